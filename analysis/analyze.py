@@ -6,42 +6,186 @@ Summary statistics for a watermark.
 """
 
 import os
+import json
 import glob
-from typing import Union
+import itertools
+from typing import Dict, Union
 
 import numpy as np
 import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
 
 from benchmark import durability
 from benchmark.image.edit import ImageEditParams
-from bench import BenchmarkEvaluation
+from benchmark.results import ResultsFormat, read_parquet_results, read_summaries
+from benchmark.summary import PartialSummary, merge_groups
+from bench import BenchmarkEvaluation, SUMMARY_EVALUATIONS
+
+
+# the columns used by the summaries
+ANALYSIS_COLUMNS = [
+    'watermark', 'dataset', 'evaluation', 'operation', 'content_id', 'content_dimensions',
+    'time_taken_ms', 'error', 'psnr', 'ssim', 'pcpa', 'edit_type', 'detected', 'decoded', 'inferred',
+]
+# per-stage timings (averaged) and memory growth (maximum), in the per-edit breakdown
+STAGE_TIME_COLUMNS = [
+    'time_taken_ms', 'cpu_time_ms', 'read_time_ms', 'bytes_to_bgr_time_ms',
+    'edit_time_ms', 'bgr_to_bytes_time_ms', 'metrics_time_ms',
+]
+STAGE_MEMORY_COLUMNS = ['rss_peak_delta_kb', 'tracemalloc_peak_kb']
+ANALYSIS_COLUMNS += [column for column in STAGE_TIME_COLUMNS + STAGE_MEMORY_COLUMNS if column not in ANALYSIS_COLUMNS]
+# the columns used by the scalability summaries
+SCALABILITY_COLUMNS = [
+    'watermark', 'dataset', 'evaluation', 'operation', 'content_id', 'content_dimensions',
+    'time_taken_ms', 'cpu_time_ms', 'error', 'concurrency', 'started_at_ms',
+]
+# columns with few distinct values, stored as categoricals
+CATEGORICAL_COLUMNS = ['watermark', 'dataset', 'evaluation', 'operation', 'content_id', 'edit_type']
+
+
+def read_results(input: Union[str, pd.DataFrame], results_format: ResultsFormat, columns=None, filter=None) -> pd.DataFrame:
+    """
+    Read raw benchmark data; a string input is a glob pattern over "watermark.dataset.evaluation" result names.
+    With the Parquet format, only the matching partitions and the given columns are read, and the filter is pushed down;
+    with JSON results, the other columns are dropped after reading.
+    """
+    if isinstance(input, str) and results_format is ResultsFormat.PARQUET:
+        return read_parquet_results(f"{os.getcwd()}/results/parquet", input, columns=columns, filter=filter)
+    elif isinstance(input, str):
+        df_files = glob.glob(f"{os.getcwd()}/results/{input}.json")
+        jsonl_files = glob.glob(f"{os.getcwd()}/results/{input}.jsonl")
+
+        dfs = []
+        for df_file in df_files:
+            dfs.append(pd.read_json(df_file))
+        for jsonl_file in jsonl_files:
+            dfs.append(pd.read_json(jsonl_file, lines=True))
+        if len(dfs) == 0:
+            raise FileNotFoundError(
+                f"No results in {os.getcwd()}/results match {input} (as watermark.dataset.evaluation)."
+            )
+        if columns is not None:
+            dfs = [df[[column for column in columns if column in df.columns]] for df in dfs]
+        return pd.concat(dfs, ignore_index=True)
+    return input
+
+
+def split_dimensions(dimensions: pd.Series) -> Dict[str, np.ndarray]:
+    """
+    Split content dimensions (shapes) into height, width and channels int arrays (0 where missing,
+    1 channel for grayscale images), without a per-row Python function.
+    """
+    lengths = dimensions.str.len().fillna(0).to_numpy(dtype=np.int64)
+    flat = np.fromiter(
+        itertools.chain.from_iterable(dimensions[lengths > 0]), dtype=np.int64, count=int(lengths.sum()),
+    )
+    offsets = np.cumsum(lengths) - lengths
+
+    columns = {}
+    for axis, column in enumerate(['height', 'width', 'channels']):
+        has_axis = lengths > axis
+        values = np.zeros(len(lengths), dtype=np.int64)
+        values[has_axis] = flat[offsets[has_axis] + axis]
+        columns[column] = values
+    columns['channels'][lengths == 2] = 1
+    return columns
+
+
+def flatten_edit_parameters(edit_parameters: pd.Series) -> pd.DataFrame:
+    """
+    Flatten edit parameters (dicts, or JSON strings from Parquet) into one typed column per parameter,
+    named "param_<name>": integer, float and boolean parameters get nullable numeric columns, and the others
+    (strings, and JSON-encoded lists) categorical columns.
+    Only the distinct parameter sets are parsed, so the cost is mostly one hash per row.
+    """
+    if len(edit_parameters) > 0 and not isinstance(edit_parameters.iloc[0], str):
+        edit_parameters = edit_parameters.map(lambda parameters: json.dumps(parameters or {}, sort_keys=True))
+    codes, uniques = pd.factorize(edit_parameters)
+    # (missing parameter sets, coded -1, get an empty set appended last, so that their columns are missing)
+    unique_parameters = [json.loads(parameters) for parameters in uniques] + [{}]
+    codes = np.where(codes < 0, len(uniques), codes)
+    names = list(dict.fromkeys(name for parameters in unique_parameters for name in parameters))
+
+    columns = {}
+    for name in names:
+        values = pd.Series([parameters.get(name) for parameters in unique_parameters], dtype=object)
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind == 'integer':
+            values = values.astype('Int64')
+        elif kind in ('floating', 'mixed-integer-float'):
+            values = values.astype('float64')
+        elif kind == 'boolean':
+            values = values.astype('boolean')
+        else:
+            values = values.map(lambda value: value if value is None or isinstance(value, str) else json.dumps(value))
+            values = values.astype('category')
+        columns[f"param_{name}"] = values.take(codes).set_axis(edit_parameters.index)
+    return pd.DataFrame(columns, index=edit_parameters.index)
 
 
 class ImageAnalysis():
     """
     Analyze raw benchmark data.
+    A string input is a glob pattern over "watermark.dataset.evaluation" result names.
+    With the Parquet format, only the matching partitions and the columns needed for the summaries are read.
+    On ingestion, the content dimensions are split into height/width/channels int columns, and the low-cardinality
+    string columns become categoricals; with edit_parameters, the edit parameters are also flattened into typed
+    "param_<name>" columns (see flatten_edit_parameters).
     """
-    def __init__(self, input: Union[str, pd.DataFrame]):
+    def __init__(
+        self,
+        input: Union[str, pd.DataFrame],
+        results_format: ResultsFormat=ResultsFormat.JSONL,
+        edit_parameters: bool=False,
+    ):
         # parsing input
-        if isinstance(input, str):
-            df_files = glob.glob(f"{os.getcwd()}/results/{input}.json")
-
-            dfs = []
-            for df_file in df_files:
-                dfs.append(pd.read_json(df_file))
-            df = pd.concat(dfs)
-        else:
-            df = input
+        df = read_results(
+            input,
+            results_format,
+            columns=ANALYSIS_COLUMNS + (['edit_parameters'] if edit_parameters else []),
+            filter=(
+                pc.match_substring(pads.field('dataset'), 'IMG') & ~pads.field('error')
+                & ~pads.field('evaluation').isin([evaluation.value for evaluation in SUMMARY_EVALUATIONS])
+            ),
+        )
         
-        # pruning dataframe
-        df = df.loc[df['dataset'].apply(lambda x: 'IMG' in x)]
-        df = df[~df['error']]
-        self.df = df
+        # pruning dataframe (scalability and reliability results are summarized separately)
+        df = self.normalize(df)
+        df = df[
+            df['dataset'].str.contains('IMG', regex=False)
+            & ~df['evaluation'].isin([evaluation.value for evaluation in SUMMARY_EVALUATIONS])
+            & ~df['error']
+        ]
+        self.df = df.reset_index(drop=True)
 
         self.summarize_per()
         self.summarize_edit()
         self.summarize_score()
-    
+
+    @staticmethod
+    def normalize(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert raw results to the typed in-memory layout of the summaries.
+        (Columns are replaced one at a time, rather than building a new frame, to avoid consolidating copies.)
+        """
+        ndf = df.drop(columns=['content_dimensions', 'edit_parameters'], errors='ignore')
+        for column in ndf.columns:
+            if column in CATEGORICAL_COLUMNS:
+                ndf[column] = ndf[column].astype('category')
+            elif column in ['error', 'detected', 'decoded', 'inferred']:
+                # (inferred failures of adaptive runs are counted as failures, and also reported apart)
+                ndf[column] = ndf[column].fillna(False).astype(bool)
+        if 'inferred' not in ndf.columns:
+            ndf['inferred'] = False
+
+        if 'content_dimensions' in df.columns:
+            for column, values in split_dimensions(df['content_dimensions']).items():
+                ndf[column] = values
+        if 'edit_parameters' in df.columns:
+            ndf = ndf.join(flatten_edit_parameters(df['edit_parameters']))
+        return ndf
+
     @staticmethod
     def get_evaluation_subset(df: pd.DataFrame, evaluation: BenchmarkEvaluation):
         return df[(df['edit_type'] != '') & (df['evaluation'] == evaluation.value)]
@@ -51,45 +195,47 @@ class ImageAnalysis():
         Get a per-(watermark, dataset, evaluation, content_id) summary, with both encoding and decoding metrics.
         """
         # encoding metrics
-        xdf = self.df[self.df['operation'] == "encode"][[
+        xdf = self.df.loc[self.df['operation'] == "encode", [
             'watermark', 'dataset', 'evaluation', 'content_id',
-            'content_dimensions', 'time_taken_ms', 'error',
+            'height', 'width', 'channels', 'time_taken_ms', 'error',
             'psnr', 'ssim', 'pcpa',
         ]]
-        def get_size(shape):
-            if len(shape) >= 2:
-                return np.round(np.sqrt(np.prod(shape[:2]))).astype(int)
-            return 0
-        xdf['content_size'] = xdf['content_dimensions'].apply(get_size)
+        xdf = xdf.assign(content_size=np.round(np.sqrt(xdf['height'] * xdf['width'])).astype(np.int64))
 
         # decoding metrics
-        ddf_all = self.df[self.df['operation'] == "decode"].copy()
-        ddf_all['total'] = 1
-        ddf_all = ddf_all[[
-            'watermark', 'dataset', 'evaluation', 'content_id',
-            'detected', 'decoded', 'total',
-        ]].groupby(['watermark', 'dataset', 'evaluation', 'content_id']).sum()
+        ddf_all = self.df.loc[self.df['operation'] == "decode", [
+            'watermark', 'dataset', 'evaluation', 'content_id', 'detected', 'decoded',
+        ]].groupby(['watermark', 'dataset', 'evaluation', 'content_id'], observed=True).agg(
+            detected=('detected', 'sum'),
+            decoded=('decoded', 'sum'),
+            total=('decoded', 'size'),
+        )
         xdf = pd.merge(xdf, ddf_all, how='left', on=['watermark', 'dataset', 'evaluation', 'content_id'])
 
         self.df_per = xdf
 
     def summarize_edit(self):
         """
-        Get a per-edit breakdown, per-(watermark, dataset, evaluation).
+        Get a per-edit breakdown, per-(watermark, dataset, evaluation), with the number of inferred failures.
+        Also includes the mean time of each stage, and the largest memory growth (for results that have them).
         """
         # preprocessing
-        ydf = self.df.copy()
-        ydf = pd.merge(ydf, self.df_per[[
+        stage_columns = [column for column in STAGE_TIME_COLUMNS + STAGE_MEMORY_COLUMNS if column in self.df.columns]
+        ydf = pd.merge(self.df[list(dict.fromkeys([
+            'watermark', 'dataset', 'evaluation', 'content_id', 'edit_type',
+            'error', 'detected', 'decoded', 'inferred', 'time_taken_ms', *stage_columns,
+        ]))], self.df_per[[
             'watermark', 'dataset', 'evaluation', 'content_id', 'content_size',
         ]], how='left', on=['watermark', 'dataset', 'evaluation', 'content_id',])
-        ydf['count'] = 1
         ydf['ntime'] = ydf['time_taken_ms'] / (256 + ydf['content_size'])
 
         # aggregating
-        ydf = ydf[[
-            'watermark', 'dataset', 'evaluation', 'edit_type',
-            'error', 'detected', 'decoded', 'count', 'ntime',
-        ]].groupby(['watermark', 'dataset', 'evaluation', 'edit_type']).sum()
+        aggregations = {column: (column, 'sum') for column in ['error', 'detected', 'decoded', 'inferred']}
+        aggregations['count'] = ('error', 'size')
+        aggregations['ntime'] = ('ntime', 'sum')
+        aggregations.update({column: (column, 'mean') for column in STAGE_TIME_COLUMNS if column in stage_columns})
+        aggregations.update({column: (column, 'max') for column in STAGE_MEMORY_COLUMNS if column in stage_columns})
+        ydf = ydf.groupby(['watermark', 'dataset', 'evaluation', 'edit_type'], observed=True).agg(**aggregations)
         ydf['ntime'] /= ydf['count']
 
         self.df_edit = ydf
@@ -99,16 +245,17 @@ class ImageAnalysis():
         Get top-line scores, per-(watermark, dataset, evaluation).
         """
         # encoding composite
-        enc_zdf = self.df_per.copy()
-        enc_zdf['enc_count'] = 1
-        enc_zdf['enc_ntime'] = enc_zdf['time_taken_ms'] / (256 + enc_zdf['content_size'])
-        enc_zdf['enc_psnr'] = enc_zdf['psnr']
-        enc_zdf['enc_ssim'] = enc_zdf['ssim']
-        enc_zdf['enc_pcpa'] = 10. / (10. + enc_zdf['pcpa'])
-
-        enc_zdf = enc_zdf[[
-            'watermark', 'dataset', 'evaluation', 'enc_count', 'enc_ntime', 'enc_psnr', 'enc_ssim', 'enc_pcpa',
-        ]].groupby(['watermark', 'dataset', 'evaluation']).sum()
+        enc_zdf = self.df_per[['watermark', 'dataset', 'evaluation', 'psnr', 'ssim']].assign(
+            enc_ntime=self.df_per['time_taken_ms'] / (256 + self.df_per['content_size']),
+            enc_pcpa=10. / (10. + self.df_per['pcpa']),
+        )
+        enc_zdf = enc_zdf.groupby(['watermark', 'dataset', 'evaluation'], observed=True).agg(
+            enc_count=('psnr', 'size'),
+            enc_ntime=('enc_ntime', 'sum'),
+            enc_psnr=('psnr', 'sum'),
+            enc_ssim=('ssim', 'sum'),
+            enc_pcpa=('enc_pcpa', 'sum'),
+        )
         enc_zdf['enc_ntime'] = enc_zdf['enc_ntime'] / enc_zdf['enc_count']
         enc_zdf['enc_psnr'] = enc_zdf['enc_psnr'] / enc_zdf['enc_count']
         enc_zdf['enc_sdsm'] = -10 * np.log(1. - enc_zdf['enc_ssim'] / enc_zdf['enc_count'])
@@ -118,9 +265,10 @@ class ImageAnalysis():
 
         # decoding composite
         dec_zdf = self.df_edit.reset_index()
-        dec_zdf = dec_zdf[dec_zdf['edit_type'] != '']
-        dec_zdf['dec_ntime'] = dec_zdf['ntime'] * dec_zdf['count']
-        dec_zdf = dec_zdf.groupby(['watermark', 'dataset', 'evaluation']).sum()
+        dec_zdf = dec_zdf.loc[dec_zdf['edit_type'] != '', ['watermark', 'dataset', 'evaluation', 'count', 'decoded']].assign(
+            dec_ntime=dec_zdf['ntime'] * dec_zdf['count'],
+        )
+        dec_zdf = dec_zdf.groupby(['watermark', 'dataset', 'evaluation'], observed=True).sum()
         dec_zdf['dec_count'] = dec_zdf['count']
         dec_zdf['dec_ntime'] = dec_zdf['dec_ntime'] / dec_zdf['count']
         dec_zdf['dec_score'] = dec_zdf['decoded'] / dec_zdf['count'] * 100
@@ -130,3 +278,156 @@ class ImageAnalysis():
         ]], how='outer', on=['watermark', 'dataset', 'evaluation'])
 
         self.df_score = zdf
+
+
+class SummaryAnalysis():
+    """
+    Top-line scores and per-edit breakdown (as in ImageAnalysis.df_score and ImageAnalysis.df_edit),
+    computed from the partial summaries persisted next to the results instead of the raw rows.
+    The input is a glob pattern over "watermark.dataset.evaluation" result names (JSON-lines or Parquet results);
+    summaries that are missing or behind their results are caught up first, reading only the rows they miss.
+    """
+    def __init__(self, input: str, results_format: ResultsFormat=ResultsFormat.JSONL):
+        # merging the partials per (watermark, dataset, evaluation)
+        summaries = {}
+        for summary in read_summaries(f"{os.getcwd()}/results", results_format, input):
+            if 'IMG' not in summary.key[1] or summary.key[2] in [evaluation.value for evaluation in SUMMARY_EVALUATIONS]:
+                continue
+            summaries.setdefault(summary.key, PartialSummary(*summary.key)).merge(summary)
+        self.summaries = summaries
+
+        self.summarize_edit()
+        self.summarize_score()
+
+    def summarize_edit(self):
+        """
+        Get a per-edit breakdown, per-(watermark, dataset, evaluation), with the number of inferred failures.
+        Also includes the mean (and standard deviation) of the time taken, the mean time of each stage,
+        and the largest memory growth.
+        """
+        rows = []
+        for key, summary in self.summaries.items():
+            for edit_type, group in summary.edit_groups().items():
+                row = dict(zip(['watermark', 'dataset', 'evaluation', 'edit_type'], (*key, edit_type)))
+                row['count'] = group['rows']
+                for column in ['detected', 'decoded', 'inferred']:
+                    row[column] = int(group.get(column, (0, 0.))[1])
+                # (as in ImageAnalysis, missing times per content size count as 0)
+                row['ntime'] = group.get('ntime', (0, 0.))[1] / group['rows']
+                for column in STAGE_TIME_COLUMNS:
+                    n, total, total_sq, _ = group.get(column, (0, np.nan, np.nan, np.nan))
+                    row[column] = total / max(n, 1)
+                    if column == 'time_taken_ms':
+                        row['time_taken_ms_std'] = np.sqrt(max(total_sq / max(n, 1) - row[column] ** 2, 0.))
+                for column in STAGE_MEMORY_COLUMNS:
+                    row[column] = group.get(column, (0, np.nan, np.nan, np.nan))[3]
+                rows.append(row)
+
+        self.df_edit = pd.DataFrame(rows).set_index(['watermark', 'dataset', 'evaluation', 'edit_type'])
+
+    def summarize_score(self):
+        """
+        Get top-line scores, per-(watermark, dataset, evaluation).
+        """
+        rows = []
+        for key, summary in self.summaries.items():
+            row = dict(zip(['watermark', 'dataset', 'evaluation'], key))
+
+            # encoding composite
+            enc_group = summary.groups.get(("encode", ''))
+            if enc_group is not None:
+                enc_count = enc_group['rows']
+                row['enc_count'] = enc_count
+                row['enc_ntime'] = enc_group.get('ntime', (0, 0.))[1] / enc_count
+                row['enc_psnr'] = enc_group.get('psnr', (0, 0.))[1] / enc_count
+                row['enc_sdsm'] = -10 * np.log(1. - enc_group.get('ssim', (0, 0.))[1] / enc_count)
+                row['enc_pcpa'] = 10. / (enc_group.get('pcpa_ratio', (0, 0.))[1] / enc_count) - 10.
+
+            # decoding composite
+            dec_group = merge_groups([group for (_, edit_type), group in summary.groups.items() if edit_type != ''])
+            if dec_group['rows'] > 0:
+                row['dec_count'] = dec_group['rows']
+                row['dec_ntime'] = dec_group.get('ntime', (0, 0.))[1] / dec_group['rows']
+                row['dec_score'] = dec_group.get('decoded', (0, 0.))[1] / dec_group['rows'] * 100
+            rows.append(row)
+
+        self.df_score = pd.DataFrame(rows, columns=[
+            'watermark', 'dataset', 'evaluation',
+            'enc_count', 'enc_ntime', 'enc_psnr', 'enc_sdsm', 'enc_pcpa', 'dec_count', 'dec_ntime', 'dec_score',
+        ]).set_index(['watermark', 'dataset', 'evaluation'])
+
+
+class ScalabilityAnalysis():
+    """
+    Analyze IMG_SCALABILITY benchmark data: throughput, latency percentiles and per-megapixel cost
+    per (resolution, concurrency) level, and the scaling exponent of the latency with the image size.
+    Inputs are as for ImageAnalysis.
+    """
+    def __init__(self, input: Union[str, pd.DataFrame], results_format: ResultsFormat=ResultsFormat.JSONL):
+        # parsing input
+        df = read_results(
+            input,
+            results_format,
+            columns=SCALABILITY_COLUMNS,
+            filter=((pads.field('evaluation') == BenchmarkEvaluation.IMG_SCALABILITY.value) & ~pads.field('error')),
+        )
+
+        # pruning dataframe
+        df = df[(df['evaluation'] == BenchmarkEvaluation.IMG_SCALABILITY.value) & ~df['error']].reset_index(drop=True)
+        df = df.assign(**split_dimensions(df['content_dimensions'])).drop(columns=['content_dimensions'])
+        df['megapixels'] = df['height'] * df['width'] / 1e6
+        self.df = df
+
+        self.summarize_levels()
+        self.summarize_exponent()
+
+    def summarize_levels(self):
+        """
+        Get a per-(watermark, dataset, height, width, concurrency, operation) summary.
+        Throughput is the number of (encode + decode) images completed per second of the level's wall-clock span;
+        latencies are per wrapper call.
+        """
+        level_keys = ['watermark', 'dataset', 'height', 'width', 'concurrency']
+
+        # throughput
+        tdf = self.df.copy()
+        tdf['ended_at_ms'] = tdf['started_at_ms'] + tdf['time_taken_ms']
+        tdf['images'] = (tdf['operation'] == "encode").astype(int)
+        tdf = tdf.groupby(level_keys).agg(
+            started_at_ms=('started_at_ms', 'min'),
+            ended_at_ms=('ended_at_ms', 'max'),
+            images=('images', 'sum'),
+        )
+        tdf['images_per_s'] = tdf['images'] / (tdf['ended_at_ms'] - tdf['started_at_ms']) * 1000.
+
+        # latency
+        ldf_groups = self.df.groupby(level_keys + ['operation'])
+        ldf = ldf_groups.agg(
+            megapixels=('megapixels', 'first'),
+            count=('time_taken_ms', 'size'),
+            mean_ms=('time_taken_ms', 'mean'),
+            p50_ms=('time_taken_ms', lambda x: x.quantile(0.50)),
+            p95_ms=('time_taken_ms', lambda x: x.quantile(0.95)),
+            p99_ms=('time_taken_ms', lambda x: x.quantile(0.99)),
+            cpu_time_ms=('cpu_time_ms', 'mean'),
+        )
+        ldf['ms_per_mp'] = ldf['mean_ms'] / ldf['megapixels']
+
+        self.df_levels = ldf.join(tdf[['images_per_s']], on=level_keys)
+
+    def summarize_exponent(self):
+        """
+        Get the scaling exponent b of the median latency with the image size (latency ~ megapixels^b),
+        per-(watermark, dataset, operation), fitted in log-log space at the lowest concurrency level.
+        """
+        ldf = self.df_levels.reset_index()
+        ldf = ldf[ldf['concurrency'] == ldf['concurrency'].min()]
+
+        def fit_exponent(group):
+            if len(group) < 2:
+                return np.nan
+            return np.polyfit(np.log(group['megapixels']), np.log(group['p50_ms']), 1)[0]
+
+        self.df_exponent = ldf.groupby(['watermark', 'dataset', 'operation'])[['megapixels', 'p50_ms']].apply(
+            fit_exponent
+        ).rename('exponent').to_frame()
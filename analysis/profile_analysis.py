@@ -0,0 +1,86 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Time and memory of ImageAnalysis on a large synthetic frame (run from the repository root):
+
+    python -m analysis.profile_analysis --images 50000
+
+The frame repeats the rows of one image (an encode row, and a decode row per edit of the full robustness suite,
+with their real edit parameters, as read back from the results) over many images, with random metrics.
+To compare with another version of analysis/analyze.py (e.g. before a change), run this script from that tree.
+"""
+
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from analysis.analyze import ImageAnalysis
+from benchmark import durability
+from benchmark.evaluate import IMAGE_RESULTS
+from benchmark.results import to_jsonable
+
+
+def image_rows() -> list:
+    """
+    The rows of one image: an encode row, and the decode rows of the full robustness suite.
+    """
+    image_bgr = np.random.default_rng(0).integers(0, 256, (512, 512, 3), dtype=np.uint8)
+    rows = [dict(IMAGE_RESULTS, operation="encode", content_format="image/png", psnr=40., ssim=0.98, pcpa=5.)]
+    for edit in durability.image_edits(durability.ImageRobustnessTests.V1_FULL):
+        for edit_parameters, _ in edit.generate(image_bgr):
+            rows.append(dict(
+                IMAGE_RESULTS,
+                operation="decode",
+                content_format="image",
+                edit_type=type(edit).__name__,
+                edit_parameters=to_jsonable(edit_parameters),
+            ))
+    return rows
+
+
+def synthetic_frame(images: int, seed: int=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    template = image_rows()
+    df = pd.DataFrame(template * images)
+    n = len(df)
+    df['watermark'] = "SYNTHETIC"
+    df['dataset'] = "IMG_1"
+    df['evaluation'] = "IMG_ROBUSTNESS"
+    df['content_id'] = np.repeat([f"im{k}" for k in range(images)], len(template))
+    sides = np.repeat(rng.integers(256, 2048, size=(images, 2)), len(template), axis=0)
+    df['content_dimensions'] = [[h, w, 3] for h, w in sides.tolist()]
+    df['time_taken_ms'] = rng.exponential(20., n)
+    df['detected'] = rng.random(n) < 0.9
+    df['decoded'] = df['detected'] & (rng.random(n) < 0.8)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time ImageAnalysis on a synthetic frame.")
+    parser.add_argument('--images', type=int, default=5000, help="(default: %(default)s)")
+    parser.add_argument('--no-parameters', action='store_true', help="without the edit parameters column")
+    args = parser.parse_args(argv)
+
+    df = synthetic_frame(args.images)
+    if args.no_parameters:
+        df = df.drop(columns=['edit_parameters'])
+    print(f"{len(df)} rows ({args.images} images x {len(df) // args.images} rows).")
+
+    t = time.perf_counter()
+    analysis = ImageAnalysis(df)
+    elapsed = time.perf_counter() - t
+    print(f"ImageAnalysis: {elapsed:.2f} s, {analysis.df.memory_usage(deep=True).sum() / 2 ** 20:.0f} MiB for self.df.")
+
+    tracemalloc.start()
+    ImageAnalysis(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Peak memory allocated (tracemalloc): {peak / 2 ** 20:.0f} MiB.")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,26 @@ Main file for running benchmark tests.
 import os
 import glob
 import enum
+import fnmatch
 import logging
-
-import pandas as pd
-import cv2
+import argparse
+import importlib
+import tracemalloc
+from typing import List
 
 from wrappers.wrapper import ImageWrapper
+from benchmark import cache
 from benchmark import durability
 from benchmark import evaluate
+from benchmark import frames
+from benchmark import invisibility
+from benchmark import manifest
+from benchmark import matrix
+from benchmark import parallel
+from benchmark import reliability
+from benchmark import results
+from benchmark import sampling
+from benchmark import scalability
 
 
 class BenchmarkDataset(enum.Enum):
@@ -51,6 +63,10 @@ class BenchmarkEvaluation(enum.Enum):
     IMG_ROBUSTNESS = 'IMG_ROBUSTNESS'
     # abridged suite of 12 robustness tests per image
     IMG_ROBUSTNESS_Q = 'IMG_ROBUSTNESS_Q'
+    # throughput and latency across a resolution ladder and concurrency levels
+    IMG_SCALABILITY = 'IMG_SCALABILITY'
+    # false-positive rate bound, with sequential stopping
+    IMG_RELIABILITY = 'IMG_RELIABILITY'
 
 DEFAULT_EVALUATION = BenchmarkEvaluation.IMG_SIMPLE
 
@@ -59,8 +75,24 @@ EVALUATION_MODES = {
     BenchmarkEvaluation.IMG_NEGATIVE: durability.ImageRobustnessTests.V1_BASIC,
     BenchmarkEvaluation.IMG_ROBUSTNESS: durability.ImageRobustnessTests.V1_FULL,
     BenchmarkEvaluation.IMG_ROBUSTNESS_Q: durability.ImageRobustnessTests.V1_QUICK,
+    BenchmarkEvaluation.IMG_SCALABILITY: scalability.ImageScalabilityTests.V1_FULL,
+    BenchmarkEvaluation.IMG_RELIABILITY: reliability.ImageReliabilityTests.V1_FULL,
 }
 
+# evaluation modes whose results are summaries over the whole run, which cannot be resumed
+SUMMARY_EVALUATIONS = [BenchmarkEvaluation.IMG_SCALABILITY, BenchmarkEvaluation.IMG_RELIABILITY]
+
+
+def dataset_filepaths(dataset: BenchmarkDataset) -> List[str]:
+    """
+    Get the (sorted) image files of a dataset, from its manifest if current, or by globbing the dataset directory.
+    """
+    pattern = f"{os.getcwd()}/dataset/{DATASET_FILES[dataset]}"
+    dataset_manifest = manifest.find_manifest(os.path.dirname(pattern))
+    if dataset_manifest is not None and dataset_manifest.is_current():
+        return [filepath for filepath in dataset_manifest.filepaths() if fnmatch.fnmatch(filepath, pattern)]
+    return sorted(glob.glob(pattern))
+
 
 def simple_logging_setup():
     logging.basicConfig()
@@ -76,55 +108,468 @@ def benchmark(
     evaluation: BenchmarkEvaluation=DEFAULT_EVALUATION,
     override: bool=False,
     debug_mode: bool=False,
+    workers: int=1,
+    resume: bool=False,
+    results_format: results.ResultsFormat=results.ResultsFormat.JSONL,
+    encode_cache: cache.EncodeCache=None,
+    edit_cache: cache.EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    trace_memory: bool=False,
+    early_stop: int=None,
+    sampling_target: sampling.SamplingTarget=None,
+    sampling_seed: int=0,
+    results_dir: str=None,
+    dry_run: bool=False,
+    fpr: float=None,
+    confidence: float=None,
 ):
     """
     Run the benchmark evaluation on a single watermark. 
+    With workers > 1, images are evaluated across a process pool (each worker builds its own wrapper);
+    the results are merged back in the same (sorted) image order as a serial run.
+    Results are appended to a JSON-lines file (or a partitioned Parquet store) as each image completes;
+    with resume, the images already in existing results are skipped.
+    An encode cache lets evaluation modes on the same wrapper + dataset share a single encoding per image,
+    and an edit cache lets IMG_NEGATIVE runs of different wrappers share the same edited images.
+    With batch_size > 1, images (and edited images) of the same shape are passed to the wrapper in batches,
+    holding at most about batch_bytes of pending images.
+    The invisibility metrics of images too large for metrics_max_bytes (per image) are computed over tiles;
+    metrics_backend selects the PSNR/SSIM implementation (CV2 is much faster on large datasets).
+    The wrapper is set up once (per worker), and its setup time is logged apart from the per-call times.
+    Each row has per-stage timings, CPU time and peak memory growth; trace_memory also records the peak
+    memory allocated during the wrapper calls (with tracemalloc, which slows down Python allocations).
+    With early_stop (adaptive mode), each severity-ordered edit family (e.g. JPEG quality levels) stops after
+    early_stop consecutive failures to decode, and the rest of the family is recorded as inferred failures.
+    With a sampling target, images are evaluated in a randomized order stratified by format and size, and the run
+    stops once the intervals (over images) of dec_score and of each edit type's success rate are narrow enough;
+    the achieved intervals and the number of images saved are logged (and returned).
+    IMG_SCALABILITY runs its own pools (one per concurrency level) and cannot be resumed.
+    IMG_RELIABILITY streams false-positive trials across the workers until its sequential test decides,
+    and writes one summary row per trial kind (it cannot be resumed either); fpr and confidence set the
+    false-positive rate bound it tests and its confidence level (by default, those of its evaluation mode).
+    Results go under results_dir (results/ in the working directory, by default);
+    a dry run only logs the images that would be evaluated and where the results would go.
     """
     if wrapper_class.TYPE == ImageWrapper.TYPE:
         assert 'IMG' in dataset.value
         assert 'IMG' in evaluation.value
         image_wrapper = wrapper_class()
 
-        out_filepath = f"{os.getcwd()}/results/{image_wrapper.name}.{dataset.value}.{evaluation.value}.json"
-        if not override and os.path.exists(out_filepath):
+        run_name = f"{image_wrapper.name}.{dataset.value}.{evaluation.value}"
+        out_filepath = results.results_path(
+            results_format, results_dir or f"{os.getcwd()}/results", image_wrapper.name, dataset.value, evaluation.value,
+        )
+        if not override and not resume and os.path.exists(out_filepath):
+            logging.info((
+                f"The results file {run_name} already exists. "
+                "If you would like to override the file, please set the override argument to True, "
+                "or to complete a partial run, set the resume argument to True."
+            ))
+            return
+
+        image_filepaths = dataset_filepaths(dataset)
+
+        if resume and evaluation in SUMMARY_EVALUATIONS:
+            logging.warning(f"{run_name} cannot be resumed, and is run again from the start.")
+            resume, override = False, True
+
+        sampled = sampling_target is not None and evaluation not in SUMMARY_EVALUATIONS
+        if dry_run:
+            # (before stratifying, which reads every image)
             logging.info((
-                f"The results file {image_wrapper.name}.{dataset.value}.{evaluation.value} already exists. "
-                "If you would like to override the file, please set the override argument to True."
+                f"Dry run: {run_name} would run on {'at most ' if sampled else ''}{len(image_filepaths)} images, "
+                f"with results in {out_filepath}."
             ))
             return
 
-        image_filepaths = glob.glob(f"{os.getcwd()}/dataset/{DATASET_FILES[dataset]}")
-        logging.info(f"Running {image_wrapper.name}.{dataset.value}.{evaluation.value} on {len(image_filepaths)} images.")
+        tracker = None
+        if sampled:
+            image_filepaths = sampling.stratified_order(image_filepaths, random_seed=sampling_seed)
+            tracker = sampling.IntervalTracker(sampling_target)
+
+        sink = results.open_sink(results_format, out_filepath, resume=(resume and not override))
+        if len(sink.done) > 0:
+            if tracker is not None:
+                logging.warning("The sampling intervals only cover the images evaluated from now on.")
+            image_filepaths = [fp for fp in image_filepaths if evaluate.get_image_name(fp) not in sink.done]
+            logging.info(f"Resuming {run_name}: {len(sink.done)} images were already completed.")
+        logging.info(f"Running {run_name} on {len(image_filepaths)} images.")
 
-        # [TODO] multiprocessing speedup
-        results = []
-        for image_filepath in image_filepaths:
-            results.extend(evaluate.evaluate_image(
-                image_filepath,
+        in_process = False
+        if evaluation is BenchmarkEvaluation.IMG_SCALABILITY:
+            image_results = scalability.evaluate_scalability(
+                wrapper_class,
+                image_filepaths,
+                EVALUATION_MODES[evaluation],
+            )
+        elif evaluation is BenchmarkEvaluation.IMG_RELIABILITY:
+            image_results = reliability.evaluate_reliability(
+                wrapper_class,
+                image_filepaths,
+                EVALUATION_MODES[evaluation],
+                workers=workers,
+                batch_size=batch_size,
+                batch_bytes=batch_bytes,
+                fpr=fpr,
+                confidence=confidence,
+            )
+        elif workers > 1 and not debug_mode:
+            image_results = parallel.evaluate_images(
+                wrapper_class,
+                image_filepaths,
+                EVALUATION_MODES[evaluation],
+                encode=('NEG' not in evaluation.value),
+                workers=workers,
+                encode_cache=encode_cache,
+                edit_cache=edit_cache,
+                batch_size=batch_size,
+                batch_bytes=batch_bytes,
+                metrics_max_bytes=metrics_max_bytes,
+                metrics_backend=metrics_backend,
+                trace_memory=trace_memory,
+                early_stop=early_stop,
+            )
+        else:
+            in_process = True
+            if trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            evaluate.setup_wrapper(image_wrapper)
+            image_results = parallel.evaluate_images_safe(
+                image_filepaths,
                 image_wrapper,
                 EVALUATION_MODES[evaluation],
                 encode=('NEG' not in evaluation.value),
                 debug_mode=debug_mode,
+                encode_cache=encode_cache,
+                edit_cache=edit_cache,
+                batch_size=batch_size,
+                batch_bytes=batch_bytes,
+                metrics_max_bytes=metrics_max_bytes,
+                metrics_backend=metrics_backend,
+                early_stop=early_stop,
+            )
+
+        # results are streamed to disk, one image at a time
+        try:
+            for image_result in image_results:
+                for result in image_result:
+                    result['watermark'] = image_wrapper.name
+                    result['dataset'] = dataset.value
+                    result['evaluation'] = evaluation.value
+                sink.write(image_result)
+                if tracker is not None:
+                    tracker.update(image_result)
+                    if tracker.is_met():
+                        break
+        finally:
+            # (stops the workers early, if sampling is done)
+            image_results.close()
+            sink.close()
+            if in_process:
+                image_wrapper.teardown()
+                if trace_memory:
+                    tracemalloc.stop()
+
+        for cache_name, image_cache in [('Encode', encode_cache), ('Edit', edit_cache)]:
+            if image_cache is not None and evaluation not in SUMMARY_EVALUATIONS:
+                logging.info(f"{cache_name} cache statistics: {image_cache.stats()}.")
+
+        if tracker is not None:
+            intervals = tracker.intervals()
+            for metric, (rate, low, high) in intervals.items():
+                logging.info(f"{metric}: {100 * rate:.1f}% [{100 * low:.1f}%, {100 * high:.1f}%].")
+            logging.info((
+                f"Sampling {'met' if tracker.is_met() else 'did not meet'} the target of "
+                f"±{100 * sampling_target.half_width:g}% at {100 * sampling_target.confidence:g}% confidence "
+                f"after {tracker.images} images, saving {len(image_filepaths) - tracker.images} images."
             ))
+            return {
+                'images' : tracker.images,
+                'images_saved' : len(image_filepaths) - tracker.images,
+                'intervals' : intervals,
+            }
 
-        if len(results) > 0:
-            results = pd.DataFrame.from_dict(results)
-            results['watermark'] = image_wrapper.name
-            results['dataset'] = dataset.value
-            results['evaluation'] = evaluation.value
-            results.to_json(out_filepath)
-    
     # [TODO] currently, only image functionality is supported
     else:
         raise NotImplementedError
 
 
-def main():
-    # [TODO] command line support: sys.argv -> (wrapper, mode)
+def benchmark_matrix(
+    wrapper_classes: list,
+    dataset: BenchmarkDataset=DEFAULT_DATASET,
+    evaluations: list=(DEFAULT_EVALUATION,),
+    override: bool=False,
+    workers: int=1,
+    resume: bool=False,
+    results_format: results.ResultsFormat=results.ResultsFormat.JSONL,
+    encode_cache: cache.EncodeCache=None,
+    edit_cache: cache.EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    trace_memory: bool=False,
+    early_stop: int=None,
+    results_dir: str=None,
+    dry_run: bool=False,
+):
+    """
+    Run the benchmark evaluation on every (wrapper, evaluation) combination, in a single pass over the dataset.
+    Each image is read once, encoded once per wrapper, and each edited image is generated once per source
+    (the original image, shared by the IMG_NEGATIVE runs, or a wrapper's watermarked image, shared by its
+    evaluation modes), then decoded by every combination that uses it.
+    The results of each combination go to their own file, the same as with separate benchmark runs
+    (see benchmark for the other arguments); IMG_SCALABILITY and IMG_RELIABILITY are not supported.
+    """
+    assert 'IMG' in dataset.value
+    for evaluation in evaluations:
+        assert 'IMG' in evaluation.value
+        assert evaluation not in SUMMARY_EVALUATIONS, f"{evaluation.value} cannot run in a matrix."
+    for wrapper_class in wrapper_classes:
+        assert wrapper_class.TYPE == ImageWrapper.TYPE
+    wrapper_names = [wrapper_class().name for wrapper_class in wrapper_classes]
+
+    image_filepaths = dataset_filepaths(dataset)
+
+    runs, run_names, out_filepaths = [], [], []
+    for w, wrapper_name in enumerate(wrapper_names):
+        for evaluation in evaluations:
+            run_name = f"{wrapper_name}.{dataset.value}.{evaluation.value}"
+            out_filepath = results.results_path(
+                results_format, results_dir or f"{os.getcwd()}/results", wrapper_name, dataset.value, evaluation.value,
+            )
+            if not override and not resume and os.path.exists(out_filepath):
+                logging.info((
+                    f"The results file {run_name} already exists, and is skipped. "
+                    "If you would like to override the file, please set the override argument to True, "
+                    "or to complete a partial run, set the resume argument to True."
+                ))
+                continue
+            runs.append(matrix.MatrixRun(w, EVALUATION_MODES[evaluation], ('NEG' not in evaluation.value)))
+            run_names.append((wrapper_name, evaluation))
+            out_filepaths.append(out_filepath)
+    if len(runs) == 0:
+        return
+
+    if dry_run:
+        for (wrapper_name, evaluation), out_filepath in zip(run_names, out_filepaths):
+            logging.info((
+                f"Dry run: {wrapper_name}.{dataset.value}.{evaluation.value} would run on "
+                f"{len(image_filepaths)} images, with results in {out_filepath}."
+            ))
+        return
+
+    sinks = []
+    try:
+        for (wrapper_name, evaluation), out_filepath in zip(run_names, out_filepaths):
+            sink = results.open_sink(results_format, out_filepath, resume=(resume and not override))
+            if len(sink.done) > 0:
+                logging.info(f"Resuming {wrapper_name}.{dataset.value}.{evaluation.value}: {len(sink.done)} images were already completed.")
+            sinks.append(sink)
+        logging.info(f"Running {len(runs)} combinations on {len(image_filepaths)} images.")
+
+        if trace_memory and workers <= 1 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        image_results = matrix.evaluate_matrix(
+            wrapper_classes,
+            image_filepaths,
+            runs,
+            done=[sink.done for sink in sinks],
+            workers=workers,
+            encode_cache=encode_cache,
+            edit_cache=edit_cache,
+            batch_size=batch_size,
+            batch_bytes=batch_bytes,
+            metrics_max_bytes=metrics_max_bytes,
+            metrics_backend=metrics_backend,
+            trace_memory=trace_memory,
+            early_stop=early_stop,
+        )
+
+        # results are streamed to disk, one image at a time (per combination)
+        try:
+            for run_results in image_results:
+                for (wrapper_name, evaluation), sink, image_result in zip(run_names, sinks, run_results):
+                    if len(image_result) == 0:
+                        continue
+                    for result in image_result:
+                        result['watermark'] = wrapper_name
+                        result['dataset'] = dataset.value
+                        result['evaluation'] = evaluation.value
+                    sink.write(image_result)
+        finally:
+            image_results.close()
+            if trace_memory and workers <= 1:
+                tracemalloc.stop()
+    finally:
+        for sink in sinks:
+            sink.close()
+
+    for cache_name, image_cache in [('Encode', encode_cache), ('Edit', edit_cache)]:
+        if image_cache is not None:
+            logging.info(f"{cache_name} cache statistics: {image_cache.stats()}.")
+
+
+def prepare_dataset(dataset: BenchmarkDataset=DEFAULT_DATASET, workers: int=1, decode_frames: bool=True):
+    """
+    Prepare a dataset for the benchmark runs, updating only what changed since the last preparation:
+    decode its images once, into raw BGR frames next to the original files (see frames.FrameStore), which the runs
+    then map instead of decoding each image (unless decode_frames is False); and build its manifest
+    (see manifest.DatasetManifest), which lists the images with their content hashes (from which the payload seeds
+    are derived) and dimensions, without globbing or hashing them again.
+    """
+    image_filepaths = sorted(glob.glob(f"{os.getcwd()}/dataset/{DATASET_FILES[dataset]}"))
+    directories = sorted({os.path.dirname(filepath) for filepath in image_filepaths})
+    for directory in directories:
+        directory_filepaths = [filepath for filepath in image_filepaths if os.path.dirname(filepath) == directory]
+        if decode_frames:
+            stats = frames.FrameStore(directory).prepare(directory_filepaths, workers=workers)
+            logging.info((
+                f"Prepared {stats['images']} frames of {dataset.value} in {directory} ({stats['bytes'] / 2 ** 20:.1f} MiB): "
+                f"{stats['decoded']} decoded, {stats['removed']} stale frames removed."
+            ))
+        # (after the frames, which it reads the dimensions from, and which change the directory's modification time)
+        dataset_manifest = manifest.DatasetManifest.build(directory, directory_filepaths, workers=workers)
+        dataset_manifest.save()
+        logging.info(f"Saved the manifest of {dataset.value} ({len(dataset_manifest.entries)} images) at {manifest.manifest_path(directory)}.")
+    frames.find_store.cache_clear()
+    manifest.find_manifest.cache_clear()
+
+
+def load_wrapper(path: str):
+    """
+    Get a wrapper class from its dotted path (e.g. wrappers.ref_wrapper.DDWrapper, or wrappers.ref_wrapper:DDWrapper).
+    """
+    module_name, _, class_name = path.replace(':', '.').rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=(
+        "Run the benchmark evaluation on a watermark "
+        "(or on every combination of several watermarks and evaluations, in a single pass over the dataset)."
+    ))
+    parser.add_argument(
+        'wrapper', nargs='*', default=["wrappers.ref_wrapper.DDWrapper"],
+        help="dotted paths of the wrapper classes (default: wrappers.ref_wrapper.DDWrapper)",
+    )
+    parser.add_argument(
+        '--dataset', default=DEFAULT_DATASET.name,
+        choices=[dataset.name for dataset in DATASET_FILES],
+        help="(default: %(default)s)",
+    )
+    parser.add_argument(
+        '--evaluation', nargs='+', default=[DEFAULT_EVALUATION.name],
+        choices=[evaluation.name for evaluation in EVALUATION_MODES],
+        help=f"one or more evaluations (default: {DEFAULT_EVALUATION.name})",
+    )
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (default: %(default)s)")
+    parser.add_argument('--output', default=None, help="results directory (default: results/)")
+    parser.add_argument(
+        '--results-format', default=results.ResultsFormat.JSONL.value,
+        choices=[results_format.value for results_format in results.ResultsFormat],
+        help="(default: %(default)s)",
+    )
+    parser.add_argument('--batch-size', type=int, default=1, help="images per wrapper call (default: %(default)s)")
+    parser.add_argument('--encode-cache', default=None, help="directory of a cache of the encoded images")
+    parser.add_argument('--edit-cache', default=None, help="directory of a cache of the edited images")
+    parser.add_argument(
+        '--cache-max-mb', type=int, default=4096,
+        help="size limit of each cache, in MiB (default: %(default)s)",
+    )
+    parser.add_argument(
+        '--metrics-backend', default=invisibility.DEFAULT_METRICS_BACKEND.value,
+        choices=[backend.value for backend in invisibility.MetricsBackend],
+        help="PSNR/SSIM implementation (default: %(default)s)",
+    )
+    parser.add_argument(
+        '--early-stop', type=int, default=None,
+        help="stop each severity-ordered edit family after this many consecutive failures",
+    )
+    parser.add_argument(
+        '--fpr', type=float, default=None,
+        help="IMG_RELIABILITY: false-positive rate bound to test (default: 1e-6)",
+    )
+    parser.add_argument(
+        '--confidence', type=float, default=None,
+        help="IMG_RELIABILITY: confidence level of the decision (default: 0.99)",
+    )
+    parser.add_argument('--override', action='store_true', help="override existing results")
+    parser.add_argument('--resume', action='store_true', help="complete a partial run")
+    parser.add_argument('--debug', action='store_true', help="serial run, displaying the images (needs IPython)")
+    parser.add_argument('--dry-run', action='store_true', help="only list what would be run")
+    parser.add_argument(
+        '--prepare', action='store_true',
+        help="only prepare the dataset: build its manifest, and decode its images into memory-mapped frames",
+    )
+    parser.add_argument('--no-frames', action='store_true', help="with --prepare, only build the manifest")
+    args = parser.parse_args(argv)
+    if args.debug and (len(args.wrapper) > 1 or len(args.evaluation) > 1):
+        parser.error("--debug runs a single wrapper and evaluation.")
+    is_reliability = args.evaluation == [BenchmarkEvaluation.IMG_RELIABILITY.name]
+    if (args.fpr is not None or args.confidence is not None) and not is_reliability:
+        parser.error("--fpr and --confidence only apply to a single IMG_RELIABILITY evaluation.")
+    if args.fpr is not None and not 0. < args.fpr < 1.:
+        parser.error("--fpr must be in (0, 1).")
+    if args.confidence is not None and not 0.5 < args.confidence < 1.:
+        parser.error("--confidence must be in (0.5, 1).")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
 
     simple_logging_setup()
-    from wrappers.ref_wrapper import DDWrapper
-    benchmark(DDWrapper)
+    if args.prepare:
+        prepare_dataset(BenchmarkDataset[args.dataset], workers=args.workers, decode_frames=not args.no_frames)
+        return
+
+    wrapper_classes = [load_wrapper(wrapper) for wrapper in args.wrapper]
+    evaluations = [BenchmarkEvaluation[evaluation] for evaluation in args.evaluation]
+    max_bytes = args.cache_max_mb * 2 ** 20
+    encode_cache = cache.EncodeCache(args.encode_cache, max_bytes=max_bytes) if args.encode_cache else None
+    edit_cache = cache.EditCache(args.edit_cache, max_bytes=max_bytes) if args.edit_cache else None
+    if len(wrapper_classes) > 1 or len(evaluations) > 1:
+        benchmark_matrix(
+            wrapper_classes,
+            dataset=BenchmarkDataset[args.dataset],
+            evaluations=evaluations,
+            override=args.override,
+            workers=args.workers,
+            resume=args.resume,
+            results_format=results.ResultsFormat(args.results_format),
+            encode_cache=encode_cache,
+            edit_cache=edit_cache,
+            batch_size=args.batch_size,
+            metrics_backend=invisibility.MetricsBackend(args.metrics_backend),
+            early_stop=args.early_stop,
+            results_dir=args.output,
+            dry_run=args.dry_run,
+        )
+        return
+
+    benchmark(
+        wrapper_classes[0],
+        dataset=BenchmarkDataset[args.dataset],
+        evaluation=evaluations[0],
+        override=args.override,
+        debug_mode=args.debug,
+        workers=args.workers,
+        resume=args.resume,
+        results_format=results.ResultsFormat(args.results_format),
+        encode_cache=encode_cache,
+        edit_cache=edit_cache,
+        batch_size=args.batch_size,
+        metrics_backend=invisibility.MetricsBackend(args.metrics_backend),
+        early_stop=args.early_stop,
+        results_dir=args.output,
+        dry_run=args.dry_run,
+        fpr=args.fpr,
+        confidence=args.confidence,
+    )
 
 if __name__ == "__main__":
     main()
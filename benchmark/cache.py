@@ -0,0 +1,294 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+On-disk caches, shared across runs and worker processes.
+"""
+
+import io
+import os
+import json
+import uuid
+import hashlib
+import logging
+import functools
+import collections
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+# (loads every edit class, for edits_fingerprint)
+from benchmark import durability
+from benchmark.image.edit import ImageEdit
+from benchmark.results import to_jsonable
+
+
+class DiskCache():
+    """
+    Size-bounded key-value store in a directory, with LRU eviction.
+    Each entry is a file named by its key, whose modification time is refreshed on every hit;
+    once the directory grows past max_bytes, the least recently used entries are removed.
+    Writes are atomic (temporary file + rename), so the directory can be shared by concurrent processes.
+    Each process only counts its own writes, so the size is measured on disk again after every resync_fraction
+    of max_bytes written (bounding the overshoot with N processes to about N * resync_fraction * max_bytes).
+    """
+    def __init__(self, directory: str, max_bytes: int=2 ** 32, resync_fraction: float=0.05):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.resync_fraction = resync_fraction
+        self.hits = 0
+        self.misses = 0
+        self.size = None
+        self.written = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256('\0'.join(map(str, parts)).encode()).hexdigest()
+
+    def get(self, key: str) -> Union[None, bytes]:
+        filepath = f"{self.directory}/{key}"
+        try:
+            with open(filepath, 'rb') as entry_file:
+                value = entry_file.read()
+            os.utime(filepath)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        filepath = f"{self.directory}/{key}"
+        try:
+            # (a replaced entry no longer counts)
+            old_size = os.path.getsize(filepath)
+        except FileNotFoundError:
+            old_size = 0
+        tmp_filepath = f"{self.directory}/.{key}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filepath, 'wb') as entry_file:
+            entry_file.write(value)
+        os.replace(tmp_filepath, filepath)
+
+        self.written += len(value)
+        if self.size is None or self.written > self.resync_fraction * self.max_bytes:
+            # (other processes sharing the directory write to it too)
+            self.size = self.disk_size()
+            self.written = 0
+        else:
+            self.size += len(value) - old_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def disk_size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries, down to 90% of the size limit.
+        """
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        self.written = 0
+        for _, size, filepath in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+        logging.info(f"Evicted cache entries in {self.directory}, down to {self.size} bytes.")
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits' : self.hits, 'misses' : self.misses}
+
+    def take_stats(self) -> Dict[str, int]:
+        # (a worker process reports its counts since the previous call, which the coordinator sums with add_stats)
+        stats = self.stats()
+        self.hits, self.misses = 0, 0
+        return stats
+
+    def add_stats(self, stats: Dict[str, int]):
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+
+
+class EncodeCache(DiskCache):
+    """
+    Cache of watermarked images, keyed by (wrapper name + version, image content hash, payload bits).
+    An entry holds the encoded image bytes, along with the encoding time and invisibility metrics.
+    """
+    @staticmethod
+    def encode_key(wrapper, image_bytes: bytes, payload_bits: np.ndarray) -> str:
+        return DiskCache.make_key(
+            'encode',
+            wrapper.name,
+            wrapper.version,
+            hashlib.sha256(image_bytes).hexdigest(),
+            np.packbits(payload_bits).tobytes().hex(),
+            len(payload_bits),
+        )
+
+    def get_encoding(self, key: str) -> Union[None, Tuple[bytes, dict]]:
+        value = self.get(key)
+        if value is None:
+            return None
+        header, enc_image_bytes = value.split(b'\n', 1)
+        return enc_image_bytes, json.loads(header)
+
+    def put_encoding(self, key: str, enc_image_bytes: bytes, metrics: dict):
+        header = json.dumps({k : (v.item() if isinstance(v, np.generic) else v) for k, v in metrics.items()}).encode()
+        self.put(key, header + b'\n' + enc_image_bytes)
+
+
+@functools.lru_cache(maxsize=None)
+def edits_fingerprint() -> str:
+    """
+    Hash of the constants (upper-case class attributes, e.g. JPEG_QUALITY_LEVELS or ANGLES) of every edit class,
+    so that edited images are no longer served once the parameters of an edit change
+    (composite edits apply other edits as steps, so all of them count).
+    """
+    constants, edit_classes = {}, [ImageEdit]
+    while len(edit_classes) > 0:
+        edit_class = edit_classes.pop()
+        edit_classes.extend(edit_class.__subclasses__())
+        constants[edit_class.__name__] = {
+            name : value for name, value in vars(edit_class).items()
+            if name.isupper() and isinstance(value, (int, float, str, list, tuple))
+        }
+    return hashlib.sha256(repr(sorted(constants.items())).encode()).hexdigest()
+
+
+class EditCache(DiskCache):
+    """
+    Cache of edited (attacked) images, keyed by (image content hash, edit class, edit index, random seed, parameters).
+    An entry holds the edit parameters and the edited image, as prepared for decoding (bytes, or arrays if lossless):
+    a JSON header, followed by the images as an .npz archive (read without pickle, since the directory is shared).
+    Without watermarking (IMG_NEGATIVE), the edited images do not depend on the wrapper, so they are shared by all wrappers.
+    """
+    @staticmethod
+    def edit_key(image_hash: str, edit: ImageEdit, image_shape: Tuple[int, ...], as_array: bool=False) -> str:
+        try:
+            parameters = edit.params(edit.indices[0], image_shape) if len(edit.indices) == 1 else None
+        except NotImplementedError:
+            parameters = None
+        return DiskCache.make_key(
+            'edit',
+            image_hash,
+            type(edit).__name__,
+            list(edit.indices),
+            edit.random_seed,
+            json.dumps(to_jsonable(parameters), sort_keys=True),
+            edits_fingerprint(),
+            'array' if as_array else 'bytes',
+        )
+
+    def get_edits(self, key: str) -> Union[None, List[Tuple[dict, Tuple[int], Union[bytes, np.ndarray]]]]:
+        value = self.get(key)
+        if value is None:
+            return None
+        header, archive = value.split(b'\n', 1)
+        images = np.load(io.BytesIO(archive), allow_pickle=False)
+        edits = []
+        for k, entry in enumerate(json.loads(header)):
+            mod_image = images[f"image_{k}"]
+            if not entry['is_array']:
+                mod_image = mod_image.tobytes()
+            edits.append((entry['parameters'], tuple(entry['shape']), mod_image))
+        return edits
+
+    def put_edits(self, key: str, edits: List[Tuple[dict, Tuple[int], Union[bytes, np.ndarray]]]):
+        header = json.dumps([{
+            'parameters' : to_jsonable(edit_parameters),
+            'shape' : list(mod_image_shape),
+            'is_array' : isinstance(mod_image, np.ndarray),
+        } for edit_parameters, mod_image_shape, mod_image in edits]).encode()
+        archive = io.BytesIO()
+        np.savez(archive, **{
+            f"image_{k}" : mod_image if isinstance(mod_image, np.ndarray) else np.frombuffer(mod_image, dtype=np.uint8)
+            for k, (_, _, mod_image) in enumerate(edits)
+        })
+        self.put(key, header + b'\n' + archive.getvalue())
+
+
+class MemoryEditCache():
+    """
+    In-memory counterpart of EditCache (with the same interface), to share edited images within a single pass,
+    e.g. across the wrappers and evaluation modes of a matrix run. The least recently used entries are dropped
+    beyond max_bytes. Entries are shared, so the edited images must not be modified in place.
+    """
+    edit_key = staticmethod(EditCache.edit_key)
+
+    def __init__(self, max_bytes: int=2 ** 30):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_edits(self, key: str) -> Union[None, List[Tuple[dict, Tuple[int], Union[bytes, np.ndarray]]]]:
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put_edits(self, key: str, edits: List[Tuple[dict, Tuple[int], Union[bytes, np.ndarray]]]):
+        nbytes = sum(mod_image.nbytes if isinstance(mod_image, np.ndarray) else len(mod_image) for _, _, mod_image in edits)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            # (a replaced entry no longer counts)
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (edits, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, (_, old_nbytes) = self.entries.popitem(last=False)
+            self.size -= old_nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits' : self.hits, 'misses' : self.misses}
+
+    def take_stats(self) -> Dict[str, int]:
+        # (a worker process reports its counts since the previous call, which the coordinator sums with add_stats)
+        stats = self.stats()
+        self.hits, self.misses = 0, 0
+        return stats
+
+    def add_stats(self, stats: Dict[str, int]):
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+
+
+def take_stats(caches: list) -> list:
+    """
+    Take the statistics of a worker's caches (None for a missing cache), to be returned with its task results.
+    """
+    return [None if image_cache is None else image_cache.take_stats() for image_cache in caches]
+
+
+def add_stats(caches: list, stats: list):
+    """
+    Sum the statistics returned by a worker task into the coordinator's caches.
+    """
+    for image_cache, cache_stats in zip(caches, stats):
+        if image_cache is not None and cache_stats is not None:
+            image_cache.add_stats(cache_stats)
@@ -58,3 +58,29 @@ def image_edits(image_edits: ImageRobustnessTests, random_seed: int=0) -> List[I
             IEComposeA(random_seed),
         ]
     raise NotImplementedError
+
+
+def image_edit_tasks(evaluation: ImageRobustnessTests, random_seed: int=0) -> List[ImageEdit]:
+    """
+    Get the image edits of an evaluation mode, split into one task per (edit, parameter).
+    """
+    return [task for edit in image_edits(evaluation, random_seed) for task in edit.split()]
+
+
+def image_edit_chains(evaluation: ImageRobustnessTests, random_seed: int=0) -> List[List[ImageEdit]]:
+    """
+    Get the image edits of an evaluation mode, split into tasks for adaptive early stopping:
+    one task per severity chain (its single-index edits, in order of severity), and one per unchained (edit, parameter).
+    """
+    tasks = []
+    for edit in image_edits(evaluation, random_seed):
+        chain_tasks = {}
+        for task, chain in edit.split_chains():
+            if chain is None:
+                tasks.append([task])
+            elif chain in chain_tasks:
+                chain_tasks[chain].append(task)
+            else:
+                chain_tasks[chain] = [task]
+                tasks.append(chain_tasks[chain])
+    return tasks
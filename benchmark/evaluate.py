@@ -6,15 +6,24 @@ Evaluation module.
 """
 
 import time
+import hashlib
 import logging
 import mimetypes
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+try:
+    import resource
+except ImportError:
+    # (not available on Windows)
+    resource = None
 
 import numpy as np
 import cv2
 
-from benchmark import durability, invisibility
+from benchmark import durability, frames, invisibility, manifest
+from benchmark.cache import EditCache, EncodeCache
 from benchmark.image import utils
-from benchmark.image.edit import ImageEditParams
+from benchmark.image.edit import EditMemo, ImageEdit, ImageEditParams
 
 from wrappers.wrapper import ImageWrapper
 
@@ -28,6 +37,14 @@ IMAGE_RESULTS = {
     'content_format' : "",
     'content_dimensions' : (),
     'time_taken_ms' : 0.,
+    'cpu_time_ms' : 0.,
+    'read_time_ms' : 0.,
+    'bytes_to_bgr_time_ms' : 0.,
+    'edit_time_ms' : 0.,
+    'bgr_to_bytes_time_ms' : 0.,
+    'metrics_time_ms' : 0.,
+    'rss_peak_delta_kb' : 0,
+    'tracemalloc_peak_kb' : None,
     'error' : False,
     'psnr' : 0.,
     'ssim' : 0.,
@@ -36,118 +53,570 @@ IMAGE_RESULTS = {
     'edit_parameters' : {},
     'detected' : False,
     'decoded' : False,
+    'batch_size' : 1,
+    # scalability runs only: worker processes running at once, and call start time within the level
+    'concurrency' : 1,
+    'started_at_ms' : None,
+    # reliability runs only: per-kind false-positive trial counts, and the sequential test decision
+    'trial_kind' : "",
+    'trials' : 0,
+    'positives' : 0,
+    'fpr_bound' : None,
+    'fpr_confidence' : None,
+    'sprt_decision' : "",
+    'design_effect' : None,
+    # adaptive early stopping only: failure inferred from the less severe edits of the chain, without decoding
+    'inferred' : False,
 }
 
+# memory budget for the images pending in (or waiting for) a batch
+DEFAULT_BATCH_BYTES = 2 ** 28
 
-def evaluate_image(
+
+def get_image_name(filepath: str) -> str:
+    return filepath.split('/')[-1].split('.')[0]
+
+
+def content_random_seed(image_hash: str) -> int:
+    """
+    Get the random seed used for an image (payload + edits), from its content hash (SHA-256, hex),
+    so that it is the same in every process, run and machine.
+    """
+    return int(image_hash[:8], 16)
+
+
+def image_random_seed(filepath: str) -> int:
+    """
+    Get the random seed used for an image file (its content hash is taken from the dataset manifest, if current).
+    """
+    return content_random_seed(manifest.content_hash(filepath))
+
+
+def error_result(filepath: str, encode: bool=True):
+    """
+    Placeholder result for an image that could not be evaluated at all.
+    """
+    err_result = IMAGE_RESULTS.copy()
+    err_result['operation'] = "encode" if encode else "decode"
+    err_result['content_id'] = get_image_name(filepath)
+    err_result['content_format'] = mimetypes.guess_type(filepath)[0] or "image/unknown"
+    err_result['error'] = True
+    return err_result
+
+
+def elapsed_ms(t: int) -> float:
+    """
+    Time since t (from time.perf_counter_ns), in ms.
+    """
+    return (time.perf_counter_ns() - t) / 1e6
+
+
+def usage_start() -> Tuple:
+    """
+    Snapshot of the process resource usage, before a measured call (see usage_since).
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    return (
+        time.perf_counter_ns(),
+        time.process_time_ns(),
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else 0,
+        tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+    )
+
+
+def usage_since(start: Tuple, count: int=1) -> Dict[str, Any]:
+    """
+    Resource usage of a measured call (over count items): wall and CPU times per item,
+    and the growth of the peak RSS and (if tracing) the peak traced memory above its starting point.
+    """
+    wall_ns, cpu_ns, max_rss, traced = start
+    return {
+        'time_taken_ms' : elapsed_ms(wall_ns) / count,
+        'cpu_time_ms' : (time.process_time_ns() - cpu_ns) / 1e6 / count,
+        'rss_peak_delta_kb' : (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss) if resource is not None else 0,
+        'tracemalloc_peak_kb' : (
+            (tracemalloc.get_traced_memory()[1] - traced) / 1024 if traced is not None and tracemalloc.is_tracing() else None
+        ),
+    }
+
+
+def setup_wrapper(wrapper: ImageWrapper) -> float:
+    """
+    Run the wrapper setup (e.g. model loading), and report its time apart from the per-call times.
+    """
+    t = time.perf_counter_ns()
+    wrapper.setup()
+    setup_time_ms = elapsed_ms(t)
+    logging.info(f"Set up {wrapper.name} in {setup_time_ms:.1f} ms.")
+    return setup_time_ms
+
+
+def batched(items: Iterable[Tuple[Any, int, Any]], batch_size: int, batch_bytes: int) -> Iterator[List[Any]]:
+    """
+    Group a stream of (key, nbytes, item) into batches of items with the same key (e.g. image shape),
+    of up to batch_size items each. Beyond batch_bytes of pending items, the largest pending batch is released early.
+    """
+    groups, group_bytes = {}, {}
+    for key, nbytes, item in items:
+        groups.setdefault(key, []).append(item)
+        group_bytes[key] = group_bytes.get(key, 0) + nbytes
+        if len(groups[key]) >= batch_size:
+            group_bytes.pop(key)
+            yield groups.pop(key)
+        while sum(group_bytes.values()) > batch_bytes:
+            key = max(group_bytes, key=group_bytes.get)
+            group_bytes.pop(key)
+            yield groups.pop(key)
+    yield from groups.values()
+
+
+def run_batch(batch_fn: Callable, inputs: List[Any], labels: List[str]) -> Tuple[List[Any], List[bool], Dict[str, Any]]:
+    """
+    Run a batched wrapper call, measuring it. If the batch fails, its items are retried one by one to isolate the errors.
+    Returns the outputs, the per-item error flags, and the resource usage (with times amortized over the batch).
+    """
+    start = usage_start()
+    try:
+        outputs = batch_fn(inputs)
+        errors = [False] * len(inputs)
+    except:
+        if len(inputs) == 1:
+            logging.error(f"{labels[0]}:", exc_info=True)
+            outputs, errors = [None], [True]
+        else:
+            outputs, errors = [], []
+            for item, label in zip(inputs, labels):
+                item_outputs, item_errors, _ = run_batch(batch_fn, [item], [label])
+                outputs.extend(item_outputs)
+                errors.extend(item_errors)
+    return outputs, errors, usage_since(start, len(inputs))
+
+
+def read_image(filepath: str):
+    """
+    Read an image, as bytes and BGR (mapped from the prepared frame, if any, see frames.FrameStore).
+    Also returns the time taken by the read and the conversion to BGR.
+    """
+    with open(filepath, 'rb') as image_file:
+        logging.info(f"Processing image {get_image_name(filepath)}.")
+
+        t = time.perf_counter_ns()
+        image_bytes = image_file.read()
+        read_time_ms = elapsed_ms(t)
+        t = time.perf_counter_ns()
+        image_bgr = frames.load_frame(filepath, image_bytes)
+        bytes_to_bgr_time_ms = elapsed_ms(t)
+
+    timings = {'read_time_ms' : read_time_ms, 'bytes_to_bgr_time_ms' : bytes_to_bgr_time_ms}
+    return image_bytes, image_bgr, timings
+
+
+def draw_payload(random_seed: int, payload_size: int) -> np.ndarray:
+    rng = np.random.default_rng(random_seed)
+    return rng.integers(2, size=payload_size).astype(bool)
+
+
+def load_image(filepath: str, wrapper: ImageWrapper, random_seed: int=None):
+    """
+    Read an image, and draw its payload. Also returns the time taken by the read and the conversion to BGR.
+    """
+    image_bytes, image_bgr, timings = read_image(filepath)
+    if random_seed is None:
+        random_seed = content_random_seed(hashlib.sha256(image_bytes).hexdigest())
+    return image_bytes, image_bgr, draw_payload(random_seed, wrapper.payload_size), timings
+
+
+def encode_images(
+    filepaths: List[str],
+    wrapper: ImageWrapper,
+    encode: bool=True,
+    debug_mode: bool=False,
+    random_seeds: List[int]=None,
+    encode_cache: EncodeCache=None,
+    batch_size: int=1,
+    batch_bytes: int=DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    images: List[Tuple]=None,
+):
+    """
+    Encoding stage: read images, draw their payloads and (optionally) watermark them.
+    Images already loaded (as by load_image) can be passed in, instead of being read again.
+    Returns, per image, the encoding results, the payload, and the image to run the decoding stage on,
+    as both bytes and BGR (None on an encoding error).
+    With an encode cache, a previous encoding (and its metrics) of the same image + payload is reused.
+    Images of the same shape are encoded together with wrapper.encode_batch.
+    The invisibility metrics of larger images are computed over tiles, to stay within metrics_max_bytes.
+    """
+    if random_seeds is None:
+        random_seeds = [None] * len(filepaths)
+    if images is None:
+        images = [load_image(filepath, wrapper, random_seed) for filepath, random_seed in zip(filepaths, random_seeds)]
+
+    if not encode:
+        return [([], payload_bits, image_bytes, image_bgr) for image_bytes, image_bgr, payload_bits, _ in images]
+
+    enc_results, enc_images, cache_keys, is_cached = [], [], [], []
+    for filepath, (image_bytes, image_bgr, payload_bits, timings) in zip(filepaths, images):
+
+        # preprocessing
+        if debug_mode:
+            logging.info("Dispalying the original image.")
+            utils.display_frame(image_bgr)
+
+        enc_result = IMAGE_RESULTS.copy()
+        enc_result['operation'] = "encode"
+        enc_result['content_id'] = get_image_name(filepath)
+        enc_result['content_format'] = mimetypes.guess_type(filepath)[0]
+        if enc_result['content_format'] is None:
+            enc_result['content_format'] = "image/unknown"
+        enc_result['content_dimensions'] = image_bgr.shape
+        enc_result.update(timings)
+
+        # cached encoding
+        cached, cache_key = None, None
+        if encode_cache is not None:
+            cache_key = EncodeCache.encode_key(wrapper, image_bytes, payload_bits)
+            cached = encode_cache.get_encoding(cache_key)
+        if cached is not None:
+            enc_image_bytes, cached_result = cached
+            enc_result.update(cached_result)
+
+        enc_results.append(enc_result)
+        enc_images.append(enc_image_bytes if cached is not None else None)
+        cache_keys.append(cache_key)
+        is_cached.append(cached is not None)
+
+    # encoding, batched by shape (array-native if possible)
+    as_array = wrapper.implements('encode_array')
+    pending = (
+        (image_bgr.shape, image_bgr.nbytes, i)
+        for i, (_, image_bgr, _, _) in enumerate(images) if not is_cached[i]
+    )
+    for batch in batched(pending, batch_size, batch_bytes):
+        outputs, errors, usage = run_batch(
+            lambda inputs: wrapper.encode_batch([x for x, _ in inputs], [p for _, p in inputs]),
+            [(images[i][1] if as_array else images[i][0], images[i][2]) for i in batch],
+            ["Encoding error"] * len(batch),
+        )
+        for i, output, error in zip(batch, outputs, errors):
+            enc_images[i] = output
+            enc_results[i]['error'] = error
+            enc_results[i].update(usage)
+            enc_results[i]['batch_size'] = len(batch)
+
+    # postprocessing
+    encoded = []
+    for i, (_, image_bgr, payload_bits, _) in enumerate(images):
+        enc_result, enc_image = enc_results[i], enc_images[i]
+        if enc_result['error']:
+            encoded.append(([enc_result], payload_bits, None, None))
+            continue
+
+        t = time.perf_counter_ns()
+        if isinstance(enc_image, np.ndarray):
+            enc_image_bytes, enc_image_bgr = utils.bgr_to_bytes(enc_image), enc_image
+            enc_result['bgr_to_bytes_time_ms'] = elapsed_ms(t)
+        else:
+            enc_image_bytes, enc_image_bgr = enc_image, utils.bytes_to_bgr(enc_image)
+            enc_result['bytes_to_bgr_time_ms'] += elapsed_ms(t)
+        if debug_mode:
+            logging.info("Dispalying the watermarked image.")
+            utils.display_frame(enc_image_bgr)
+
+        encoded.append(([enc_result], payload_bits, enc_image_bytes, enc_image_bgr))
+
+    # invisibility metrics, for the new encodings
+    assessed = [i for i in range(len(images)) if not is_cached[i] and encoded[i][3] is not None]
+    t = time.perf_counter_ns()
+    assessments = invisibility.assess_images(
+        [(images[i][1], encoded[i][3]) for i in assessed], max_bytes=metrics_max_bytes, backend=metrics_backend,
+    )
+    metrics_time_ms = elapsed_ms(t) / max(len(assessed), 1)
+    for i, assessment in zip(assessed, assessments):
+        enc_results[i].update(assessment)
+        enc_results[i]['metrics_time_ms'] = metrics_time_ms
+        if encode_cache is not None:
+            encode_cache.put_encoding(cache_keys[i], encoded[i][2], {
+                key : enc_results[i][key] for key in ['time_taken_ms', 'psnr', 'ssim', 'pcpa']
+            })
+
+    return encoded
+
+
+def encode_image(
     filepath: str,
     wrapper: ImageWrapper,
-    evaluation: durability.ImageRobustnessTests,
     encode: bool=True,
     debug_mode: bool=False,
+    random_seed: int=None,
+    encode_cache: EncodeCache=None,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
 ):
     """
-    Run a specified set of tests on an image.
+    Encoding stage for a single image (see encode_images).
     """
-    results = []
+    return encode_images(
+        [filepath], wrapper, encode=encode, debug_mode=debug_mode, random_seeds=[random_seed], encode_cache=encode_cache,
+        metrics_max_bytes=metrics_max_bytes, metrics_backend=metrics_backend,
+    )[0]
 
-    with open(filepath, 'rb') as image_file:
-        image_name = filepath.split('/')[-1].split('.')[0]
-        logging.info(f"Processing image {image_name}.")
 
-        random_seed = hash(image_name) % 2 ** 32
-        image_bytes = image_file.read()
-        image_bgr = utils.bytes_to_bgr(image_bytes)
-
-        rng = np.random.default_rng(random_seed)
-        payload_bits = rng.integers(2, size=wrapper.payload_size).astype(bool)
-
-        ### encoding
-            
-        if encode:
-
-            # preprocessing
-            if debug_mode:
-                logging.info("Dispalying the original image.")
-                utils.display_frame(image_bgr)
-
-            enc_result = IMAGE_RESULTS.copy()
-            enc_result['operation'] = "encode"
-            enc_result['content_id'] = image_name
-            enc_result['content_format'] = mimetypes.guess_type(filepath)[0]
-            if enc_result['content_format'] is None:
-                enc_result['content_format'] = "image/unknown"
-            enc_result['content_dimensions'] = image_bgr.shape
-
-            # encoding
-            t = time.time()
-            try:
-                enc_image_bytes = wrapper.encode(image_bytes, payload_bits)
-            except:
-                enc_result['error'] = True
-                logging.error("Encoding error:", exc_info=True)
-            enc_result['time_taken_ms'] = int((time.time() - t) * 1000)
-            if enc_result['error']:
-                results.append(enc_result)
-                return results
+def edit_image(image_bgr: np.ndarray, edit: ImageEdit, debug_mode: bool=False, memo: EditMemo=None, as_array: bool=False):
+    """
+    Generate the edited images of an edit, written to bytes for decoding.
+    Yields (edit parameters, edited image shape, edited image bytes, timings of the edit and of the write to bytes).
+    With as_array, losslessly edited images are yielded as (BGR) arrays instead of being written to PNG bytes.
+    """
+    edit_generator = edit.generate(image_bgr) if memo is None else memo.generate(edit, image_bgr)
+    t = time.perf_counter_ns()
+    for (edit_parameters, mod_image_bgr) in edit_generator:
+        edit_time_ms = elapsed_ms(t)
 
-            # postprocessing
-            enc_image_bgr = utils.bytes_to_bgr(enc_image_bytes)
-            if debug_mode:
-                logging.info("Dispalying the watermarked image.")
-                utils.display_frame(enc_image_bgr)
-
-            enc_result.update(invisibility.assess_image(image_bgr, enc_image_bgr))
-                
-            results.append(enc_result)
-
-        ### decoding
-
-        if not encode:
-            enc_image_bytes = image_bytes
-            enc_image_bgr = image_bgr
-        
-        edits = durability.image_edits(evaluation)
-            
+        if debug_mode:
+            print(f"{type(edit).__name__}:{edit_parameters}.")
+            utils.display_frame(mod_image_bgr)
+
+        t = time.perf_counter_ns()
+        if ImageEditParams.JPEG_Q.value in edit_parameters:
+            mod_image = utils.bgr_to_bytes(mod_image_bgr, jpeg_quality=edit_parameters[ImageEditParams.JPEG_Q.value])
+        elif as_array:
+            mod_image = mod_image_bgr
+        else:
+            mod_image = utils.bgr_to_bytes(mod_image_bgr)
+        timings = {'edit_time_ms' : edit_time_ms, 'bgr_to_bytes_time_ms' : elapsed_ms(t)}
+
+        yield edit_parameters, mod_image_bgr.shape, mod_image, timings
+        t = time.perf_counter_ns()
+
+
+def edit_image_cached(
+    image_bgr: np.ndarray,
+    image_hash: str,
+    edit: ImageEdit,
+    edit_cache: EditCache,
+    debug_mode: bool=False,
+    memo: EditMemo=None,
+    as_array: bool=False,
+):
+    """
+    Same as edit_image, with each (edit, index) looked up in (or added to) an edit cache.
+    For cached edits, the time of the cache lookup is reported as the edit time.
+    """
+    for task in edit.split():
+        key = EditCache.edit_key(image_hash, task, image_bgr.shape, as_array=as_array)
+        t = time.perf_counter_ns()
+        edited = edit_cache.get_edits(key)
+        if edited is None:
+            edited = list(edit_image(image_bgr, task, debug_mode=debug_mode, memo=memo, as_array=as_array))
+            edit_cache.put_edits(key, [item[:3] for item in edited])
+            yield from edited
+        else:
+            timings = {'edit_time_ms' : elapsed_ms(t) / max(len(edited), 1), 'bgr_to_bytes_time_ms' : 0.}
+            for item in edited:
+                yield (*item, timings)
+
+
+def decode_image(
+    image_name: str,
+    enc_image_bgr: np.ndarray,
+    payload_bits: np.ndarray,
+    wrapper: ImageWrapper,
+    edits: List[ImageEdit],
+    debug_mode: bool=False,
+    image_hash: str=None,
+    edit_cache: EditCache=None,
+    memo: EditMemo=None,
+    batch_size: int=1,
+    batch_bytes: int=DEFAULT_BATCH_BYTES,
+    early_stop: int=None,
+):
+    """
+    Decoding stage: apply each edit to the (watermarked) image and try to decode the results.
+    With an edit cache (and the content hash of the image), edited images are reused across runs and wrappers.
+    Intermediate edit steps are memoized, by default in a memo for this call only.
+    Wrappers that implement decode_array get lossless edits as arrays, skipping the PNG round-trip.
+    Edited images of the same shape are decoded together with wrapper.decode_batch, as they are generated.
+    With early_stop (adaptive mode), the severity chains of each edit are run in order of severity, and after
+    early_stop consecutive failures to decode, the rest of the chain is skipped and recorded as inferred failures
+    (with the parameters the edit would have had). With batching, only the images decoded so far count towards the failures.
+    """
+    results = []
+    if memo is None:
+        memo = EditMemo()
+    as_array = wrapper.implements('decode_array')
+    # results so far of each severity chain, and the results already decoded
+    chain_results = {}
+    completed = set()
+
+    def edit_tasks():
         for edit in edits:
-            edit_generator = edit.generate(enc_image_bgr)
-            for (edit_parameters, mod_image_bgr) in edit_generator:
+            if not early_stop:
+                yield edit, None
+                continue
+            for task, chain in edit.split_chains():
+                if chain is None:
+                    yield task, None
+                    continue
+                chain_key = (type(task).__name__, chain)
+                last_results = chain_results.setdefault(chain_key, [])[-early_stop:]
+                if len(last_results) == early_stop and all(
+                    id(dec_result) in completed and not dec_result['decoded'] for dec_result in last_results
+                ):
+                    edit_parameters = task.params(task.indices[0], enc_image_bgr.shape)
+                    if edit_parameters is None:
+                        # (the edit would be skipped for this image, and has no row)
+                        continue
+                    dec_result = IMAGE_RESULTS.copy()
+                    dec_result['operation'] = "decode"
+                    dec_result['content_id'] = image_name
+                    dec_result['content_format'] = "image"
+                    dec_result['edit_type'] = type(task).__name__
+                    dec_result['edit_parameters'] = edit_parameters
+                    dec_result['inferred'] = True
+                    results.append(dec_result)
+                    completed.add(id(dec_result))
+                    chain_results[chain_key].append(dec_result)
+                else:
+                    yield task, chain_key
+
+    def edited_images():
+        for edit, chain_key in edit_tasks():
+            if edit_cache is not None and image_hash is not None:
+                edited = edit_image_cached(
+                    enc_image_bgr, image_hash, edit, edit_cache, debug_mode=debug_mode, memo=memo, as_array=as_array,
+                )
+            else:
+                edited = edit_image(enc_image_bgr, edit, debug_mode=debug_mode, memo=memo, as_array=as_array)
 
-                # preprocessing
-                if debug_mode:
-                    print(f"{type(edit).__name__}:{edit_parameters}.")
-                    utils.display_frame(mod_image_bgr)
+            for (edit_parameters, mod_image_shape, mod_image, timings) in edited:
 
                 dec_result = IMAGE_RESULTS.copy()
                 dec_result['operation'] = "decode"
                 dec_result['content_id'] = image_name
                 dec_result['content_format'] = "image"
-                dec_result['content_dimensions'] = mod_image_bgr.shape
+                dec_result['content_dimensions'] = mod_image_shape
                 dec_result['edit_type'] = type(edit).__name__
                 dec_result['edit_parameters'] = edit_parameters
+                dec_result.update(timings)
+                results.append(dec_result)
+                if chain_key is not None:
+                    chain_results[chain_key].append(dec_result)
 
-                if ImageEditParams.JPEG_Q.value in edit_parameters:
-                    mod_image_bytes = utils.bgr_to_bytes(mod_image_bgr, jpeg_quality=edit_parameters[ImageEditParams.JPEG_Q.value])
-                else:
-                    mod_image_bytes = utils.bgr_to_bytes(mod_image_bgr)
-
-                # decoding
-                t = time.time()
-                try:
-                    dec_payload_bits = wrapper.decode(mod_image_bytes)
-                except:
-                    dec_result['error'] = True
-                    logging.error(f"Decoding error ({edit_parameters}):", exc_info=True)
-                dec_result['time_taken_ms'] = int((time.time() - t) * 1000)
-                if dec_result['error']:
-                    results.append(dec_result)
-                    continue
+                is_array = isinstance(mod_image, np.ndarray)
+                nbytes = mod_image.nbytes if is_array else len(mod_image)
+                yield (is_array, mod_image_shape), nbytes, (dec_result, mod_image)
 
-                # postprocessing
-                if dec_payload_bits is not None:
-                    dec_result['detected'] = True
-                    dec_result['decoded'] = np.array_equal(dec_payload_bits, payload_bits)
-            
-                results.append(dec_result)
+    # decoding
+    for batch in batched(edited_images(), batch_size, batch_bytes):
+        outputs, errors, usage = run_batch(
+            wrapper.decode_batch,
+            [mod_image for _, mod_image in batch],
+            [f"Decoding error ({dec_result['edit_parameters']})" for dec_result, _ in batch],
+        )
+        for (dec_result, _), dec_payload_bits, error in zip(batch, outputs, errors):
+            dec_result['error'] = error
+            dec_result.update(usage)
+            dec_result['batch_size'] = len(batch)
+            completed.add(id(dec_result))
+
+            # postprocessing
+            if not error and dec_payload_bits is not None:
+                dec_result['detected'] = True
+                dec_result['decoded'] = np.array_equal(dec_payload_bits, payload_bits)
 
     return results
+
+
+def evaluate_images(
+    filepaths: List[str],
+    wrapper: ImageWrapper,
+    evaluation: durability.ImageRobustnessTests,
+    encode: bool=True,
+    debug_mode: bool=False,
+    random_seeds: List[int]=None,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    early_stop: int=None,
+) -> Iterator[List[dict]]:
+    """
+    Run a specified set of tests on a list of images, yielding the results of each image in order.
+    The images are encoded together (batch_size at a time), then the edits of each image are decoded in batches
+    (stopping early within severity chains, with early_stop).
+    The random seeds default to the ones given by image_random_seed.
+    """
+    if random_seeds is None:
+        random_seeds = [None] * len(filepaths)
+    edits = durability.image_edits(evaluation)
+
+    for k in range(0, len(filepaths), batch_size):
+        encoded = encode_images(
+            filepaths[k:k + batch_size],
+            wrapper,
+            encode=encode,
+            debug_mode=debug_mode,
+            random_seeds=random_seeds[k:k + batch_size],
+            encode_cache=encode_cache,
+            batch_size=batch_size,
+            batch_bytes=batch_bytes,
+            metrics_max_bytes=metrics_max_bytes,
+            metrics_backend=metrics_backend,
+        )
+        for filepath, (results, payload_bits, enc_image_bytes, enc_image_bgr) in zip(filepaths[k:k + batch_size], encoded):
+            if enc_image_bgr is not None:
+                results.extend(decode_image(
+                    get_image_name(filepath),
+                    enc_image_bgr,
+                    payload_bits,
+                    wrapper,
+                    edits,
+                    debug_mode=debug_mode,
+                    image_hash=(hashlib.sha256(enc_image_bytes).hexdigest() if edit_cache is not None else None),
+                    edit_cache=edit_cache,
+                    batch_size=batch_size,
+                    batch_bytes=batch_bytes,
+                    early_stop=early_stop,
+                ))
+            yield results
+
+
+def evaluate_image(
+    filepath: str,
+    wrapper: ImageWrapper,
+    evaluation: durability.ImageRobustnessTests,
+    encode: bool=True,
+    debug_mode: bool=False,
+    random_seed: int=None,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    early_stop: int=None,
+):
+    """
+    Run a specified set of tests on an image.
+    The random seed defaults to the one given by image_random_seed.
+    """
+    return next(evaluate_images(
+        [filepath],
+        wrapper,
+        evaluation,
+        encode=encode,
+        debug_mode=debug_mode,
+        random_seeds=[random_seed],
+        encode_cache=encode_cache,
+        edit_cache=edit_cache,
+        batch_size=batch_size,
+        batch_bytes=batch_bytes,
+        metrics_max_bytes=metrics_max_bytes,
+        metrics_backend=metrics_backend,
+        early_stop=early_stop,
+    ))
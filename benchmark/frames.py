@@ -0,0 +1,119 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Pre-decoded dataset images, memory-mapped by the benchmark processes.
+"""
+
+import os
+import uuid
+import hashlib
+import logging
+import functools
+import concurrent.futures
+from typing import Dict, List, Union
+
+import numpy as np
+
+from benchmark.image import utils
+
+
+# the frames of a dataset directory are kept in this subdirectory (hidden, so that the dataset globs skip it)
+FRAMES_DIRNAME = '.frames'
+
+
+class FrameStore():
+    """
+    Raw BGR frames of the images in a dataset directory, as one .npy file per image, named by the content hash
+    of the source file (so a changed source file is never matched to a stale frame).
+    Frames are memory-mapped copy-on-write: they are read without decoding or copying, the pages are shared
+    by all the processes mapping them, and writes to a frame stay private to the process.
+    """
+    def __init__(self, directory: str):
+        self.directory = f"{directory}/{FRAMES_DIRNAME}"
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def frame_key(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def frame_path(self, key: str) -> str:
+        return f"{self.directory}/{key}.npy"
+
+    def get_frame(self, image_bytes: bytes) -> Union[None, np.ndarray]:
+        try:
+            image_bgr = np.load(self.frame_path(self.frame_key(image_bytes)), mmap_mode='c')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return image_bgr
+
+    def put_frame(self, key: str, image_bgr: np.ndarray):
+        # (written to a temporary file and renamed into place, so that readers never map a partial frame)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_filepath = f"{self.directory}/.{key}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filepath, 'wb') as frame_file:
+            np.save(frame_file, image_bgr)
+        os.replace(tmp_filepath, self.frame_path(key))
+
+    def prepare(self, filepaths: List[str], workers: int=1) -> Dict[str, int]:
+        """
+        Decode the images without an up-to-date frame (cv2 decodes without the GIL, so workers are threads),
+        and remove the frames whose source file changed or is gone. Undecodable images get no frame.
+        """
+        def prepare_image(filepath):
+            with open(filepath, 'rb') as image_file:
+                image_bytes = image_file.read()
+            key = self.frame_key(image_bytes)
+            if os.path.exists(self.frame_path(key)):
+                return key, False
+            image_bgr = utils.bytes_to_bgr(image_bytes)
+            if image_bgr is None:
+                logging.warning(f"{filepath} cannot be decoded, and has no frame.")
+                return None, False
+            self.put_frame(key, image_bgr)
+            return key, True
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            prepared = list(executor.map(prepare_image, filepaths))
+        keys = {key for key, _ in prepared if key is not None}
+
+        removed = 0
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.npy') and filename[:-len('.npy')] not in keys:
+                    os.remove(f"{self.directory}/{filename}")
+                    removed += 1
+        return {
+            'images' : len(keys),
+            'decoded' : sum(decoded for _, decoded in prepared),
+            'removed' : removed,
+            'bytes' : sum(os.path.getsize(self.frame_path(key)) for key in keys),
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits' : self.hits, 'misses' : self.misses}
+
+
+@functools.lru_cache(maxsize=None)
+def find_store(directory: str) -> Union[None, FrameStore]:
+    """
+    Get the frame store of a dataset directory, if it was prepared (checked once per process).
+    """
+    if os.path.isdir(f"{directory}/{FRAMES_DIRNAME}"):
+        return FrameStore(directory)
+    return None
+
+
+def load_frame(filepath: str, image_bytes: bytes) -> np.ndarray:
+    """
+    Get the BGR image of a dataset file from its prepared frame, or by decoding its bytes.
+    """
+    frame_store = find_store(os.path.dirname(os.path.abspath(filepath)))
+    if frame_store is not None:
+        image_bgr = frame_store.get_frame(image_bytes)
+        if image_bgr is not None:
+            return image_bgr
+    return utils.bytes_to_bgr(image_bytes)
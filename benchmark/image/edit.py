@@ -7,7 +7,8 @@ Image edits.
 
 import abc
 import enum
-from typing import List
+import collections
+from typing import List, Tuple, Union
 
 import numpy as np
 
@@ -24,12 +25,21 @@ class ImageEdit(abc.ABC):
     @abc.abstractmethod
     def NUM(self):
         ...
+
+    # whether generate depends on the random seed (if not, steps are shared across seeds)
+    SEEDED = True
+    # optional chains of indices, each in order of increasing severity (for adaptive early stopping)
+    SEVERITY_CHAINS = []
+    # optional EditMemo (and the key of the input image in it), which composite edits use for their steps
+    memo = None
+    memo_key = ()
     
     def __init__(self, random_seed: int=0, indices: List[int] = None):
         """
         Pass in a random seed for replicable pseudorandomness.
         Pass in a indices subset for granular test selection.
         """
+        self.random_seed = random_seed
         self.rng = np.random.default_rng(random_seed)
 
         if indices is None:
@@ -45,12 +55,106 @@ class ImageEdit(abc.ABC):
         """
         ...
 
+    def params(self, ind: int, image_shape: Tuple[int, ...]) -> Union[None, dict]:
+        """
+        Get the parameters that generate gives the edit at an index, for an image of this shape, without applying it
+        (None if generate skips it). Edits with severity chains implement it, for the edits skipped by early stopping.
+        """
+        raise NotImplementedError
+
+    def split(self) -> List['ImageEdit']:
+        """
+        Split into single-index edits, which generate the same edits (in order) as this one.
+        This relies on generate drawing its randomness independently of the indices subset.
+        """
+        return [type(self)(self.random_seed, [ind]) for ind in self.indices]
+
+    def split_chains(self) -> List[Tuple['ImageEdit', int]]:
+        """
+        Same as split, with the indices of each severity chain in order of severity, followed by the unchained ones.
+        Returns (single-index edit, chain number, or None if unchained).
+        """
+        tasks = []
+        for chain, chain_indices in enumerate(self.SEVERITY_CHAINS):
+            tasks += [(type(self)(self.random_seed, [ind]), chain) for ind in chain_indices if ind in self.indices]
+        chained = {ind for chain_indices in self.SEVERITY_CHAINS for ind in chain_indices}
+        tasks += [(type(self)(self.random_seed, [ind]), None) for ind in self.indices if ind not in chained]
+        return tasks
+
+    def step(self, edit_class, random_seed: int, indices: List[int], image_bgr: np.ndarray, key: Tuple=None):
+        """
+        Apply another edit as a step (its first edit among the indices), memoized if a memo is set.
+        Returns (edit parameters, edited image, step key), where the key identifies the chain of steps so far;
+        pass it along with the image for the next step (by default, the input of this edit is assumed).
+        """
+        memo = self.memo if self.memo is not None else EditMemo(max_bytes=0)
+        return memo.step(edit_class, random_seed, indices, image_bgr, self.memo_key if key is None else key)
+
+
+class EditMemo():
+    """
+    Per-image memoization of edit steps, as a DAG of frames.
+    A step is keyed by the key of its input, its edit class and index, and (for seeded edits) its random seed,
+    so that identical chains of steps across a suite (e.g. a standalone edit and the prefix of a composite edit)
+    are computed once. The least recently used frames are dropped beyond max_bytes.
+    Memoized frames are shared, so they must not be modified in place.
+    """
+    def __init__(self, max_bytes: int=2 ** 29):
+        self.max_bytes = max_bytes
+        self.frames = collections.OrderedDict()
+        self.nbytes = 0
+
+    def reset(self):
+        """
+        Drop all frames (e.g. when moving on to the next image).
+        """
+        self.frames.clear()
+        self.nbytes = 0
+
+    def step(self, edit_class, random_seed: int, indices: List[int], image_bgr: np.ndarray, key: Tuple=()):
+        for ind in indices:
+            step_key = key + ((edit_class.__name__, ind, random_seed if edit_class.SEEDED else None),)
+
+            if step_key in self.frames:
+                self.frames.move_to_end(step_key)
+                result = self.frames[step_key][0]
+            else:
+                edit = edit_class(random_seed, [ind])
+                edit.memo, edit.memo_key = self, key
+                result = next(edit.generate(image_bgr), None)
+                self.store(step_key, result, image_bgr)
+
+            if result is not None:
+                return result[0], result[1], step_key
+        return None
+
+    def store(self, step_key: Tuple, result, image_bgr: np.ndarray):
+        # a step that passes its input through holds no extra memory
+        nbytes = 0 if result is None or result[1] is image_bgr else result[1].nbytes
+        if nbytes > self.max_bytes:
+            return
+        self.frames[step_key] = (result, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, old_nbytes) = self.frames.popitem(last=False)
+            self.nbytes -= old_nbytes
+
+    def generate(self, edit: ImageEdit, image_bgr: np.ndarray):
+        """
+        Memoized equivalent of edit.generate.
+        """
+        for ind in edit.indices:
+            result = self.step(type(edit), edit.random_seed, [ind], image_bgr)
+            if result is not None:
+                yield result[:2]
+
 
 class IEBase(ImageEdit):
     """
     Basic PNG + JPEG.
     """
     NUM = 2
+    SEEDED = False
 
     def generate(self, image_bgr):
         if 0 in self.indices:
@@ -64,9 +168,13 @@ class IECompressJPEG(ImageEdit):
     Various levels of JPEG compression.
     """
     NUM = 10
+    SEEDED = False
     JPEG_QUALITY_LEVELS = [99, 90, 80, 70, 60, 50, 40, 30, 20, 10]
+    SEVERITY_CHAINS = [list(range(10))]
+
+    def params(self, ind, image_shape):
+        return {ImageEditParams.JPEG_Q.value : self.JPEG_QUALITY_LEVELS[ind]}
 
     def generate(self, image_bgr):
         for ind in self.indices:
-            jpeg_quality = self.JPEG_QUALITY_LEVELS[ind]
-            yield ({ImageEditParams.JPEG_Q.value : jpeg_quality}, image_bgr)
+            yield (self.params(ind, image_bgr.shape), image_bgr)
@@ -14,6 +14,7 @@ from benchmark.image.edit_alt import IEAlterA
 class IEComposeA(ImageEdit):
     """
     Fixed composition.
+    Each composition is a chain of steps (see ImageEdit.step), so that with a memo, shared prefixes are computed once.
     """
     NUM = 6
 
@@ -23,28 +24,22 @@ class IEComposeA(ImageEdit):
         if 0 in self.indices:
             params = {'composite' : 'fixed/post'}
             
-            m_gen = IEFilterA(random_seed, [2]).generate(image_bgr) # increase brightness
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IEFilterA, random_seed, [2], image_bgr) # increase brightness
             params.update(m_params)
-            m_gen = IEAlterA(random_seed, [0]).generate(mod_image_bgr) # corner square mask
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IEAlterA, random_seed, [0], mod_image_bgr, key) # corner square mask
             params.update(m_params)
-            m_gen = IECompressJPEG(random_seed, [1]).generate(mod_image_bgr) # Q95 JPEG
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IECompressJPEG, random_seed, [1], mod_image_bgr, key) # Q95 JPEG
             params.update(m_params)
             yield (params, mod_image_bgr)
         
         random_seed = self.rng.integers(2**32)
         if 1 in self.indices:
             params = {'composite' : 'fixed/post'}
-            m_gen = IEFilterA(random_seed, [5]).generate(image_bgr) # decrease saturation
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IEFilterA, random_seed, [5], image_bgr) # decrease saturation
             params.update(m_params)
-            m_gen = IEAlterA(random_seed, [2]).generate(mod_image_bgr) # many squares mask
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IEAlterA, random_seed, [2], mod_image_bgr, key) # many squares mask
             params.update(m_params)
-            m_gen = IECompressJPEG(random_seed, [3]).generate(mod_image_bgr) # Q80 JPEG
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IECompressJPEG, random_seed, [3], mod_image_bgr, key) # Q80 JPEG
             params.update(m_params)
             yield (params, mod_image_bgr)
 
@@ -52,28 +47,22 @@ class IEComposeA(ImageEdit):
         random_seed = self.rng.integers(2**32)
         if 2 in self.indices:
             params = {'composite' : 'fixed/repost'}
-            m_gen = IERescale(random_seed, [1, 2]).generate(image_bgr) # 95%/105% size
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IERescale, random_seed, [1, 2], image_bgr) # 95%/105% size
             params.update(m_params)
-            m_gen = IEAlterA(random_seed, [7]).generate(mod_image_bgr) # small text
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IEAlterA, random_seed, [7], mod_image_bgr, key) # small text
             params.update(m_params)
-            m_gen = IECompressJPEG(random_seed, [3]).generate(mod_image_bgr) # Q85 JPEG
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IECompressJPEG, random_seed, [3], mod_image_bgr, key) # Q85 JPEG
             params.update(m_params)
             yield (params, mod_image_bgr)
 
         random_seed = self.rng.integers(2**32)
         if 3 in self.indices:
             params = {'composite' : 'fixed/repost'}
-            m_gen = IERescale(random_seed, [6]).generate(image_bgr) # fixed size
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IERescale, random_seed, [6], image_bgr) # fixed size
             params.update(m_params)
-            m_gen = IEAlterA(random_seed, [8]).generate(mod_image_bgr) # large text
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IEAlterA, random_seed, [8], mod_image_bgr, key) # large text
             params.update(m_params)
-            m_gen =  IECompressJPEG(random_seed, [6]).generate(mod_image_bgr) # Q70 JPEG
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IECompressJPEG, random_seed, [6], mod_image_bgr, key) # Q70 JPEG
             params.update(m_params)
             yield (params, mod_image_bgr)
 
@@ -81,22 +70,18 @@ class IEComposeA(ImageEdit):
         random_seed = self.rng.integers(2**32)
         if 4 in self.indices:
             params = {'composite' : 'fixed/screenshot'}
-            m_gen = IERescale(random_seed, [1, 2]).generate(image_bgr) # 95%/105% size
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IERescale, random_seed, [1, 2], image_bgr) # 95%/105% size
             params.update(m_params)
-            m_gen = IECrop(random_seed, [2]).generate(mod_image_bgr) # one side, 8px
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IECrop, random_seed, [2], mod_image_bgr, key) # one side, 8px
             params.update(m_params)
             yield (params, mod_image_bgr)
 
         random_seed = self.rng.integers(2**32)
         if 5 in self.indices:
             params = {'composite' : 'fixed/screenshot'}
-            m_gen = IERescale(random_seed, [7]).generate(image_bgr) # fixed area
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IERescale, random_seed, [7], image_bgr) # fixed area
             params.update(m_params)
-            m_gen = IECrop(random_seed, [1]).generate(mod_image_bgr) # all sides, 10%
-            m_params, mod_image_bgr = next(m_gen)
+            m_params, mod_image_bgr, key = self.step(IECrop, random_seed, [1], mod_image_bgr, key) # all sides, 10%
             params.update(m_params)
             yield (params, mod_image_bgr)
 
@@ -17,6 +17,7 @@ class IEFilterA(ImageEdit):
     Global filters.
     """
     NUM = 6
+    SEEDED = False
 
     @staticmethod
     def gamma_correction(data, gamma):
@@ -66,6 +67,7 @@ class IEFilterB(ImageEdit):
     Local filters.
     """
     NUM = 3
+    SEEDED = False
 
     def generate(self, image_bgr):
         # blur / sharpen
@@ -64,7 +64,29 @@ class IERescale(ImageEdit):
     Rescaling.
     """
     NUM = 8
+    SEEDED = False
     SCALES = [(0.5, 0.5), (0.95, 0.95), (1.05, 1.05), (1.5, 1.5), (0.8, 1.2), (1.2, 0.8)]
+    # downscaling (0.95, 0.5), upscaling (1.05, 1.5)
+    SEVERITY_CHAINS = [[1, 0], [2, 3]]
+
+    def relative_size(self, i, h, w):
+        """
+        Get the size of a relative rescaling, or None if it is out of bounds (and skipped).
+        """
+        scale = self.SCALES[i]
+        nh, nw = int(scale[0] * h), int(scale[1] * w)
+        if nh * nw > max(h * w, 3840 * 2160):
+            return None
+        if nh * nw < min(h * w, 256 * 256):
+            return None
+        return nh, nw
+
+    def params(self, ind, image_shape):
+        if ind < len(self.SCALES):
+            if self.relative_size(ind, *image_shape[:2]) is None:
+                return None
+            return {'scale' : self.SCALES[ind]}
+        return {'scale' : "fixed size" if ind == 6 else "fixed area"}
 
     def generate(self, image_bgr):
         h, w = image_bgr.shape[:2]
@@ -72,13 +94,10 @@ class IERescale(ImageEdit):
         # relative rescaling
         for i in range(len(self.SCALES)):
             if i in self.indices:
-                scale = self.SCALES[i]
-                nh, nw = int(scale[0] * h), int(scale[1] * w)
-                if nh * nw > max(h * w, 3840 * 2160):
-                    continue
-                if nh * nw < min(h * w, 256 * 256):
+                size = self.relative_size(i, h, w)
+                if size is None:
                     continue
-                yield ({'scale' : scale}, utils.resize_frame(image_bgr, nh, nw))
+                yield ({'scale' : self.SCALES[i]}, utils.resize_frame(image_bgr, *size))
     
         # fixed rescaling
         if 6 in self.indices:
@@ -119,10 +138,23 @@ class IERotateB(ImageEdit):
     """
     NUM = 5
     ANGLES = [1, 3, 9, 27]
+    # (the last index is a random angle)
+    SEVERITY_CHAINS = [[0, 1, 2, 3]]
+
+    def gen_angles(self, rng):
+        """
+        Generate rotation angles.
+        """
+        angles = [angle * (-1) ** rng.integers(2) for angle in self.ANGLES]
+        angles.append(rng.integers(360))
+        return angles
+
+    def params(self, ind, image_shape):
+        # (from a fresh generator, as generate draws them)
+        return {'angle' : self.gen_angles(np.random.default_rng(self.random_seed))[ind]}
 
     def generate(self, image_bgr):
-        angles = [angle * (-1) ** self.rng.integers(2) for angle in self.ANGLES]
-        angles.append(self.rng.integers(360))
+        angles = self.gen_angles(self.rng)
 
         for ind in self.indices:
             yield ({'angle' : angles[ind]}, utils.rotate_frame(image_bgr, angles[ind]))
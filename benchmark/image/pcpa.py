@@ -5,7 +5,7 @@ SPDX-License-Identifier: MIT
 Trufo's perceptibility measure, version A.
 """
 
-from typing import Dict
+from typing import List, Tuple
 
 import numpy as np
 import cv2
@@ -14,6 +14,27 @@ from benchmark.image import utils
 
 
 FIXED_SIZE = 512
+# image pairs processed together, with their planes stacked along the channel axis (OpenCV allows up to 512 channels);
+# on CPU, the blurs get slower per plane beyond a dozen or so channels, so by default pairs are stacked one at a time
+MAX_BATCH = 1
+
+# BGR -> YCbCr (same as utils.bgr_to_ycc), as an affine transform for cv2.transform
+YCC_TRANSFORM = np.asarray([
+    [+0.114, +0.587, +0.299, 0.],
+    [+0.500, -0.331264, -0.168736, 128.],
+    [-0.081312, -0.418688, +0.500, 128.],
+], dtype=np.float32)
+
+# per channel (Y, Cb, Cr): blend size, base range
+# (human vision resolution is ~3x lower in Cr/Cb vs. Y)
+BLEND_SIZES = (2, 6, 6)
+BASE_RANGES = (6., 2., 2.)
+WINDOW_SIZE = 16
+
+# rows that a pixel's pcp value depends on, above and below (the window blur after/before a blend blur)
+HALO = (WINDOW_SIZE - 1) + (max(BLEND_SIZES) - 1)
+# approximate peak memory of calc_pcp_map, per pixel and view
+BYTES_PER_PIXEL = 160
 
 EPS = 0.0001
 CCC = 10.
@@ -34,64 +55,120 @@ def sigmoid(values: np.ndarray, limit: float=1.) -> np.ndarray:
     return limit * s_values
 
 
-def calc_pcpa_channel(grid_a: np.ndarray, grid_b: np.ndarray, is_color: True) -> float:
+def stack_ycc(images_bgr: List[np.ndarray]) -> np.ndarray:
     """
-    Calculate pcpa data for a single color channel.
+    Convert same-shape BGR images to YCbCr (float32), stacked as planes [Y_0..Y_n-1, Cb_0..Cb_n-1, Cr_0..Cr_n-1].
     """
-    # with some inspiration from both PSNR and SSIM
-    blend_size = 6 if is_color else 2
-    base_range = 2. if is_color else 6.
-
-    window_size = 16
-    
-    diff = grid_a - grid_b
-    diff = blur(diff - 0.9 * blur(diff, window_size), blend_size)
+    n = len(images_bgr)
+    height, width = images_bgr[0].shape[:2]
+    ycc = np.empty((height, width, 3 * n), dtype=np.float32)
+    for i, image_bgr in enumerate(images_bgr):
+        ycc_i = cv2.transform(image_bgr.astype(np.float32), YCC_TRANSFORM)
+        ycc[:, :, i::n] = ycc_i
+    return ycc
 
-    sig_a = grid_a - blur(grid_a, blend_size)
-    sig_b = grid_b - blur(grid_b, blend_size)
-    sig_a = blur(sig_a * sig_a, window_size)
-    sig_b = blur(sig_b * sig_b, window_size)
 
-    pcp_grid = diff * diff / (base_range * base_range + sig_a + sig_b)
-    return pcp_grid
-
-
-def calc_pcpa_single(ycc_a: np.ndarray, ycc_b: np.ndarray) -> float:
+def calc_pcp_map(ycc_a: np.ndarray, ycc_b: np.ndarray, n: int) -> np.ndarray:
     """
-    Calculate pcpa data for a single view.
+    Calculate pcpa data for n views of the same shape, given as stacked YCbCr planes (see stack_ycc).
+    Returns the per-pixel pcp ^ 1.5 of each view, stacked along the last axis.
     """
-    # human vision resolution is ~3x lower in Cr/Cb vs. Y
-    pcp_y = calc_pcpa_channel(ycc_a[:, :, 0], ycc_b[:, :, 0], is_color=False)
-    pcp_cb = calc_pcpa_channel(ycc_a[:, :, 1], ycc_b[:, :, 1], is_color=True)
-    pcp_cr = calc_pcpa_channel(ycc_a[:, :, 2], ycc_b[:, :, 2], is_color=True)
-
-    # adding up the various color channels
-    pcp = pcp_y + pcp_cb + pcp_cr
+    # with some inspiration from both PSNR and SSIM
+    # (by linearity, blur(a - b) = blur(a) - blur(b), so the blended maps of a and b also give the blended difference,
+    # and the window blurs of the two signal terms are done as one)
+    diff = ycc_a - ycc_b
+    diff_w = blur(diff, WINDOW_SIZE)
+
+    # blend blurs of a, b and the windowed difference, one call per blend size
+    blend_a = np.empty_like(ycc_a)
+    blend_b = np.empty_like(ycc_b)
+    for blend_size in sorted(set(BLEND_SIZES)):
+        planes = np.concatenate([
+            np.arange(c * n, (c + 1) * n) for c, size in enumerate(BLEND_SIZES) if size == blend_size
+        ])
+        k = len(planes)
+        blended = blur(np.concatenate([ycc_a[:, :, planes], ycc_b[:, :, planes], diff_w[:, :, planes]], axis=2), blend_size)
+        blend_a[:, :, planes] = blended[:, :, :k]
+        blend_b[:, :, planes] = blended[:, :, k:2 * k]
+        diff_w[:, :, planes] = blended[:, :, 2 * k:]
+
+    # blur(diff - 0.9 * blur(diff, window), blend)
+    diff = np.subtract(blend_a, blend_b, out=diff)
+    diff -= 0.9 * diff_w
+
+    # blur(sig_a * sig_a, window) + blur(sig_b * sig_b, window)
+    sig_a = np.subtract(ycc_a, blend_a, out=blend_a)
+    sig_b = np.subtract(ycc_b, blend_b, out=blend_b)
+    sig_a *= sig_a
+    sig_b *= sig_b
+    sig_a += sig_b
+    sig = blur(sig_a, WINDOW_SIZE)
+
+    # pcp_grid = diff * diff / (base_range * base_range + sig_a + sig_b)
+    sig += np.repeat(np.square(np.asarray(BASE_RANGES, dtype=np.float32)), n)
+    diff *= diff
+    diff /= sig
+
+    # adding up the various color channels, then overall measure across the full grid
+    height, width = diff.shape[:2]
+    pcp = diff.reshape(height, width, 3, n).sum(axis=2)
+    return np.power(pcp, 1.5, out=pcp)
+
+
+def calc_pcp_batch(images_a_bgr: List[np.ndarray], images_b_bgr: List[np.ndarray]) -> np.ndarray:
+    """
+    Calculate pcpa data for pairs of views of the same shape, MAX_BATCH pairs at a time.
+    """
+    pcp = []
+    for k in range(0, len(images_a_bgr), MAX_BATCH):
+        ycc_a = stack_ycc(images_a_bgr[k:k + MAX_BATCH])
+        ycc_b = stack_ycc(images_b_bgr[k:k + MAX_BATCH])
+        pcp_map = calc_pcp_map(ycc_a, ycc_b, len(images_a_bgr[k:k + MAX_BATCH]))
+        pcp.append(pcp_map.mean(axis=(0, 1), dtype=np.float64))
+    return np.concatenate(pcp)
 
-    # overall measure across the full grid
-    pcpa = np.mean(np.power(pcp, 1.5))
 
-    return pcpa
+def calc_pcp_tiled(image_a_bgr: np.ndarray, image_b_bgr: np.ndarray, tile_rows: int) -> float:
+    """
+    Calculate pcpa data for a single view, over tiles of tile_rows rows (full width) with a HALO rows margin,
+    so that the peak memory is bounded by the tile size rather than the image size.
+    """
+    height, width = image_a_bgr.shape[:2]
+    total = 0.
+    for row_a in range(0, height, tile_rows):
+        row_b = min(row_a + tile_rows, height)
+        halo_a, halo_b = max(row_a - HALO, 0), min(row_b + HALO, height)
+        pcp_map = calc_pcp_map(stack_ycc([image_a_bgr[halo_a:halo_b]]), stack_ycc([image_b_bgr[halo_a:halo_b]]), 1)
+        total += pcp_map[row_a - halo_a:row_b - halo_a].sum(dtype=np.float64)
+    return total / (height * width)
 
 
-def calc_pcpa(image_a_bgr: np.ndarray, image_b_bgr: np.ndarray) -> float:
+def calc_pcpa_batch(pairs: List[Tuple[np.ndarray, np.ndarray]], max_bytes: int=None) -> List[float]:
     """
-    Calculate pcpa, Trufo's watermark perceptibility measure.
+    Calculate pcpa for a batch of (original, candidate) BGR image pairs.
+    Pairs of the same shape are computed together, and all of them at the fixed size.
+    With max_bytes, the original size pcpa of larger images is computed over tiles (matching within ~1e-5).
     """
-    # original size
-    image_a_ycc = utils.bgr_to_ycc(image_a_bgr)
-    image_b_ycc = utils.bgr_to_ycc(image_b_bgr)
+    if len(pairs) == 0:
+        return []
+    pcpa_a = np.zeros(len(pairs))
 
-    pcpa_a = calc_pcpa_single(image_a_ycc, image_b_ycc)
+    # original size
+    shapes = {}
+    for i, (image_a_bgr, _) in enumerate(pairs):
+        shapes.setdefault(image_a_bgr.shape, []).append(i)
+    for shape, indices in shapes.items():
+        tile_rows = utils.get_tile_rows(shape, BYTES_PER_PIXEL, HALO, max_bytes)
+        if tile_rows is None:
+            pcpa_a[indices] = calc_pcp_batch([pairs[i][0] for i in indices], [pairs[i][1] for i in indices])
+        else:
+            pcpa_a[indices] = [calc_pcp_tiled(pairs[i][0], pairs[i][1], tile_rows) for i in indices]
 
     # fixed size
-    image_a_bgr = utils.resize_frame(image_a_bgr, FIXED_SIZE, FIXED_SIZE)
-    image_b_bgr = utils.resize_frame(image_b_bgr, FIXED_SIZE, FIXED_SIZE)
-
-    image_a_ycc = utils.bgr_to_ycc(image_a_bgr)
-    image_b_ycc = utils.bgr_to_ycc(image_b_bgr)
-
-    pcpa_b = calc_pcpa_single(image_a_ycc, image_b_ycc)
+    pcpa_b = calc_pcp_batch(
+        [utils.resize_frame(image_a_bgr, FIXED_SIZE, FIXED_SIZE) for image_a_bgr, _ in pairs],
+        [utils.resize_frame(image_b_bgr, FIXED_SIZE, FIXED_SIZE) for _, image_b_bgr in pairs],
+    )
 
     # blending
     pcpa = np.sqrt(pcpa_a) * 0.5 + np.sqrt(pcpa_b) * 0.5
@@ -101,4 +178,11 @@ def calc_pcpa(image_a_bgr: np.ndarray, image_b_bgr: np.ndarray) -> float:
     pcpa = np.clip(np.abs(pcpa) * pcpa / (CCC + pcpa * pcpa), 0., None)
     pcpa *= 100. / MAX_PCPA
 
-    return pcpa
+    return pcpa.tolist()
+
+
+def calc_pcpa(image_a_bgr: np.ndarray, image_b_bgr: np.ndarray, max_bytes: int=None) -> float:
+    """
+    Calculate pcpa, Trufo's watermark perceptibility measure.
+    """
+    return calc_pcpa_batch([(image_a_bgr, image_b_bgr)], max_bytes=max_bytes)[0]
@@ -6,13 +6,15 @@ Shared image operations.
 """
 
 import os
+from typing import Tuple, Union
 
 import numpy as np
 import cv2
-from IPython.display import Image, display
 
 
 RANGE_MIDPOINT = 127.5
+# smallest tile for tiled computations, whatever the memory budget
+MIN_TILE_ROWS = 64
 
 
 def bgr_to_ycc(image_bgr: np.ndarray) -> np.ndarray:
@@ -61,10 +63,23 @@ def rotate_frame(image_bgr: np.ndarray, angle: int) -> np.ndarray:
     return cv2.warpAffine(image_bgr, rot_mat, image_bgr.shape[1::-1], flags=cv2.INTER_LINEAR)
 
 
+def get_tile_rows(shape: Tuple[int], bytes_per_pixel: int, halo: int, max_bytes: int=None) -> Union[None, int]:
+    """
+    Number of rows per tile to stay within max_bytes (for a computation needing halo rows of margin),
+    or None if the whole image fits.
+    """
+    height, width = shape[:2]
+    if max_bytes is None or height * width * bytes_per_pixel <= max_bytes:
+        return None
+    return max(max_bytes // (width * bytes_per_pixel) - 2 * halo, MIN_TILE_ROWS)
+
+
 def display_frame(image_bgr: np.ndarray) -> None:
     """
-    Displays a frame using IPython.
+    Displays a frame using IPython (only imported here, as it is slow to import and only needed in debug mode).
     """
+    from IPython.display import Image, display
+
     location = 'tmp.jpg'
     cv2.imwrite(location, image_bgr)
 
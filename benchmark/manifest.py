@@ -0,0 +1,151 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Dataset manifests: the images of a dataset directory, with their content hashes and dimensions.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import functools
+import mimetypes
+import concurrent.futures
+from typing import Dict, List, NamedTuple, Union
+
+from benchmark import frames
+
+
+class ManifestEntry(NamedTuple):
+    # file name, in the dataset directory
+    name: str
+    # SHA-256 of the file contents (hex)
+    sha256: str
+    # MIME type, from the file extension (as in the results' content_format)
+    format: str
+    # dimensions of the image as read for the benchmark (BGR), or 0 if it cannot be decoded
+    height: int
+    width: int
+    channels: int
+    # file size (bytes) and modification time (ns), to tell whether the entry is still current
+    size: int
+    mtime_ns: int
+
+
+def manifest_path(directory: str) -> str:
+    # (kept next to the directory, so that writing it does not change the directory's modification time)
+    directory = os.path.abspath(directory)
+    return f"{os.path.dirname(directory)}/.{os.path.basename(directory)}.manifest.json"
+
+
+class DatasetManifest():
+    """
+    Content hashes, formats and dimensions of the images in a dataset directory, built once and loaded instantly.
+    The manifest lists the directory's images without globbing it, as long as no file was added or removed
+    (the directory's modification time is unchanged); an entry is used as long as its file's size and
+    modification time are unchanged (otherwise, the file is hashed again).
+    """
+    def __init__(self, directory: str, entries: Dict[str, ManifestEntry], mtime_ns: int):
+        self.directory = os.path.abspath(directory)
+        self.entries = entries
+        self.mtime_ns = mtime_ns
+
+    def is_current(self) -> bool:
+        return os.stat(self.directory).st_mtime_ns == self.mtime_ns
+
+    def filepaths(self) -> List[str]:
+        return [f"{self.directory}/{name}" for name in sorted(self.entries)]
+
+    def get(self, filepath: str) -> Union[None, ManifestEntry]:
+        entry = self.entries.get(os.path.basename(filepath))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+            return None
+        return entry
+
+    def to_dict(self) -> Dict:
+        return {
+            'directory' : self.directory,
+            'mtime_ns' : self.mtime_ns,
+            'entries' : [entry._asdict() for _, entry in sorted(self.entries.items())],
+        }
+
+    def save(self):
+        # (written to a temporary file and renamed into place, so that readers never see a partial manifest)
+        filepath = manifest_path(self.directory)
+        tmp_filepath = f"{os.path.dirname(filepath)}/{os.path.basename(filepath)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filepath, 'w') as manifest_file:
+            json.dump(self.to_dict(), manifest_file)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, directory: str) -> Union[None, 'DatasetManifest']:
+        try:
+            with open(manifest_path(directory), 'r') as manifest_file:
+                data = json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+        entries = {entry['name']: ManifestEntry(**entry) for entry in data['entries']}
+        return cls(directory, entries, data['mtime_ns'])
+
+    @classmethod
+    def build(cls, directory: str, filepaths: List[str], workers: int=1) -> 'DatasetManifest':
+        """
+        Build the manifest of the given images of a directory, reusing the current entries of its previous manifest.
+        The dimensions are read from the prepared frames, if any (see frames.FrameStore), or by decoding the images
+        (cv2 decodes without the GIL, so workers are threads).
+        """
+        previous = cls.load(directory)
+
+        def build_entry(filepath):
+            if previous is not None:
+                entry = previous.get(filepath)
+                if entry is not None:
+                    return entry
+            stat = os.stat(filepath)
+            with open(filepath, 'rb') as image_file:
+                image_bytes = image_file.read()
+            image_bgr = frames.load_frame(filepath, image_bytes)
+            height, width, channels = image_bgr.shape if image_bgr is not None else (0, 0, 0)
+            return ManifestEntry(
+                name=os.path.basename(filepath),
+                sha256=hashlib.sha256(image_bytes).hexdigest(),
+                format=mimetypes.guess_type(filepath)[0] or "image/unknown",
+                height=height,
+                width=width,
+                channels=channels,
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+            )
+
+        mtime_ns = os.stat(directory).st_mtime_ns
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            entries = list(executor.map(build_entry, filepaths))
+        return cls(directory, {entry.name: entry for entry in entries}, mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def find_manifest(directory: str) -> Union[None, DatasetManifest]:
+    """
+    Get the manifest of a dataset directory, if it was built (loaded once per process).
+    """
+    return DatasetManifest.load(directory)
+
+
+def content_hash(filepath: str) -> str:
+    """
+    Get the SHA-256 of an image file, from the manifest of its directory if current, or by hashing the file.
+    """
+    manifest = find_manifest(os.path.dirname(os.path.abspath(filepath)))
+    if manifest is not None:
+        entry = manifest.get(filepath)
+        if entry is not None:
+            return entry.sha256
+    with open(filepath, 'rb') as image_file:
+        return hashlib.sha256(image_file.read()).hexdigest()
@@ -0,0 +1,212 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Evaluation of several wrappers and evaluation modes in a single pass over the images.
+"""
+
+import hashlib
+import logging
+import tracemalloc
+import concurrent.futures
+import multiprocessing.util
+from typing import Iterator, List, NamedTuple, Set
+
+from benchmark import durability
+from benchmark import evaluate
+from benchmark import cache
+from benchmark import invisibility
+from benchmark.cache import EditCache, EncodeCache, MemoryEditCache
+from benchmark.image.edit import EditMemo
+
+from wrappers.wrapper import ImageWrapper
+
+
+class MatrixRun(NamedTuple):
+    # index of the wrapper, in the list of wrappers
+    wrapper: int
+    # the edits applied
+    evaluation: durability.ImageRobustnessTests
+    # whether the image is watermarked first (otherwise, the edits apply to the original image)
+    encode: bool
+
+
+# per-process wrappers, set once by the pool initializer
+_worker_wrappers = None
+_worker_encode_cache = None
+_worker_edit_cache = None
+
+
+def evaluate_matrix_image(
+    filepath: str,
+    wrappers: List[ImageWrapper],
+    runs: List[MatrixRun],
+    needed: List[int]=None,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    early_stop: int=None,
+) -> List[List[dict]]:
+    """
+    Evaluate an image for the needed runs (all of them, by default), returning the results of each run.
+    The image is read once; each wrapper encodes it once, for all of its runs; and each edited image is generated
+    once per source image (the original, for the runs without encoding, or a wrapper's watermarked image),
+    then decoded by every run that uses it. The results match those of separate runs (except for the timings).
+    """
+    if needed is None:
+        needed = list(range(len(runs)))
+    image_name = evaluate.get_image_name(filepath)
+    image_bytes, image_bgr, timings = evaluate.read_image(filepath)
+    random_seed = evaluate.content_random_seed(hashlib.sha256(image_bytes).hexdigest())
+
+    # the edited images are shared within each source image, so the runs are grouped by source
+    shared_edits = MemoryEditCache() if edit_cache is None else edit_cache
+    memo = EditMemo()
+    source, encodings = -1, {}
+    run_results = [[] for _ in runs]
+    for r in sorted(needed, key=lambda r: (runs[r].encode, runs[r].wrapper)):
+        run = runs[r]
+        wrapper = wrappers[run.wrapper]
+        payload_bits = evaluate.draw_payload(random_seed, wrapper.payload_size)
+
+        try:
+            if run.encode:
+                if run.wrapper not in encodings:
+                    encodings[run.wrapper] = evaluate.encode_images(
+                        [filepath],
+                        wrapper,
+                        encode_cache=encode_cache,
+                        metrics_max_bytes=metrics_max_bytes,
+                        metrics_backend=metrics_backend,
+                        images=[(image_bytes, image_bgr, payload_bits, timings)],
+                    )[0]
+                enc_results, _, enc_image_bytes, enc_image_bgr = encodings[run.wrapper]
+                results = [enc_result.copy() for enc_result in enc_results]
+            else:
+                results, enc_image_bytes, enc_image_bgr = [], image_bytes, image_bgr
+
+            if enc_image_bgr is not None:
+                if (run.wrapper if run.encode else None) != source:
+                    source = run.wrapper if run.encode else None
+                    memo.reset()
+                    if edit_cache is None:
+                        shared_edits.clear()
+                results.extend(evaluate.decode_image(
+                    image_name,
+                    enc_image_bgr,
+                    payload_bits,
+                    wrapper,
+                    durability.image_edits(run.evaluation),
+                    image_hash=hashlib.sha256(enc_image_bytes).hexdigest(),
+                    edit_cache=shared_edits,
+                    memo=memo,
+                    batch_size=batch_size,
+                    batch_bytes=batch_bytes,
+                    early_stop=early_stop,
+                ))
+        except Exception:
+            logging.error(f"Evaluation error ({filepath}, {wrapper.name}, {run.evaluation.value}):", exc_info=True)
+            results = [evaluate.error_result(filepath, encode=run.encode)]
+        run_results[r] = results
+
+    return run_results
+
+
+def _init_worker(wrapper_classes, encode_cache, edit_cache, trace_memory=False):
+    global _worker_wrappers, _worker_encode_cache, _worker_edit_cache
+    if trace_memory:
+        tracemalloc.start()
+    _worker_wrappers = [wrapper_class() for wrapper_class in wrapper_classes]
+    for wrapper in _worker_wrappers:
+        evaluate.setup_wrapper(wrapper)
+        multiprocessing.util.Finalize(None, wrapper.teardown, exitpriority=10)
+    _worker_encode_cache = encode_cache
+    _worker_edit_cache = edit_cache
+    # (the copies start from the coordinator's counts, which are not the worker's to report)
+    cache.take_stats([_worker_encode_cache, _worker_edit_cache])
+
+
+def _matrix_task(args):
+    filepath, runs, needed, batch_size, batch_bytes, metrics_max_bytes, metrics_backend, early_stop = args
+    run_results = evaluate_matrix_image(
+        filepath, _worker_wrappers, runs, needed=needed,
+        encode_cache=_worker_encode_cache, edit_cache=_worker_edit_cache,
+        batch_size=batch_size, batch_bytes=batch_bytes,
+        metrics_max_bytes=metrics_max_bytes, metrics_backend=metrics_backend, early_stop=early_stop,
+    )
+    return run_results, cache.take_stats([_worker_encode_cache, _worker_edit_cache])
+
+
+def evaluate_matrix(
+    wrapper_classes: List[type],
+    filepaths: List[str],
+    runs: List[MatrixRun],
+    done: List[Set[str]]=None,
+    workers: int=1,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    trace_memory: bool=False,
+    early_stop: int=None,
+) -> Iterator[List[List[dict]]]:
+    """
+    Evaluate the images for every run (see evaluate_matrix_image), yielding the results of each image, per run,
+    in the order of the filepaths. The images already done by a run (by image name) are skipped for that run.
+    With workers > 1, the images are spread across a process pool, in which each worker sets up every wrapper;
+    otherwise, the wrappers are set up (and torn down) in this process; either way, the cache statistics end up
+    in encode_cache and edit_cache.
+    """
+    if done is None:
+        done = [set() for _ in runs]
+    tasks = []
+    for filepath in filepaths:
+        image_name = evaluate.get_image_name(filepath)
+        tasks.append((filepath, [r for r in range(len(runs)) if image_name not in done[r]]))
+
+    if workers <= 1:
+        wrappers = [wrapper_class() for wrapper_class in wrapper_classes]
+        for wrapper in wrappers:
+            evaluate.setup_wrapper(wrapper)
+        try:
+            for filepath, needed in tasks:
+                yield evaluate_matrix_image(
+                    filepath, wrappers, runs, needed=needed,
+                    encode_cache=encode_cache, edit_cache=edit_cache,
+                    batch_size=batch_size, batch_bytes=batch_bytes,
+                    metrics_max_bytes=metrics_max_bytes, metrics_backend=metrics_backend, early_stop=early_stop,
+                )
+        finally:
+            for wrapper in wrappers:
+                wrapper.teardown()
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(wrapper_classes, encode_cache, edit_cache, trace_memory),
+    ) as executor:
+        def collect(future):
+            run_results, cache_stats = future.result()
+            cache.add_stats([encode_cache, edit_cache], cache_stats)
+            return run_results
+
+        # (at most 2 images per worker are in flight, so that results are held briefly)
+        futures = []
+        try:
+            for k, (filepath, needed) in enumerate(tasks):
+                futures.append(executor.submit(_matrix_task, (
+                    filepath, runs, needed, batch_size, batch_bytes, metrics_max_bytes, metrics_backend, early_stop,
+                )))
+                if k + 1 >= 2 * workers:
+                    yield collect(futures.pop(0))
+            while futures:
+                yield collect(futures.pop(0))
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,299 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Parallel evaluation over a process pool.
+"""
+
+import hashlib
+import logging
+import itertools
+import tracemalloc
+import concurrent.futures
+import multiprocessing.util
+from typing import Iterator, List
+
+from benchmark import durability
+from benchmark import evaluate
+from benchmark import invisibility
+from benchmark import cache
+from benchmark import transport
+from benchmark.cache import EditCache, EncodeCache
+from benchmark.image.edit import EditMemo
+
+
+# per-process wrapper instance (and caches), set once by the pool initializer
+_worker_wrapper = None
+_worker_encode_cache = None
+_worker_edit_cache = None
+# per-process image currently being decoded (and its shared memory mapping, if any), and its memoized edit steps
+_worker_frames = {}
+_worker_shared_frame = None
+_worker_memo = EditMemo()
+
+
+def _init_worker(wrapper_class, encode_cache, edit_cache, trace_memory=False):
+    global _worker_wrapper, _worker_encode_cache, _worker_edit_cache
+    if trace_memory:
+        tracemalloc.start()
+    _worker_wrapper = wrapper_class()
+    evaluate.setup_wrapper(_worker_wrapper)
+    # (worker processes exit without running atexit handlers, but do run multiprocessing finalizers)
+    multiprocessing.util.Finalize(None, _worker_wrapper.teardown, exitpriority=10)
+    _worker_encode_cache = encode_cache
+    _worker_edit_cache = edit_cache
+    # (the copies start from the coordinator's counts, which are not the worker's to report)
+    cache.take_stats([_worker_encode_cache, _worker_edit_cache])
+
+
+def evaluate_image_safe(
+    filepath: str,
+    wrapper,
+    evaluation: durability.ImageRobustnessTests,
+    encode: bool=True,
+    debug_mode: bool=False,
+    random_seed: int=None,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    early_stop: int=None,
+) -> List[dict]:
+    """
+    Evaluate an image; a failure is reported as an error row instead of being raised.
+    """
+    try:
+        return evaluate.evaluate_image(
+            filepath,
+            wrapper,
+            evaluation,
+            encode=encode,
+            debug_mode=debug_mode,
+            random_seed=random_seed,
+            encode_cache=encode_cache,
+            edit_cache=edit_cache,
+            metrics_max_bytes=metrics_max_bytes,
+            metrics_backend=metrics_backend,
+            early_stop=early_stop,
+        )
+    except Exception:
+        logging.error(f"Evaluation error ({filepath}):", exc_info=True)
+        return [evaluate.error_result(filepath, encode=encode)]
+
+
+def evaluate_images_safe(
+    filepaths: List[str],
+    wrapper,
+    evaluation: durability.ImageRobustnessTests,
+    encode: bool=True,
+    debug_mode: bool=False,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    early_stop: int=None,
+) -> Iterator[List[dict]]:
+    """
+    Evaluate images serially, batch_size at a time; if a group of images fails, its images are retried one by one,
+    so that a failure is reported as error rows of the image(s) at fault.
+    """
+    for k in range(0, len(filepaths), batch_size):
+        group = filepaths[k:k + batch_size]
+        try:
+            group_results = list(evaluate.evaluate_images(
+                group,
+                wrapper,
+                evaluation,
+                encode=encode,
+                debug_mode=debug_mode,
+                encode_cache=encode_cache,
+                edit_cache=edit_cache,
+                batch_size=batch_size,
+                batch_bytes=batch_bytes,
+                metrics_max_bytes=metrics_max_bytes,
+                metrics_backend=metrics_backend,
+                early_stop=early_stop,
+            ))
+        except Exception:
+            logging.error(f"Evaluation error ({', '.join(group)}), retrying one image at a time:", exc_info=True)
+            group_results = [evaluate_image_safe(
+                filepath,
+                wrapper,
+                evaluation,
+                encode=encode,
+                debug_mode=debug_mode,
+                encode_cache=encode_cache,
+                edit_cache=edit_cache,
+                metrics_max_bytes=metrics_max_bytes,
+                metrics_backend=metrics_backend,
+                early_stop=early_stop,
+            ) for filepath in group]
+        yield from group_results
+
+
+def _set_worker_frame(image_name: str, image_bgr, shared_frame: transport.SharedFrame=None):
+    global _worker_frames, _worker_shared_frame
+    # (the previous image and its edit steps are dropped first, so that its shared memory can be unmapped)
+    _worker_frames = {}
+    _worker_memo.reset()
+    if _worker_shared_frame is not None:
+        _worker_shared_frame.close()
+    _worker_frames = {image_name: image_bgr}
+    _worker_shared_frame = shared_frame
+
+
+def _worker_frame(image_name: str, handle: transport.FrameHandle):
+    """
+    Map an image once per worker (from the shared memory of the worker that encoded it, without copying),
+    and reuse it for the following tasks on the same image.
+    """
+    if image_name not in _worker_frames:
+        shared_frame = transport.SharedFrame(handle)
+        _set_worker_frame(image_name, shared_frame.array, shared_frame)
+    return _worker_frames[image_name]
+
+
+def _encode_task(args):
+    results, payload_bits, handle, image_hash = _encode_image(*args)
+    return results, payload_bits, handle, image_hash, cache.take_stats([_worker_encode_cache, _worker_edit_cache])
+
+
+def _encode_image(filepath, encode, random_seed, metrics_max_bytes, metrics_backend, frame_name):
+    try:
+        results, payload_bits, enc_image_bytes, enc_image_bgr = evaluate.encode_image(
+            filepath, _worker_wrapper, encode=encode, random_seed=random_seed, encode_cache=_worker_encode_cache,
+            metrics_max_bytes=metrics_max_bytes,
+            metrics_backend=metrics_backend,
+        )
+    except Exception:
+        logging.error(f"Evaluation error ({filepath}):", exc_info=True)
+        return [evaluate.error_result(filepath, encode=encode)], None, None, None
+
+    if enc_image_bgr is None:
+        return results, payload_bits, None, None
+    _set_worker_frame(evaluate.get_image_name(filepath), enc_image_bgr)
+    # (the image goes to the other workers through shared memory, instead of being pickled with every decode task)
+    image_hash = hashlib.sha256(enc_image_bytes).hexdigest() if _worker_edit_cache is not None else None
+    return results, payload_bits, transport.share_frame(frame_name, enc_image_bgr), image_hash
+
+
+def _decode_task(args):
+    return _decode_image(*args), cache.take_stats([_worker_encode_cache, _worker_edit_cache])
+
+
+def _decode_image(image_name, handle, image_hash, payload_bits, edits, batch_bytes, early_stop):
+    try:
+        enc_image_bgr = _worker_frame(image_name, handle)
+        return evaluate.decode_image(
+            image_name, enc_image_bgr, payload_bits, _worker_wrapper, edits,
+            image_hash=image_hash, edit_cache=_worker_edit_cache, memo=_worker_memo,
+            batch_size=(1 if early_stop else len(edits)), batch_bytes=batch_bytes, early_stop=early_stop,
+        )
+    except Exception:
+        logging.error(f"Evaluation error ({image_name}, {', '.join(type(edit).__name__ for edit in edits)}):", exc_info=True)
+        dec_results = []
+        for edit in edits:
+            dec_result = evaluate.IMAGE_RESULTS.copy()
+            dec_result['operation'] = "decode"
+            dec_result['content_id'] = image_name
+            dec_result['content_format'] = "image"
+            dec_result['edit_type'] = type(edit).__name__
+            dec_result['error'] = True
+            dec_results.append(dec_result)
+        return dec_results
+
+
+def evaluate_images(
+    wrapper_class,
+    filepaths: List[str],
+    evaluation: durability.ImageRobustnessTests,
+    encode: bool=True,
+    workers: int=1,
+    encode_cache: EncodeCache=None,
+    edit_cache: EditCache=None,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    metrics_max_bytes: int=invisibility.DEFAULT_MAX_BYTES,
+    metrics_backend: invisibility.MetricsBackend=invisibility.DEFAULT_METRICS_BACKEND,
+    trace_memory: bool=False,
+    early_stop: int=None,
+    shared_bytes: int=transport.DEFAULT_SHARED_BYTES,
+) -> Iterator[List[dict]]:
+    """
+    Evaluate images across a pool of worker processes, each with its own wrapper instance (set up once per worker).
+    The work is split into one encode task per image, followed (once the image is encoded) by one decode task per
+    (edit, parameter), so that the makespan is bounded by the largest single task rather than the largest image.
+    With batch_size > 1, decode tasks are made of batch_size consecutive (edit, parameter)s, decoded as batches.
+    With early_stop, each severity chain is a single decode task instead, so that it can stop early.
+    The per-image results are yielded as they complete, in the order of the filepaths.
+    Each encoded image reaches the workers decoding it through shared memory (see transport.FrameTransport),
+    released once all of its decode tasks are done; new images are started within shared_bytes of shared images.
+    The workers' cache statistics are summed into encode_cache and edit_cache, as with a serial run.
+    """
+    if early_stop:
+        edit_tasks = durability.image_edit_chains(evaluation)
+    else:
+        edit_tasks = durability.image_edit_tasks(evaluation)
+        edit_tasks = [edit_tasks[k:k + batch_size] for k in range(0, len(edit_tasks), batch_size)]
+    # images are held in memory until yielded, so the number of open images is capped
+    max_images = 2 * workers
+
+    image_slots = [None] * len(filepaths)
+    image_pending = [0] * len(filepaths)
+    futures = {}
+
+    # (the shared images are released after the pool shuts down, so that no running task creates one afterwards)
+    with transport.FrameTransport(shared_bytes) as shared_frames, concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(wrapper_class, encode_cache, edit_cache, trace_memory),
+    ) as executor:
+        try:
+            next_image, next_yield = 0, 0
+            while next_yield < len(filepaths):
+
+                # start encoding new images
+                while next_image < len(filepaths) and next_image - next_yield < max_images and shared_frames.has_room():
+                    # (seeds are derived from the image contents by the workers, so that they match a serial run)
+                    filepath, frame_name = filepaths[next_image], shared_frames.frame_name(next_image)
+                    args = (filepath, encode, None, metrics_max_bytes, metrics_backend, frame_name)
+                    shared_frames.open(next_image)
+                    futures[executor.submit(_encode_task, args)] = (next_image, None)
+                    next_image += 1
+
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i, j = futures.pop(future)
+
+                    # encode task: fan out the decode tasks
+                    if j is None:
+                        results, payload_bits, handle, image_hash, cache_stats = future.result()
+                        image_slots[i] = [results] + [[] for _ in edit_tasks]
+                        if handle is not None:
+                            shared_frames.opened(i, handle)
+                            image_name = evaluate.get_image_name(filepaths[i])
+                            for j, edits in enumerate(edit_tasks):
+                                args = (image_name, handle, image_hash, payload_bits, edits, batch_bytes, early_stop)
+                                futures[executor.submit(_decode_task, args)] = (i, j)
+                            image_pending[i] = len(edit_tasks)
+
+                    # decode task
+                    else:
+                        image_slots[i][j + 1], cache_stats = future.result()
+                        image_pending[i] -= 1
+                    cache.add_stats([encode_cache, edit_cache], cache_stats)
+
+                    if image_pending[i] == 0:
+                        shared_frames.release(i)
+
+                # yield the completed images, in order
+                while next_yield < next_image and image_slots[next_yield] is not None and image_pending[next_yield] == 0:
+                    yield list(itertools.chain.from_iterable(image_slots[next_yield]))
+                    image_slots[next_yield] = None
+                    next_yield += 1
+        finally:
+            # (if the consumer stops early, or a worker crashed, the queued tasks are dropped)
+            for future in futures:
+                future.cancel()
@@ -5,4 +5,375 @@ SPDX-License-Identifier: MIT
 Assessment of reliability.
 """
 
-# [TODO]
+import enum
+import math
+import logging
+import concurrent.futures
+import multiprocessing.util
+from typing import Dict, Iterator, List, NamedTuple
+
+import numpy as np
+
+from benchmark import durability
+from benchmark import evaluate
+from benchmark import frames
+from benchmark import sampling
+from benchmark.image import utils
+from benchmark.image.edit import EditMemo
+
+
+class ImageReliabilityTests(enum.Enum):
+    V1_QUICK = 'QUICK'
+    V1_FULL = 'FULL'
+
+
+class TrialKind(enum.Enum):
+    """
+    Kinds of false-positive trials: each decodes an edited image, and checks it against the claimed payload
+    of its kind (fixed for the whole run).
+    """
+    # the original (unwatermarked) image
+    UNMARKED = 'UNMARKED'
+    # the image watermarked with another (random) payload than the claimed one
+    REKEYED = 'REKEYED'
+
+
+class SPRTDecision(enum.Enum):
+    # the false-positive rate is within the bound
+    CONFIRMED = 'CONFIRMED'
+    # the false-positive rate exceeds the bound
+    REFUTED = 'REFUTED'
+    # out of trials before a decision
+    UNDECIDED = 'UNDECIDED'
+
+
+class ReliabilityPlan(NamedTuple):
+    # false-positive rate bound to confirm (or refute)
+    fpr: float
+    # confidence level of the decision
+    confidence: float
+    # trials per kind, at most
+    max_trials: int
+    # trials per task (on a single image)
+    chunk_size: int
+    # the edits applied to the images (the seeded ones are cycled through, with fresh random seeds)
+    edits: durability.ImageRobustnessTests
+    # a decoded payload within this many bit errors of the claimed payload is a positive
+    max_bit_errors: int = 0
+
+
+def reliability_plan(tests: ImageReliabilityTests, fpr: float=None, confidence: float=None) -> ReliabilityPlan:
+    """
+    Get the false-positive rate bound and the trial budget of a reliability evaluation mode.
+    The mode's bound and confidence level can be overridden, in which case the trial budget is scaled
+    to the same multiple of 1 / fpr.
+    """
+    plan = _preset_plan(tests)
+    if fpr is not None:
+        if not 0. < fpr < 1.:
+            raise ValueError(f"The false-positive rate bound must be in (0, 1): {fpr}.")
+        plan = plan._replace(fpr=fpr, max_trials=math.ceil(plan.max_trials * plan.fpr / fpr))
+    if confidence is not None:
+        if not 0.5 < confidence < 1.:
+            raise ValueError(f"The confidence level must be in (0.5, 1): {confidence}.")
+        plan = plan._replace(confidence=confidence)
+    return plan
+
+
+def _preset_plan(tests: ImageReliabilityTests) -> ReliabilityPlan:
+    if tests is ImageReliabilityTests.V1_QUICK:
+        return ReliabilityPlan(
+            fpr=1e-3,
+            confidence=0.95,
+            max_trials=20000,
+            chunk_size=250,
+            edits=durability.ImageRobustnessTests.V1_QUICK,
+        )
+    if tests is ImageReliabilityTests.V1_FULL:
+        return ReliabilityPlan(
+            fpr=1e-6,
+            confidence=0.99,
+            max_trials=10 ** 8,
+            chunk_size=2000,
+            edits=durability.ImageRobustnessTests.V1_FULL,
+        )
+    raise NotImplementedError
+
+
+class SequentialTest():
+    """
+    Wald's sequential probability ratio test of a false-positive rate p, between H0: p = fpr / 2 and H1: p = fpr,
+    with both error rates at 1 - confidence. Only the running counts are kept, so memory use is constant.
+    Accepting H0 confirms the bound; accepting H1 refutes it.
+    The trials are assumed to be independent (see evaluate_reliability).
+    """
+    def __init__(self, fpr: float, confidence: float):
+        p0, p1 = fpr / 2., fpr
+        alpha = beta = 1. - confidence
+        self.upper = math.log((1. - beta) / alpha)
+        self.lower = math.log(beta / (1. - alpha))
+        self.llr_positive = math.log(p1 / p0)
+        self.llr_negative = math.log1p(-p1) - math.log1p(-p0)
+        self.trials = 0
+        self.positives = 0
+
+    def update(self, trials: int, positives: int):
+        self.trials += trials
+        self.positives += positives
+
+    @property
+    def llr(self) -> float:
+        return self.positives * self.llr_positive + (self.trials - self.positives) * self.llr_negative
+
+    @property
+    def decision(self) -> SPRTDecision:
+        if self.llr >= self.upper:
+            return SPRTDecision.REFUTED
+        if self.llr <= self.lower:
+            return SPRTDecision.CONFIRMED
+        return SPRTDecision.UNDECIDED
+
+
+# design effect of the positives over images above which the trials are reported as not independent
+MAX_DESIGN_EFFECT = 2.
+
+
+def positives_design_effect(image_counts) -> float:
+    """
+    Get the design effect of the positives over images (1 if independent), from the (positives, trials) of each image.
+    """
+    sums = [0] * 6
+    for positives, trials in image_counts:
+        sampling.add_image_sums(sums, positives, trials)
+    return sampling.design_effect(sums)
+
+
+# per-process wrapper instance, set once by the pool initializer
+_worker_wrapper = None
+
+
+def _init_worker(wrapper_class):
+    global _worker_wrapper
+    _worker_wrapper = wrapper_class()
+    evaluate.setup_wrapper(_worker_wrapper)
+    multiprocessing.util.Finalize(None, _worker_wrapper.teardown, exitpriority=10)
+
+
+def claimed_payload(random_seed: int, kind: TrialKind, payload_size: int) -> np.ndarray:
+    """
+    Get the claimed payload of a trial kind, which every trial of the kind is checked against.
+    """
+    rng = np.random.default_rng((random_seed, list(TrialKind).index(kind)))
+    return rng.integers(2, size=payload_size).astype(bool)
+
+
+def is_positive(wrapper, kind: TrialKind, dec_payload_bits, claimed_bits: np.ndarray, max_bit_errors: int) -> bool:
+    """
+    Whether a decoding is a false positive: on an unwatermarked image, any detection (for wrappers with a detection
+    stage); otherwise, a decoded payload within max_bit_errors of the claimed one.
+    """
+    if dec_payload_bits is None:
+        return False
+    if wrapper.detects and kind is TrialKind.UNMARKED:
+        return True
+    return np.count_nonzero(dec_payload_bits != claimed_bits) <= max_bit_errors
+
+
+def _reliability_task(args) -> Dict[str, float]:
+    """
+    Run a chunk of trials of one kind on one image, and return the counts only.
+    Identical decoder inputs are not independent trials, so the unseeded edits (which give the same image for
+    any seed) are only run with include_unseeded (on the first visit of an unwatermarked image, or on a newly
+    watermarked one), and the rounds after the first only run the seeded edits, with fresh seeds.
+    """
+    filepath, kind, plan, claimed_bits, include_unseeded, chunk_seed, batch_size, batch_bytes = args
+    counts = {'trials' : 0, 'positives' : 0, 'errors' : 0, 'time_taken_ms' : 0.}
+    rng = np.random.default_rng(chunk_seed)
+    as_array = _worker_wrapper.implements('decode_array')
+
+    with open(filepath, 'rb') as image_file:
+        image_bgr = frames.load_frame(filepath, image_file.read())
+    key_bits = None
+    if kind is TrialKind.REKEYED:
+        key_bits = rng.integers(2, size=_worker_wrapper.payload_size).astype(bool)
+        # (the embedded payload is never the claimed one, which would be a true positive)
+        while np.array_equal(key_bits, claimed_bits):
+            key_bits = rng.integers(2, size=_worker_wrapper.payload_size).astype(bool)
+        image = image_bgr if _worker_wrapper.implements('encode_array') else utils.bgr_to_bytes(image_bgr)
+        outputs, errors, _ = evaluate.run_batch(
+            lambda images: _worker_wrapper.encode_batch(images, [key_bits] * len(images)),
+            [image],
+            [f"Encoding error ({filepath})"],
+        )
+        if errors[0]:
+            counts['errors'] = plan.chunk_size
+            return counts
+        image_bgr = outputs[0] if isinstance(outputs[0], np.ndarray) else utils.bytes_to_bgr(outputs[0])
+
+    def edited_images():
+        # cycle through the seeded edits, with fresh random seeds for each round
+        trials, first_round = 0, include_unseeded
+        while True:
+            memo = EditMemo()
+            edit_tasks = durability.image_edit_tasks(plan.edits, random_seed=int(rng.integers(2 ** 32)))
+            if not first_round:
+                edit_tasks = [edit for edit in edit_tasks if edit.SEEDED]
+                if len(edit_tasks) == 0:
+                    return
+            first_round = False
+            for edit in edit_tasks:
+                for _, mod_image_shape, mod_image, _ in evaluate.edit_image(image_bgr, edit, memo=memo, as_array=as_array):
+                    is_array = isinstance(mod_image, np.ndarray)
+                    yield (is_array, mod_image_shape), (mod_image.nbytes if is_array else len(mod_image)), mod_image
+                    trials += 1
+                    if trials == plan.chunk_size:
+                        return
+
+    for batch in evaluate.batched(edited_images(), batch_size, batch_bytes):
+        outputs, errors, usage = evaluate.run_batch(
+            _worker_wrapper.decode_batch, batch, [f"Decoding error ({filepath}, {kind.value})"] * len(batch),
+        )
+        counts['time_taken_ms'] += usage['time_taken_ms'] * len(batch)
+        for dec_payload_bits, error in zip(outputs, errors):
+            if error:
+                counts['errors'] += 1
+                continue
+            counts['trials'] += 1
+            if is_positive(_worker_wrapper, kind, dec_payload_bits, claimed_bits, plan.max_bit_errors):
+                counts['positives'] += 1
+
+    return counts
+
+
+def reliability_result(
+    kind: TrialKind,
+    plan: ReliabilityPlan,
+    test: SequentialTest,
+    time_taken_ms: float,
+    design_effect: float,
+) -> dict:
+    result = evaluate.IMAGE_RESULTS.copy()
+    result['operation'] = "decode"
+    result['content_id'] = kind.value
+    result['content_format'] = "image"
+    result['time_taken_ms'] = time_taken_ms / max(test.trials, 1)
+    result['trial_kind'] = kind.value
+    result['trials'] = test.trials
+    result['positives'] = test.positives
+    result['fpr_bound'] = plan.fpr
+    result['fpr_confidence'] = plan.confidence
+    result['sprt_decision'] = test.decision.value
+    result['design_effect'] = design_effect
+    return result
+
+
+def evaluate_reliability(
+    wrapper_class,
+    filepaths: List[str],
+    tests: ImageReliabilityTests,
+    workers: int=1,
+    random_seed: int=0,
+    batch_size: int=1,
+    batch_bytes: int=evaluate.DEFAULT_BATCH_BYTES,
+    fpr: float=None,
+    confidence: float=None,
+) -> Iterator[List[dict]]:
+    """
+    Estimate the false-positive rate of a wrapper, streaming (image, edit) trials of each kind through the decoder
+    across a pool of worker processes, in chunks of trials on a single image, checked against a fixed claimed payload
+    per kind (the REKEYED images are watermarked with other payloads, a new one per chunk).
+    Chunks are scheduled round-robin over the kinds and images, and their counts are tallied in order,
+    so the stopping point does not depend on the number of workers. A kind stops once its sequential test decides,
+    or after max_trials; yields one summary row per kind. fpr and confidence override those of the evaluation mode.
+    The sequential test assumes independent trials, while the trials are (image, edit, seed) combinations of the
+    dataset images, many per image: this holds if every image has the same false-positive rate. The design effect
+    of the positives over images (see sampling.design_effect) is reported with each kind, and a warning is logged
+    if it is above MAX_DESIGN_EFFECT, i.e. the positives cluster on a few images (the decision is then optimistic,
+    and more distinct images are needed).
+    """
+    plan = reliability_plan(tests, fpr=fpr, confidence=confidence)
+    kinds = list(TrialKind)
+    payload_size = wrapper_class().payload_size
+    claimed = {kind: claimed_payload(random_seed, kind, payload_size) for kind in kinds}
+    sequential_tests = {kind: SequentialTest(plan.fpr, plan.confidence) for kind in kinds}
+    attempted = {kind: 0 for kind in kinds}
+    # (positives and trials of each image, per kind)
+    image_counts = {kind: {} for kind in kinds}
+    time_taken_ms = {kind: 0. for kind in kinds}
+    if len(filepaths) == 0:
+        return
+
+    def is_active(kind):
+        return (
+            sequential_tests[kind].decision is SPRTDecision.UNDECIDED
+            and attempted[kind] < plan.max_trials
+        )
+
+    max_chunks = len(kinds) * math.ceil(plan.max_trials / plan.chunk_size)
+    futures = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(wrapper_class,),
+    ) as executor:
+        next_chunk, next_tally, pending = 0, 0, {}
+        while any(is_active(kind) for kind in kinds):
+
+            # keep a bounded number of chunks in flight
+            while next_chunk < max_chunks and len(futures) < 2 * workers:
+                kind = kinds[next_chunk % len(kinds)]
+                if is_active(kind):
+                    visit, k = divmod(next_chunk // len(kinds), len(filepaths))
+                    include_unseeded = visit == 0 or kind is TrialKind.REKEYED
+                    args = (
+                        filepaths[k], kind, plan, claimed[kind], include_unseeded,
+                        (random_seed, next_chunk), batch_size, batch_bytes,
+                    )
+                    futures[executor.submit(_reliability_task, args)] = next_chunk
+                else:
+                    pending[next_chunk] = None
+                next_chunk += 1
+            if len(futures) == 0 and next_tally == next_chunk:
+                break
+
+            if len(futures) > 0:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending[futures.pop(future)] = future.result()
+
+            # tally the completed chunks, in order (chunks of kinds decided in the meantime are dropped)
+            while next_tally in pending:
+                counts = pending.pop(next_tally)
+                kind = kinds[next_tally % len(kinds)]
+                if counts is not None and is_active(kind):
+                    sequential_tests[kind].update(counts['trials'], counts['positives'])
+                    k = (next_tally // len(kinds)) % len(filepaths)
+                    positives_trials = image_counts[kind].setdefault(k, [0, 0])
+                    positives_trials[0] += counts['positives']
+                    positives_trials[1] += counts['trials']
+                    attempted[kind] += counts['trials'] + counts['errors']
+                    time_taken_ms[kind] += counts['time_taken_ms']
+                    if counts['errors'] > 0:
+                        logging.warning(f"{counts['errors']} {kind.value} trials failed, and were not counted.")
+                    if not is_active(kind):
+                        test = sequential_tests[kind]
+                        logging.info((
+                            f"{kind.value} trials: {test.positives} positives in {test.trials} trials, "
+                            f"FPR <= {plan.fpr:g} {test.decision.value}."
+                        ))
+                next_tally += 1
+
+        for future in futures:
+            future.cancel()
+
+    design_effects = {kind: positives_design_effect(image_counts[kind].values()) for kind in kinds}
+    for kind in kinds:
+        if design_effects[kind] > MAX_DESIGN_EFFECT:
+            logging.warning((
+                f"{kind.value} positives cluster on a few images (design effect {design_effects[kind]:.1f}): "
+                "the trials are not independent, and the decision is optimistic."
+            ))
+    yield [
+        reliability_result(kind, plan, sequential_tests[kind], time_taken_ms[kind], design_effects[kind])
+        for kind in kinds
+    ]
@@ -0,0 +1,381 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Results files.
+"""
+
+import os
+import json
+import enum
+import math
+import uuid
+import glob
+import shutil
+import fnmatch
+import logging
+from typing import List, Set
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmark.summary import PartialSummary
+
+
+class ResultsFormat(enum.Enum):
+    """
+    Storage format for the raw results.
+    """
+    # one JSON-lines file per (watermark, dataset, evaluation)
+    JSONL = 'jsonl'
+    # Parquet store, partitioned by watermark/dataset/evaluation
+    PARQUET = 'parquet'
+
+PARTITION_KEYS = ['watermark', 'dataset', 'evaluation']
+
+PARQUET_SCHEMA = pa.schema([
+    ('operation', pa.string()),
+    ('content_id', pa.string()),
+    ('content_format', pa.string()),
+    ('content_dimensions', pa.list_(pa.int64())),
+    ('time_taken_ms', pa.float64()),
+    ('cpu_time_ms', pa.float64()),
+    ('read_time_ms', pa.float64()),
+    ('bytes_to_bgr_time_ms', pa.float64()),
+    ('edit_time_ms', pa.float64()),
+    ('bgr_to_bytes_time_ms', pa.float64()),
+    ('metrics_time_ms', pa.float64()),
+    ('rss_peak_delta_kb', pa.int64()),
+    ('tracemalloc_peak_kb', pa.float64()),
+    ('error', pa.bool_()),
+    ('psnr', pa.float64()),
+    ('ssim', pa.float64()),
+    ('pcpa', pa.float64()),
+    ('edit_type', pa.string()),
+    # edit parameters are heterogeneous, so they are stored as JSON
+    ('edit_parameters', pa.string()),
+    ('detected', pa.bool_()),
+    ('decoded', pa.bool_()),
+    ('batch_size', pa.int64()),
+    ('concurrency', pa.int64()),
+    ('started_at_ms', pa.float64()),
+    ('trial_kind', pa.string()),
+    ('trials', pa.int64()),
+    ('positives', pa.int64()),
+    ('fpr_bound', pa.float64()),
+    ('fpr_confidence', pa.float64()),
+    ('sprt_decision', pa.string()),
+    ('design_effect', pa.float64()),
+    ('inferred', pa.bool_()),
+])
+
+
+def to_jsonable(value):
+    """
+    Convert a result value to plain JSON types (matching pandas' to_json conventions).
+    """
+    if isinstance(value, dict):
+        return {(k if isinstance(k, str) else str(k)): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def complete_appends(results_file):
+    """
+    Read a JSON-lines results file from its current position, as (rows, end offset) per append of the rows of
+    an image, stopping at the first incomplete one: a partial line, or fewer rows than its image_rows.
+    (Rows without image_rows, from older files, are taken one at a time.)
+    """
+    rows, offset = [], results_file.tell()
+    for line in results_file:
+        if not line.endswith(b'\n'):
+            return
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            return
+        offset += len(line)
+        if len(rows) >= rows[0].get('image_rows', 1):
+            yield rows, offset
+            rows = []
+
+
+class JsonLinesSink():
+    """
+    Append-only results file, with one JSON row per line.
+    All the rows of an image are written (and synced to disk) in a single append, and each row records the number
+    of rows in its append (image_rows), so that after a crash, the rows of an image cut short (along with
+    any partial line) are told apart from complete images, and dropped on resume.
+    The partial summary next to the file is updated after each append.
+    """
+    def __init__(self, filepath: str, resume: bool=False):
+        self.filepath = filepath
+        self.fd = None
+        self.done = set()
+        # (created upfront, so that a missing results directory does not fail the run after its first image)
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+
+        if resume and os.path.exists(filepath):
+            self.done = self.recover(filepath)
+            self.summary = load_jsonl_summary(filepath)
+        else:
+            for stale_filepath in [filepath, summary_path(ResultsFormat.JSONL, filepath)]:
+                if os.path.exists(stale_filepath):
+                    os.remove(stale_filepath)
+            self.summary = PartialSummary(*jsonl_key(filepath))
+
+    @staticmethod
+    def recover(filepath: str) -> Set[str]:
+        """
+        Get the content_ids already in a results file, truncating any trailing incomplete image.
+        """
+        done = set()
+        offset = 0
+        with open(filepath, 'rb') as results_file:
+            for rows, offset in complete_appends(results_file):
+                done.update(row['content_id'] for row in rows)
+
+        if offset < os.path.getsize(filepath):
+            logging.warning(f"Dropping the partially written rows of an image from {filepath}.")
+            with open(filepath, 'r+b') as results_file:
+                results_file.truncate(offset)
+        return done
+
+    def write(self, results: List[dict]):
+        if len(results) == 0:
+            return
+        if self.fd is None:
+            self.fd = os.open(self.filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        data = ''.join(
+            json.dumps({**to_jsonable(result), 'image_rows' : len(results)}) + '\n' for result in results
+        ).encode()
+        while data:
+            data = data[os.write(self.fd, data):]
+        os.fsync(self.fd)
+
+        self.summary.update(results)
+        self.summary.covered = {'size' : os.fstat(self.fd).st_size}
+        self.summary.save(summary_path(ResultsFormat.JSONL, self.filepath))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def parquet_partition(root: str, watermark: str, dataset: str, evaluation: str) -> str:
+    return f"{root}/watermark={watermark}/dataset={dataset}/evaluation={evaluation}"
+
+
+class ParquetSink():
+    """
+    Results partition in a Parquet store, written as a sequence of immutable part files.
+    Rows are buffered up to a fixed count; each part is written to a temporary file and then renamed into place,
+    so after a crash, the partition holds only complete parts (the images of unwritten rows are redone on resume).
+    The partial summary in the partition is updated after each part.
+    """
+    def __init__(self, filepath: str, resume: bool=False, max_buffered_rows: int=10000):
+        self.filepath = filepath
+        self.max_buffered_rows = max_buffered_rows
+        self.buffer = []
+        self.done = set()
+
+        if resume and os.path.exists(self.filepath):
+            self.done = self.recover(self.filepath)
+            self.summary = load_parquet_summary(self.filepath)
+        else:
+            if os.path.exists(self.filepath):
+                shutil.rmtree(self.filepath)
+            self.summary = PartialSummary(*parquet_key(self.filepath))
+        os.makedirs(self.filepath, exist_ok=True)
+
+    @staticmethod
+    def recover(filepath: str) -> Set[str]:
+        """
+        Get the content_ids already in a partition, removing any leftover temporary parts.
+        """
+        for tmp_filepath in glob.glob(f"{filepath}/.*.tmp"):
+            os.remove(tmp_filepath)
+
+        done = set()
+        for part_filepath in glob.glob(f"{filepath}/*.parquet"):
+            done.update(pq.read_table(part_filepath, columns=['content_id'])['content_id'].to_pylist())
+        return done
+
+    def write(self, results: List[dict]):
+        for result in results:
+            row = {key: to_jsonable(result.get(key)) for key in PARQUET_SCHEMA.names}
+            row['edit_parameters'] = json.dumps(row['edit_parameters'] or {})
+            self.buffer.append(row)
+        if len(self.buffer) >= self.max_buffered_rows:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        # (dot-prefixed files are ignored by readers)
+        part_name = f"part-{uuid.uuid4().hex}.parquet"
+        tmp_filepath = f"{self.filepath}/.{part_name}.tmp"
+        pq.write_table(pa.Table.from_pylist(self.buffer, schema=PARQUET_SCHEMA), tmp_filepath)
+        os.replace(tmp_filepath, f"{self.filepath}/{part_name}")
+
+        self.summary.update(self.buffer)
+        self.summary.covered = {'parts' : self.summary.covered.get('parts', []) + [part_name]}
+        self.summary.save(summary_path(ResultsFormat.PARQUET, self.filepath))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+
+def results_path(results_format: ResultsFormat, root: str, watermark: str, dataset: str, evaluation: str) -> str:
+    """
+    Location of the results of a (watermark, dataset, evaluation) run.
+    """
+    if results_format is ResultsFormat.PARQUET:
+        return parquet_partition(f"{root}/parquet", watermark, dataset, evaluation)
+    return f"{root}/{watermark}.{dataset}.{evaluation}.jsonl"
+
+
+def summary_path(results_format: ResultsFormat, filepath: str) -> str:
+    """
+    Location of the partial summary of a run (ignored by the readers of the raw results).
+    """
+    if results_format is ResultsFormat.PARQUET:
+        return f"{filepath}/_summary.json"
+    return f"{filepath}.summary"
+
+
+def jsonl_key(filepath: str) -> List[str]:
+    return os.path.basename(filepath)[:-len('.jsonl')].rsplit('.', 2)
+
+
+def parquet_key(filepath: str) -> List[str]:
+    return [part.split('=', 1)[1] for part in filepath.rstrip('/').split('/')[-3:]]
+
+
+def load_jsonl_summary(filepath: str) -> PartialSummary:
+    """
+    Get the partial summary of a JSON-lines results file, first adding any complete rows written after it
+    (or rebuilding it, if it is missing or ahead of the file).
+    """
+    try:
+        summary = PartialSummary.load(summary_path(ResultsFormat.JSONL, filepath))
+    except (FileNotFoundError, ValueError, KeyError):
+        summary = None
+    if summary is None or summary.covered.get('size', 0) > os.path.getsize(filepath):
+        summary = PartialSummary(*jsonl_key(filepath))
+
+    offset = summary.covered.get('size', 0)
+    if offset == os.path.getsize(filepath):
+        return summary
+
+    rows = []
+    with open(filepath, 'rb') as results_file:
+        results_file.seek(offset)
+        # (a run in progress, or interrupted, may have partially written the rows of an image)
+        for append_rows, offset in complete_appends(results_file):
+            rows.extend(append_rows)
+    summary.update(rows)
+    summary.covered = {'size' : offset}
+    summary.save(summary_path(ResultsFormat.JSONL, filepath))
+    return summary
+
+
+def load_parquet_summary(filepath: str) -> PartialSummary:
+    """
+    Get the partial summary of a Parquet results partition, first adding any parts written after it
+    (or rebuilding it, if it is missing or covers parts that no longer exist).
+    """
+    part_names = [os.path.basename(part_filepath) for part_filepath in sorted(glob.glob(f"{filepath}/*.parquet"))]
+    try:
+        summary = PartialSummary.load(summary_path(ResultsFormat.PARQUET, filepath))
+    except (FileNotFoundError, ValueError, KeyError):
+        summary = None
+    if summary is None or not set(summary.covered.get('parts', [])) <= set(part_names):
+        summary = PartialSummary(*parquet_key(filepath))
+
+    covered = summary.covered.get('parts', [])
+    new_part_names = [part_name for part_name in part_names if part_name not in set(covered)]
+    if len(new_part_names) == 0:
+        return summary
+
+    for part_name in new_part_names:
+        summary.update(pq.read_table(f"{filepath}/{part_name}").to_pylist())
+    summary.covered = {'parts' : covered + new_part_names}
+    summary.save(summary_path(ResultsFormat.PARQUET, filepath))
+    return summary
+
+
+def match_partitions(root: str, pattern: str='*') -> List[List[str]]:
+    """
+    Get the (watermark, dataset, evaluation) partitions of a Parquet store whose name matches the (glob) pattern.
+    """
+    partitions = []
+    for filepath in glob.glob(parquet_partition(root, '*', '*', '*')):
+        values = parquet_key(filepath)
+        if fnmatch.fnmatchcase('.'.join(values), pattern):
+            partitions.append(values)
+    return partitions
+
+
+def read_summaries(root: str, results_format: ResultsFormat, pattern: str='*') -> List[PartialSummary]:
+    """
+    Read the partial summaries of the runs whose "watermark.dataset.evaluation" name matches the (glob) pattern,
+    catching them up with the raw results first (which only reads the rows they do not cover yet).
+    """
+    if results_format is ResultsFormat.PARQUET:
+        return [
+            load_parquet_summary(parquet_partition(f"{root}/parquet", *values))
+            for values in match_partitions(f"{root}/parquet", pattern)
+        ]
+    return [load_jsonl_summary(filepath) for filepath in sorted(glob.glob(f"{root}/{pattern}.jsonl"))]
+
+
+def open_sink(results_format: ResultsFormat, filepath: str, resume: bool=False):
+    if results_format is ResultsFormat.PARQUET:
+        return ParquetSink(filepath, resume=resume)
+    return JsonLinesSink(filepath, resume=resume)
+
+
+def read_parquet_results(root: str, pattern: str='*', columns: List[str]=None, filter=None):
+    """
+    Read a Parquet results store into a DataFrame.
+    Only the partitions whose "watermark.dataset.evaluation" name matches the (glob) pattern are read,
+    and only the given columns (plus the partition keys) are loaded; an extra row filter expression is pushed down.
+    Raises FileNotFoundError if no partition matches the pattern.
+    """
+    # (pyarrow.dataset imports pandas, so it is only loaded when reading)
+    import pyarrow.dataset as pads
+
+    partitions = match_partitions(root, pattern)
+    if len(partitions) == 0:
+        raise FileNotFoundError(f"No results in {root} match {pattern} (as watermark.dataset.evaluation).")
+
+    partition_filter = None
+    for values in partitions:
+        expression = None
+        for key, value in zip(PARTITION_KEYS, values):
+            expression = (pads.field(key) == value) if expression is None else (expression & (pads.field(key) == value))
+        partition_filter = expression if partition_filter is None else (partition_filter | expression)
+    if filter is not None:
+        partition_filter = partition_filter & filter
+
+    # (with an explicit schema, columns missing from older parts are read as nulls)
+    partition_schema = pa.schema([(key, pa.string()) for key in PARTITION_KEYS])
+    dataset = pads.dataset(
+        root,
+        format='parquet',
+        schema=pa.unify_schemas([PARQUET_SCHEMA, partition_schema]),
+        partitioning=pads.partitioning(partition_schema, flavor='hive'),
+    )
+    if columns is not None:
+        columns = PARTITION_KEYS + [column for column in columns if column not in PARTITION_KEYS]
+    return dataset.to_table(columns=columns, filter=partition_filter).to_pandas()
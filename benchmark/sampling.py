@@ -0,0 +1,158 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Adaptive dataset sampling.
+"""
+
+import os
+import math
+import mimetypes
+import statistics
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import cv2
+
+from benchmark import manifest
+
+
+# name of the overall decoding score, among the tracked metrics
+DEC_SCORE = 'dec_score'
+
+
+class SamplingTarget(NamedTuple):
+    # largest half-width of the intervals (as a rate: 0.02 is ±2% on dec_score)
+    half_width: float = 0.02
+    # confidence level of the intervals
+    confidence: float = 0.95
+    # images evaluated before stopping, at least
+    min_images: int = 20
+
+
+def image_stratum(filepath: str) -> Tuple[str, int]:
+    """
+    Get the stratum of an image: its format, and its size bucket (log2 of the content size, i.e. the image side
+    sqrt(h * w)), from the dataset manifest if current, or measured on a cheap 1/8-scale grayscale read.
+    """
+    dataset_manifest = manifest.find_manifest(os.path.dirname(os.path.abspath(filepath)))
+    entry = dataset_manifest.get(filepath) if dataset_manifest is not None else None
+    if entry is not None:
+        if entry.height == 0:
+            return entry.format, -1
+        return entry.format, int(math.log2(max(math.sqrt(entry.height * entry.width), 1)))
+
+    content_format = mimetypes.guess_type(filepath)[0] or "image/unknown"
+    image_gray = cv2.imread(filepath, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image_gray is None:
+        return content_format, -1
+    content_size = 8 * math.sqrt(image_gray.shape[0] * image_gray.shape[1])
+    return content_format, int(math.log2(max(content_size, 1)))
+
+
+def stratified_order(filepaths: List[str], random_seed: int=0) -> List[str]:
+    """
+    Randomized order of the images, stratified by format and size bucket: each stratum is shuffled,
+    and the strata are interleaved in proportion to their sizes, so that every prefix is a near-proportional sample.
+    """
+    rng = np.random.default_rng(random_seed)
+    strata = {}
+    for filepath in filepaths:
+        strata.setdefault(image_stratum(filepath), []).append(filepath)
+
+    keyed = []
+    for stratum in sorted(strata):
+        stratum_filepaths = strata[stratum]
+        for rank, k in enumerate(rng.permutation(len(stratum_filepaths))):
+            keyed.append(((rank + rng.random()) / len(stratum_filepaths), stratum_filepaths[k]))
+    return [filepath for _, filepath in sorted(keyed)]
+
+
+def wilson_interval(successes: int, trials: int, z: float) -> Tuple[float, float]:
+    """
+    Wilson score interval of a rate.
+    """
+    if trials == 0:
+        return 0., 1.
+    p = successes / trials
+    center = (p + z ** 2 / (2 * trials)) / (1 + z ** 2 / trials)
+    half_width = z * math.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)) / (1 + z ** 2 / trials)
+    return max(center - half_width, 0.), min(center + half_width, 1.)
+
+
+def design_effect(sums: List[float]) -> float:
+    """
+    Design effect of a rate pooled over images, whose trials may be correlated within each image: the ratio of the
+    variance of the pooled rate over images, to its variance if all trials were independent (at least 1).
+    sums holds the number of images m, and the sums over images of y, n, y * y, y * n and n * n
+    (y the successes of an image, and n its trials).
+    """
+    m, sum_y, sum_n, sum_yy, sum_yn, sum_nn = sums
+    if m < 2 or sum_n == 0 or sum_y in (0, sum_n):
+        return 1.
+    p = sum_y / sum_n
+    # (ratio estimator variance, from the residuals of the images' successes around p * trials)
+    cluster_var = m / (m - 1) * max(sum_yy - 2 * p * sum_yn + p * p * sum_nn, 0.) / sum_n ** 2
+    return max(cluster_var / (p * (1 - p) / sum_n), 1.)
+
+
+def add_image_sums(sums: List[float], y: int, n: int):
+    """
+    Add the successes y and trials n of an image to sums (see design_effect).
+    """
+    for k, value in enumerate((1, y, n, y * y, y * n, n * n)):
+        sums[k] += value
+
+
+def cluster_interval(sums: List[float], z: float) -> Tuple[float, float, float]:
+    """
+    Interval of a rate pooled over images, whose trials are correlated within each image: the Wilson interval
+    at the effective number of trials, i.e. the trials divided by the design effect (see design_effect).
+    """
+    sum_y, sum_n = sums[1], sums[2]
+    if sum_n == 0:
+        return 0., 0., 1.
+    p = sum_y / sum_n
+    effective_n = sum_n / design_effect(sums)
+    return (p, *wilson_interval(p * effective_n, effective_n, z))
+
+
+class IntervalTracker():
+    """
+    Running intervals of the decoding success rate, overall (dec_score) and per edit type,
+    updated one image at a time from its results. Only the per-image sums are kept.
+    As in ImageAnalysis, errors are left out and inferred failures count as failures.
+    The decodes of an image share its encoding, so they are correlated: the intervals are computed over images
+    (see cluster_interval), and narrow with the number of images rather than the number of decodes.
+    """
+    def __init__(self, target: SamplingTarget):
+        self.target = target
+        self.z = statistics.NormalDist().inv_cdf(0.5 + target.confidence / 2)
+        self.images = 0
+        self.sums = {}
+
+    def update(self, image_results: List[dict]):
+        self.images += 1
+        counts = {}
+        for result in image_results:
+            if result['operation'] != "decode" or result['edit_type'] == '' or result['error']:
+                continue
+            for metric in (DEC_SCORE, result['edit_type']):
+                image_counts = counts.setdefault(metric, [0, 0])
+                image_counts[0] += bool(result['decoded'])
+                image_counts[1] += 1
+        for metric, (y, n) in counts.items():
+            add_image_sums(self.sums.setdefault(metric, [0] * 6), y, n)
+
+    def intervals(self) -> Dict[str, Tuple[float, float, float]]:
+        """
+        Get the (rate, lower bound, upper bound) of each tracked metric.
+        """
+        return {metric: cluster_interval(sums, self.z) for metric, sums in self.sums.items()}
+
+    def is_met(self) -> bool:
+        return (
+            self.images >= self.target.min_images
+            and len(self.sums) > 0
+            and all((high - low) / 2 <= self.target.half_width for _, low, high in self.intervals().values())
+        )
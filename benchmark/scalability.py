@@ -5,4 +5,198 @@ SPDX-License-Identifier: MIT
 Assessment of scalability.
 """
 
-# [TODO]
+import os
+import enum
+import time
+import logging
+import concurrent.futures
+import multiprocessing.util
+from typing import Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+import cv2
+
+from benchmark import evaluate
+from benchmark import frames
+from benchmark.image import utils
+
+
+class ImageScalabilityTests(enum.Enum):
+    V1_QUICK = 'QUICK'
+    V1_FULL = 'FULL'
+
+
+class ScalabilityLadder(NamedTuple):
+    # (height, width) of the test images
+    resolutions: List[Tuple[int, int]]
+    # numbers of worker processes running at once
+    concurrency: List[int]
+    # encode + decode calls per worker, per source image and resolution
+    repeats: int
+    # dataset images used as sources (resized to each resolution), besides the synthetic image
+    dataset_images: int
+
+
+# name of the synthetic source image
+SYNTHETIC = 'synthetic'
+
+
+def scalability_ladder(tests: ImageScalabilityTests) -> ScalabilityLadder:
+    """
+    Get the resolutions and concurrency levels of a scalability evaluation mode.
+    Concurrency levels are capped at the number of CPUs.
+    """
+    if tests is ImageScalabilityTests.V1_QUICK:
+        ladder = ScalabilityLadder(
+            resolutions=[(256, 256), (512, 512), (720, 1280), (1080, 1920)],
+            concurrency=[1, 2],
+            repeats=2,
+            dataset_images=1,
+        )
+    elif tests is ImageScalabilityTests.V1_FULL:
+        # 256² through 8K UHD
+        ladder = ScalabilityLadder(
+            resolutions=[(256, 256), (512, 512), (720, 1280), (1080, 1920), (2160, 3840), (4320, 7680)],
+            concurrency=[1, 2, 4, 8],
+            repeats=3,
+            dataset_images=2,
+        )
+    else:
+        raise NotImplementedError
+    cpus = os.cpu_count() or 1
+    return ladder._replace(concurrency=sorted({min(level, cpus) for level in ladder.concurrency}))
+
+
+def synthetic_image(height: int, width: int, random_seed: int=0) -> np.ndarray:
+    """
+    Deterministic textured BGR image: smooth structure (upscaled noise) plus fine grain.
+    """
+    rng = np.random.default_rng(random_seed)
+    coarse = rng.integers(0, 256, size=(max(height // 32, 2), max(width // 32, 2), 3), dtype=np.uint8)
+    image_bgr = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    grain = rng.integers(0, 17, size=(height, width, 3), dtype=np.uint8)
+    # (saturating uint8 arithmetic, without wider temporaries)
+    image_bgr = cv2.add(image_bgr, grain, dst=image_bgr)
+    return cv2.subtract(image_bgr, 8, dst=image_bgr)
+
+
+def source_image(source: str, height: int, width: int) -> np.ndarray:
+    """
+    Get a source image (synthetic, or a dataset filepath) at a given resolution.
+    """
+    if source == SYNTHETIC:
+        return synthetic_image(height, width)
+    with open(source, 'rb') as image_file:
+        image_bgr = frames.load_frame(source, image_file.read())
+    return utils.resize_frame(image_bgr, height, width)
+
+
+# per-process wrapper instance, and the current source image
+_worker_wrapper = None
+_worker_images = {}
+
+
+def _init_worker(wrapper_class):
+    global _worker_wrapper
+    _worker_wrapper = wrapper_class()
+    evaluate.setup_wrapper(_worker_wrapper)
+    multiprocessing.util.Finalize(None, _worker_wrapper.teardown, exitpriority=10)
+
+
+def _scalability_result(operation: str, source: str, shape: Tuple[int], concurrency: int, started_at_ms: float) -> dict:
+    result = evaluate.IMAGE_RESULTS.copy()
+    result['operation'] = operation
+    result['content_id'] = source if source == SYNTHETIC else evaluate.get_image_name(source)
+    result['content_format'] = "image"
+    result['content_dimensions'] = shape
+    result['concurrency'] = concurrency
+    result['started_at_ms'] = started_at_ms
+    return result
+
+
+def _scalability_task(args) -> List[dict]:
+    """
+    Encode and decode a source image repeatedly, measuring each wrapper call.
+    Call start times are relative to the start of the level (on the system-wide monotonic clock).
+    """
+    global _worker_images
+    source, height, width, repeats, concurrency, level_start_ns = args
+    key = (source, height, width)
+    if key not in _worker_images:
+        image_bgr = source_image(source, height, width)
+        image = image_bgr if _worker_wrapper.implements('encode_array') else utils.bgr_to_bytes(image_bgr)
+        _worker_images = {key: (image_bgr.shape, image)}
+    shape, image = _worker_images[key]
+
+    random_seed = 0 if source == SYNTHETIC else evaluate.image_random_seed(source)
+    payload_bits = np.random.default_rng(random_seed).integers(2, size=_worker_wrapper.payload_size).astype(bool)
+
+    results = []
+    for _ in range(repeats):
+        # encoding
+        enc_result = _scalability_result(
+            "encode", source, shape, concurrency, (time.monotonic_ns() - level_start_ns) / 1e6,
+        )
+        outputs, errors, usage = evaluate.run_batch(
+            lambda images: _worker_wrapper.encode_batch(images, [payload_bits] * len(images)),
+            [image],
+            [f"Encoding error ({source}, {height}x{width})"],
+        )
+        enc_result.update(usage)
+        enc_result['error'] = errors[0]
+        results.append(enc_result)
+        if errors[0]:
+            continue
+
+        # decoding
+        enc_image = outputs[0]
+        if isinstance(enc_image, np.ndarray) and not _worker_wrapper.implements('decode_array'):
+            enc_image = utils.bgr_to_bytes(enc_image)
+        dec_result = _scalability_result(
+            "decode", source, shape, concurrency, (time.monotonic_ns() - level_start_ns) / 1e6,
+        )
+        outputs, errors, usage = evaluate.run_batch(
+            _worker_wrapper.decode_batch,
+            [enc_image],
+            [f"Decoding error ({source}, {height}x{width})"],
+        )
+        dec_result.update(usage)
+        dec_result['error'] = errors[0]
+        if not errors[0] and outputs[0] is not None:
+            dec_result['detected'] = True
+            dec_result['decoded'] = np.array_equal(outputs[0], payload_bits)
+        results.append(dec_result)
+
+    return results
+
+
+def evaluate_scalability(
+    wrapper_class,
+    filepaths: List[str],
+    tests: ImageScalabilityTests,
+) -> Iterator[List[dict]]:
+    """
+    Drive a wrapper across a ladder of resolutions (a synthetic image, and dataset images resized to each resolution)
+    and of concurrency levels (a pool of that many worker processes, each with its own wrapper instance).
+    Yields the results of each (concurrency, resolution) level, with one row per encode/decode call.
+    """
+    ladder = scalability_ladder(tests)
+    sources = [SYNTHETIC] + filepaths[:ladder.dataset_images]
+
+    for concurrency in ladder.concurrency:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=concurrency,
+            initializer=_init_worker,
+            initargs=(wrapper_class,),
+        ) as executor:
+            for height, width in ladder.resolutions:
+                logging.info(f"Scalability level: {height}x{width}, concurrency {concurrency}.")
+                level_start_ns = time.monotonic_ns()
+                tasks = [
+                    (source, height, width, ladder.repeats, concurrency, level_start_ns)
+                    for source in sources for _ in range(concurrency)
+                ]
+                level_results = []
+                for task_results in executor.map(_scalability_task, tasks):
+                    level_results.extend(task_results)
+                yield level_results
@@ -0,0 +1,145 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Partial summaries of the results.
+"""
+
+import os
+import json
+import math
+import uuid
+from typing import Dict, List
+
+import numpy as np
+
+
+# the per-row values summarized (booleans count as 0/1)
+SUMMARY_COLUMNS = [
+    'detected', 'decoded', 'inferred', 'psnr', 'ssim', 'pcpa',
+    'time_taken_ms', 'cpu_time_ms', 'read_time_ms', 'bytes_to_bgr_time_ms',
+    'edit_time_ms', 'bgr_to_bytes_time_ms', 'metrics_time_ms',
+    'rss_peak_delta_kb', 'tracemalloc_peak_kb',
+]
+# derived values: the time per content size (as in ImageAnalysis), and the PCPA ratio of the encoding composite
+DERIVED_COLUMNS = ['ntime', 'pcpa_ratio']
+
+
+def content_size(shape) -> int:
+    """
+    Size of an image (the side of a square of the same area), as in ImageAnalysis.summarize_per.
+    """
+    if shape is not None and len(shape) >= 2:
+        return int(np.round(np.sqrt(np.prod(shape[:2]))))
+    return 0
+
+
+def merge_groups(groups: List[Dict]) -> Dict:
+    """
+    Add up the row counts and the moments of summary groups.
+    """
+    merged = {'rows' : 0}
+    for group in groups:
+        for column, moments in group.items():
+            if column == 'rows':
+                merged['rows'] += moments
+            elif column not in merged:
+                merged[column] = list(moments)
+            else:
+                merged_moments = merged[column]
+                merged_moments[0] += moments[0]
+                merged_moments[1] += moments[1]
+                merged_moments[2] += moments[2]
+                merged_moments[3] = max(merged_moments[3], moments[3])
+    return merged
+
+
+class PartialSummary():
+    """
+    Mergeable partial aggregates of the results of a (watermark, dataset, evaluation) run.
+    Per-(operation, edit_type) group, it keeps the number of rows and the (count, sum, sum of squares, maximum)
+    of each summarized value, over the rows without errors; missing values are left out of the moments.
+    Partials merge by adding them up, so the top-line scores are computed without the raw rows.
+    The covered field records which raw results are already included (set by the results store).
+    """
+    def __init__(self, watermark: str, dataset: str, evaluation: str):
+        self.key = (watermark, dataset, evaluation)
+        self.groups = {}
+        self.covered = {}
+
+    def update(self, results: List[dict]):
+        """
+        Add the rows of complete images (the time per content size needs the encode row of each image).
+        """
+        content_sizes = {
+            result['content_id']: content_size(result['content_dimensions'])
+            for result in results if result['operation'] == "encode" and not result['error']
+        }
+        for result in results:
+            if result['error']:
+                continue
+            group = self.groups.setdefault((result['operation'], result['edit_type'] or ''), {'rows': 0})
+            group['rows'] += 1
+
+            values = {column: result.get(column) for column in SUMMARY_COLUMNS}
+            if values['time_taken_ms'] is not None and result['content_id'] in content_sizes:
+                values['ntime'] = values['time_taken_ms'] / (256 + content_sizes[result['content_id']])
+            if values['pcpa'] is not None:
+                values['pcpa_ratio'] = 10. / (10. + values['pcpa'])
+
+            for column, value in values.items():
+                if value is None or not math.isfinite(value):
+                    continue
+                value = float(value)
+                moments = group.setdefault(column, [0, 0., 0., value])
+                moments[0] += 1
+                moments[1] += value
+                moments[2] += value * value
+                moments[3] = max(moments[3], value)
+
+    def merge(self, other: 'PartialSummary'):
+        for group_key, other_group in other.groups.items():
+            self.groups[group_key] = merge_groups([self.groups.get(group_key, {}), other_group])
+
+    def edit_groups(self) -> Dict[str, Dict]:
+        """
+        Get the groups per edit_type, merged across operations.
+        """
+        edit_types = sorted({edit_type for _, edit_type in self.groups})
+        return {
+            edit_type: merge_groups([group for (_, group_edit_type), group in self.groups.items() if group_edit_type == edit_type])
+            for edit_type in edit_types
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            'watermark' : self.key[0],
+            'dataset' : self.key[1],
+            'evaluation' : self.key[2],
+            'covered' : self.covered,
+            'groups' : [
+                {'operation' : operation, 'edit_type' : edit_type, **group}
+                for (operation, edit_type), group in self.groups.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'PartialSummary':
+        summary = cls(data['watermark'], data['dataset'], data['evaluation'])
+        summary.covered = data['covered']
+        for group in data['groups']:
+            group = dict(group)
+            summary.groups[(group.pop('operation'), group.pop('edit_type'))] = group
+        return summary
+
+    def save(self, filepath: str):
+        # (written to a temporary file and renamed into place, so that readers never see a partial summary)
+        tmp_filepath = f"{os.path.dirname(filepath)}/.{os.path.basename(filepath)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_filepath, 'w') as summary_file:
+            json.dump(self.to_dict(), summary_file)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath: str) -> 'PartialSummary':
+        with open(filepath, 'r') as summary_file:
+            return cls.from_dict(json.load(summary_file))
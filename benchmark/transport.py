@@ -0,0 +1,113 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Transfer of images between the coordinator and the worker processes, through shared memory.
+"""
+
+import uuid
+import logging
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+
+
+# memory budget for the images shared with the workers (and not fully decoded yet)
+DEFAULT_SHARED_BYTES = 2 ** 30
+
+
+class FrameHandle(NamedTuple):
+    # name of the shared memory block
+    name: str
+    # array layout of the frame
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+def share_frame(name: str, image_bgr: np.ndarray) -> FrameHandle:
+    """
+    Copy a frame into a new shared memory block (the block outlives this process, until it is unlinked).
+    """
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(image_bgr.nbytes, 1))
+    try:
+        np.ndarray(image_bgr.shape, dtype=image_bgr.dtype, buffer=shm.buf)[...] = image_bgr
+    finally:
+        shm.close()
+    return FrameHandle(name, image_bgr.shape, image_bgr.dtype.str)
+
+
+class SharedFrame():
+    """
+    A frame mapped from a shared memory block, without copying; the array is read-only, since it is shared.
+    """
+    def __init__(self, handle: FrameHandle):
+        self.shm = shared_memory.SharedMemory(name=handle.name)
+        self.array = np.ndarray(handle.shape, dtype=handle.dtype, buffer=self.shm.buf)
+        self.array.flags.writeable = False
+
+    def close(self):
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # (an edited image still views the frame; the block is unmapped once it is freed)
+            pass
+
+
+def unlink_frame(name: str):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+class FrameTransport():
+    """
+    Coordinator-side lifetime of the shared frames: each image gets a block name before its task is submitted,
+    so that its block is unlinked when released, or on close, even if the worker creating it crashed.
+    The bytes held in shared memory are tracked (counting the images still being encoded as large as the largest
+    image so far), so that new images are only started within max_bytes (one image is always allowed, however large).
+    """
+    def __init__(self, max_bytes: int=DEFAULT_SHARED_BYTES):
+        self.max_bytes = max_bytes
+        self.prefix = f"wmb_{uuid.uuid4().hex[:12]}"
+        self.live: Dict[int, int] = {}
+        self.largest = 0
+        # (workers then register their blocks with this process's tracker, which unlinks any left at exit)
+        resource_tracker.ensure_running()
+
+    def frame_name(self, i: int) -> str:
+        return f"{self.prefix}_{i}"
+
+    def has_room(self) -> bool:
+        return len(self.live) == 0 or sum(self.live.values()) < self.max_bytes
+
+    def open(self, i: int):
+        self.live[i] = self.largest
+
+    def opened(self, i: int, handle: FrameHandle):
+        self.live[i] = handle.nbytes
+        self.largest = max(self.largest, handle.nbytes)
+
+    def release(self, i: int):
+        if self.live.pop(i, None) is not None:
+            unlink_frame(self.frame_name(i))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if len(self.live) > 0:
+            logging.info(f"Releasing {len(self.live)} shared images.")
+        for i in list(self.live):
+            self.release(i)
@@ -0,0 +1,52 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Flattening of the edit parameters, on filtered and reordered frames.
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from analysis.analyze import flatten_edit_parameters
+
+
+PARAMETERS = [
+    {'jpeg_quality' : 70},
+    {},
+    {'angle' : -9},
+    {'scale' : [0.5, 0.5]},
+    None,
+    {'jpeg_quality' : 30, 'flip' : True},
+    {'scale' : "fixed size"},
+    {'angle' : 3.5},
+]
+
+
+def expected_value(parameters, name):
+    value = (parameters or {}).get(name)
+    return json.dumps(value) if isinstance(value, list) else value
+
+
+@pytest.mark.parametrize('as_json', [False, True])
+def test_index_alignment(as_json):
+    edit_parameters = pd.Series(PARAMETERS * 3, dtype=object)
+    if as_json:
+        # (as read back from Parquet, where missing parameters are nulls)
+        edit_parameters = edit_parameters.map(lambda parameters: None if parameters is None else json.dumps(parameters))
+    # filtered and reordered, so that the index is neither 0..n-1 nor sorted
+    edit_parameters = edit_parameters[edit_parameters.index % 3 != 1].iloc[::-1]
+
+    flat = flatten_edit_parameters(edit_parameters)
+    assert flat.index.equals(edit_parameters.index)
+    assert set(flat.columns) == {'param_jpeg_quality', 'param_angle', 'param_scale', 'param_flip'}
+    for i in edit_parameters.index:
+        parameters = PARAMETERS[i % len(PARAMETERS)]
+        for column in flat.columns:
+            value, expected = flat.at[i, column], expected_value(parameters, column[len("param_"):])
+            if expected is None:
+                assert pd.isna(value)
+            else:
+                assert value == expected
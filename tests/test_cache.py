@@ -0,0 +1,48 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Edit cache entries and keys.
+"""
+
+import numpy as np
+
+from benchmark import cache
+from benchmark.image.edit import IECompressJPEG
+
+
+EDITS = [
+    ({'cropping' : ((8, 8), (0, 0))}, (4, 5, 3), np.arange(60, dtype=np.uint8).reshape(4, 5, 3)),
+    ({'jpeg_quality' : 70}, (4, 5, 3), b'\xff\xd8 jpeg bytes'),
+]
+
+
+def test_round_trip(tmp_path):
+    edit_cache = cache.EditCache(str(tmp_path))
+    edit_cache.put_edits('key', EDITS)
+    edits = edit_cache.get_edits('key')
+    assert [(parameters, shape) for parameters, shape, _ in edits] == [
+        ({'cropping' : [[8, 8], [0, 0]]}, (4, 5, 3)),
+        ({'jpeg_quality' : 70}, (4, 5, 3)),
+    ]
+    np.testing.assert_array_equal(edits[0][2], EDITS[0][2])
+    assert edits[1][2] == EDITS[1][2]
+
+
+def test_key_follows_parameters(monkeypatch):
+    edit = IECompressJPEG(0, [3])
+    key = cache.EditCache.edit_key('hash', edit, (4, 5, 3))
+    monkeypatch.setattr(IECompressJPEG, 'JPEG_QUALITY_LEVELS', [99, 90, 80, 75, 60, 50, 40, 30, 20, 10])
+    cache.edits_fingerprint.cache_clear()
+    try:
+        assert cache.EditCache.edit_key('hash', edit, (4, 5, 3)) != key
+    finally:
+        cache.edits_fingerprint.cache_clear()
+
+
+def test_memory_cache_replace():
+    memory_cache = cache.MemoryEditCache()
+    memory_cache.put_edits('key', EDITS)
+    size = memory_cache.size
+    memory_cache.put_edits('key', EDITS)
+    assert memory_cache.size == size
@@ -0,0 +1,55 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Rows of adaptive early stopping, against the rows of a full run.
+"""
+
+import collections
+
+import numpy as np
+import pytest
+
+from benchmark import durability
+from benchmark import evaluate
+from wrappers.wrapper import ImageWrapper
+
+
+class NoDecodeWrapper(ImageWrapper):
+    """
+    Never decodes, so that early stopping skips as much as it can.
+    """
+    name = "NO_DECODE"
+    payload_size = 32
+
+    def encode(self, image_bytes, payload_bits):
+        return image_bytes
+
+    def decode(self, image_bytes):
+        return None
+
+    def decode_array(self, image_bgr):
+        return None
+
+
+def edit_rows(early_stop, shape):
+    image_bgr = np.random.default_rng(0).integers(0, 256, size=shape, dtype=np.uint8)
+    payload_bits = np.zeros(NoDecodeWrapper.payload_size, dtype=bool)
+    results = evaluate.decode_image(
+        "image", image_bgr, payload_bits, NoDecodeWrapper(),
+        durability.image_edits(durability.ImageRobustnessTests.V1_FULL),
+        early_stop=early_stop,
+    )
+    return results, collections.Counter(
+        (result['edit_type'], tuple(sorted((str(k), str(v)) for k, v in result['edit_parameters'].items())))
+        for result in results
+    )
+
+
+# (at 400 x 400, the largest downscaling is skipped, and must not get an inferred row)
+@pytest.mark.parametrize('shape', [(400, 400, 3), (720, 960, 3)])
+def test_inferred_rows_match(shape):
+    full_results, full_rows = edit_rows(None, shape)
+    early_results, early_rows = edit_rows(2, shape)
+    assert any(result['inferred'] for result in early_results)
+    assert early_rows == full_rows
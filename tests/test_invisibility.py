@@ -0,0 +1,54 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Invisibility metrics computed over tiles, and with the cv2 backend, against the whole-image skimage metrics.
+"""
+
+import numpy as np
+import cv2
+import pytest
+
+from benchmark import invisibility
+from benchmark.image import utils
+
+
+# budget small enough for a 600 x 500 image to be split into several tiles of rows, for every metric
+SMALL_MAX_BYTES = 2 ** 22
+
+
+def image_pair(height: int, width: int, edit: str, seed: int=0):
+    """
+    A smooth random image, and a copy with a faint noise pattern (as a watermark would add) or JPEG compression.
+    """
+    rng = np.random.default_rng(seed)
+    image_bgr = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (7, 7), 2)
+    if edit == 'noise':
+        noise = rng.normal(0., 2., image_bgr.shape)
+        return image_bgr, np.clip(image_bgr + noise, 0, 255).astype(np.uint8)
+    return image_bgr, utils.bytes_to_bgr(utils.bgr_to_bytes(image_bgr, jpeg_quality=70))
+
+
+@pytest.mark.parametrize('backend', list(invisibility.MetricsBackend))
+@pytest.mark.parametrize('edit', ['noise', 'jpeg'])
+def test_tiled_metrics(backend, edit):
+    image_a_bgr, image_b_bgr = image_pair(600, 500, edit)
+    for bytes_per_pixel in (invisibility.PSNR_BYTES_PER_PIXEL, invisibility.SSIM_BYTES_PER_PIXEL):
+        tile_rows = utils.get_tile_rows(image_a_bgr.shape, bytes_per_pixel, 0, SMALL_MAX_BYTES)
+        assert tile_rows is not None and tile_rows < image_a_bgr.shape[0]
+
+    whole = invisibility.assess_image(image_a_bgr, image_b_bgr, max_bytes=None, backend=backend)
+    tiled = invisibility.assess_image(image_a_bgr, image_b_bgr, max_bytes=SMALL_MAX_BYTES, backend=backend)
+    assert tiled['psnr'] == pytest.approx(whole['psnr'], rel=1e-12)
+    assert tiled['ssim'] == pytest.approx(whole['ssim'], rel=1e-6)
+    assert tiled['pcpa'] == pytest.approx(whole['pcpa'], rel=1e-5)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('edit', ['noise', 'jpeg'])
+def test_cv2_backend(seed, edit):
+    image_a_bgr, image_b_bgr = image_pair(240 + 37 * seed, 320 - 29 * seed, edit, seed)
+    reference = invisibility.assess_psnr_ssim(image_a_bgr, image_b_bgr, backend=invisibility.MetricsBackend.SKIMAGE)
+    assessment = invisibility.assess_psnr_ssim(image_a_bgr, image_b_bgr, backend=invisibility.MetricsBackend.CV2)
+    assert assessment['psnr'] == pytest.approx(reference['psnr'], abs=1e-6)
+    assert assessment['ssim'] == pytest.approx(reference['ssim'], abs=1e-6)
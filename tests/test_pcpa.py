@@ -0,0 +1,94 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Equivalence of the float32 stacked-channel PCPA with the original float64 implementation.
+"""
+
+import numpy as np
+import cv2
+import pytest
+
+from benchmark.image import pcpa
+from benchmark.image import utils
+
+
+# frozen copy of the original float64 implementation (per-channel blurs), as the reference
+
+def reference_bgr_to_ycc(image_bgr: np.ndarray) -> np.ndarray:
+    offset = np.asarray([0., 128., 128.])[None, None, :]
+    return np.dot(image_bgr, np.asarray([
+        [+0.114, +0.587, +0.299],
+        [+0.500, -0.331264, -0.168736],
+        [-0.081312, -0.418688, +0.500],
+    ]).T) + offset
+
+
+def reference_pcpa_channel(grid_a: np.ndarray, grid_b: np.ndarray, is_color: bool) -> np.ndarray:
+    blend_size = 6 if is_color else 2
+    base_range = 2. if is_color else 6.
+    window_size = 16
+
+    diff = grid_a - grid_b
+    diff = pcpa.blur(diff - 0.9 * pcpa.blur(diff, window_size), blend_size)
+
+    sig_a = grid_a - pcpa.blur(grid_a, blend_size)
+    sig_b = grid_b - pcpa.blur(grid_b, blend_size)
+    sig_a = pcpa.blur(sig_a * sig_a, window_size)
+    sig_b = pcpa.blur(sig_b * sig_b, window_size)
+
+    return diff * diff / (base_range * base_range + sig_a + sig_b)
+
+
+def reference_pcpa_single(image_a_bgr: np.ndarray, image_b_bgr: np.ndarray) -> float:
+    ycc_a, ycc_b = reference_bgr_to_ycc(image_a_bgr), reference_bgr_to_ycc(image_b_bgr)
+    pcp = (
+        reference_pcpa_channel(ycc_a[:, :, 0], ycc_b[:, :, 0], is_color=False)
+        + reference_pcpa_channel(ycc_a[:, :, 1], ycc_b[:, :, 1], is_color=True)
+        + reference_pcpa_channel(ycc_a[:, :, 2], ycc_b[:, :, 2], is_color=True)
+    )
+    return np.mean(np.power(pcp, 1.5))
+
+
+def reference_pcpa(image_a_bgr: np.ndarray, image_b_bgr: np.ndarray) -> float:
+    pcpa_a = reference_pcpa_single(image_a_bgr, image_b_bgr)
+    pcpa_b = reference_pcpa_single(
+        utils.resize_frame(image_a_bgr, pcpa.FIXED_SIZE, pcpa.FIXED_SIZE),
+        utils.resize_frame(image_b_bgr, pcpa.FIXED_SIZE, pcpa.FIXED_SIZE),
+    )
+    value = np.sqrt(pcpa_a) * 0.5 + np.sqrt(pcpa_b) * 0.5
+    value = np.log2(1. / (pcpa.EPS + value))
+    value = np.clip(np.abs(value) * value / (pcpa.CCC + value * value), 0., None)
+    return value * 100. / pcpa.MAX_PCPA
+
+
+def image_pair(height: int, width: int, edit: str, seed: int=0):
+    """
+    A smooth random image, and a copy with a faint noise pattern (as a watermark would add) or JPEG compression.
+    """
+    rng = np.random.default_rng(seed)
+    image_bgr = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (7, 7), 2)
+    if edit == 'noise':
+        noise = rng.normal(0., 2., image_bgr.shape)
+        return image_bgr, np.clip(image_bgr + noise, 0, 255).astype(np.uint8)
+    return image_bgr, utils.bytes_to_bgr(utils.bgr_to_bytes(image_bgr, jpeg_quality=70))
+
+
+@pytest.mark.parametrize('shape', [(300, 400), (512, 512), (700, 333)])
+@pytest.mark.parametrize('edit', ['noise', 'jpeg'])
+def test_calc_pcpa(shape, edit):
+    image_a_bgr, image_b_bgr = image_pair(*shape, edit)
+    assert pcpa.calc_pcpa(image_a_bgr, image_b_bgr) == pytest.approx(reference_pcpa(image_a_bgr, image_b_bgr), rel=1e-6)
+
+
+def test_calc_pcpa_batch():
+    pairs = [image_pair(300, 400, 'noise', seed) for seed in range(3)] + [image_pair(256, 320, 'jpeg')]
+    expected = [reference_pcpa(image_a_bgr, image_b_bgr) for image_a_bgr, image_b_bgr in pairs]
+    assert pcpa.calc_pcpa_batch(pairs) == pytest.approx(expected, rel=1e-6)
+
+
+@pytest.mark.parametrize('tile_rows', [64, 100, 1000])
+def test_calc_pcp_tiled(tile_rows):
+    image_a_bgr, image_b_bgr = image_pair(600, 400, 'noise')
+    expected = reference_pcpa_single(image_a_bgr, image_b_bgr)
+    assert pcpa.calc_pcp_tiled(image_a_bgr, image_b_bgr, tile_rows) == pytest.approx(expected, rel=1e-6)
@@ -0,0 +1,68 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Decisions of the sequential false-positive test, and the check of its independence assumption.
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from benchmark import reliability
+from benchmark.reliability import SPRTDecision
+
+
+def run_test(rng, rate, fpr=0.01, confidence=0.95, max_trials=10 ** 5):
+    test = reliability.SequentialTest(fpr, confidence)
+    while test.decision is SPRTDecision.UNDECIDED and test.trials < max_trials:
+        test.update(1, int(rng.random() < rate))
+    return test.decision
+
+
+def test_no_positives():
+    # a stream without positives is confirmed as soon as the log-likelihood ratio crosses the lower bound
+    test = reliability.SequentialTest(1e-3, 0.95)
+    needed = math.ceil(test.lower / test.llr_negative)
+    test.update(needed - 1, 0)
+    assert test.decision is SPRTDecision.UNDECIDED
+    test.update(1, 0)
+    assert test.decision is SPRTDecision.CONFIRMED
+
+
+@pytest.mark.parametrize('rate, decision', [
+    # H0, and below it
+    (0.005, SPRTDecision.CONFIRMED),
+    (0.001, SPRTDecision.CONFIRMED),
+    # H1, and above it
+    (0.01, SPRTDecision.REFUTED),
+    (0.05, SPRTDecision.REFUTED),
+])
+def test_error_rates(rate, decision):
+    # on a Bernoulli stream, the wrong decision is taken at most 1 - confidence of the time (with some slack)
+    rng = np.random.default_rng(0)
+    decisions = [run_test(rng, rate) for _ in range(200)]
+    assert SPRTDecision.UNDECIDED not in decisions
+    assert np.mean([d is decision for d in decisions]) >= 0.9
+
+
+def test_plan_override():
+    plan = reliability.reliability_plan(reliability.ImageReliabilityTests.V1_QUICK, fpr=1e-4, confidence=0.9)
+    preset = reliability.reliability_plan(reliability.ImageReliabilityTests.V1_QUICK)
+    assert (plan.fpr, plan.confidence) == (1e-4, 0.9)
+    assert plan.max_trials == pytest.approx(preset.max_trials * 10)
+    with pytest.raises(ValueError):
+        reliability.reliability_plan(reliability.ImageReliabilityTests.V1_QUICK, fpr=0.)
+
+
+def test_independence_check():
+    rng = np.random.default_rng(0)
+    # the same false-positive rate on every image: the trials are independent
+    homogeneous = [(rng.binomial(1000, 0.01), 1000) for _ in range(50)]
+    assert reliability.positives_design_effect(homogeneous) < reliability.MAX_DESIGN_EFFECT
+    # all the positives on a few images: they are not
+    clustered = [(100 if k < 5 else 0, 1000) for k in range(50)]
+    assert reliability.positives_design_effect(clustered) > reliability.MAX_DESIGN_EFFECT
+    # no positives at all: nothing to check
+    assert reliability.positives_design_effect([(0, 1000)] * 50) == 1.
@@ -0,0 +1,64 @@
+"""
+SPDX-FileCopyrightText: © 2024 Trufo™ <engineering@trufo.ai>
+SPDX-License-Identifier: MIT
+
+Coverage of the sampling intervals, on synthetic populations whose decodes are correlated within each image.
+"""
+
+import numpy as np
+import pytest
+
+from benchmark import sampling
+
+
+DECODES = 60
+
+
+def image_results(y: int, n: int=DECODES):
+    return [
+        {'operation' : "decode", 'edit_type' : "IEEdit", 'error' : False, 'decoded' : k < y}
+        for k in range(n)
+    ]
+
+
+def sampled_run(rng, image_rate, target: sampling.SamplingTarget):
+    # (images are drawn until the target is met, as in a sampled benchmark run)
+    tracker = sampling.IntervalTracker(target)
+    while not tracker.is_met():
+        tracker.update(image_results(rng.binomial(DECODES, image_rate(rng))))
+    return tracker
+
+
+def test_coverage_correlated():
+    # each image has its own success rate (mean 2/3), so its decodes are far from independent
+    rng = np.random.default_rng(0)
+    target = sampling.SamplingTarget(half_width=0.05, confidence=0.95, min_images=20)
+    covered = []
+    for _ in range(200):
+        tracker = sampled_run(rng, lambda rng: rng.beta(2, 1), target)
+        rate, low, high = tracker.intervals()[sampling.DEC_SCORE]
+        assert (high - low) / 2 <= target.half_width
+        covered.append(low <= 2 / 3 <= high)
+    assert np.mean(covered) >= 0.9
+
+
+def test_independent_matches_wilson():
+    # with the same rate for every image, the design effect is about 1, and the interval is the Wilson interval
+    rng = np.random.default_rng(1)
+    tracker = sampling.IntervalTracker(sampling.SamplingTarget())
+    for _ in range(100):
+        tracker.update(image_results(rng.binomial(DECODES, 0.8)))
+    successes, trials = tracker.sums[sampling.DEC_SCORE][1:3]
+    _, low, high = tracker.intervals()[sampling.DEC_SCORE]
+    wilson_low, wilson_high = sampling.wilson_interval(successes, trials, tracker.z)
+    assert high - low == pytest.approx(wilson_high - wilson_low, rel=0.3)
+
+
+def test_all_or_nothing_images():
+    # images that either always or never decode are single trials: the interval is that of 100 trials, not 6000
+    tracker = sampling.IntervalTracker(sampling.SamplingTarget())
+    for k in range(100):
+        tracker.update(image_results(DECODES if k % 2 == 0 else 0))
+    rate, low, high = tracker.intervals()[sampling.DEC_SCORE]
+    assert rate == 0.5
+    assert (low, high) == pytest.approx(sampling.wilson_interval(50, 100, tracker.z), rel=0.02)
@@ -7,14 +7,13 @@ Wrapper class for the open-source invisible-watermark library.
 
 import abc
 import logging
+import importlib.util
 
 import numpy as np
 import cv2
 
 from wrappers.wrapper import ImageWrapper
 
-from imwatermark import WatermarkEncoder, WatermarkDecoder
-
 
 class RefWrapper(ImageWrapper):
     payload_size = 32
@@ -23,42 +22,71 @@ class RefWrapper(ImageWrapper):
     @abc.abstractmethod
     def name(self) -> str:
         ...
+
+    def __init__(self):
+        self.encoder = None
+        self.decoder = None
+
+    def setup(self):
+        """
+        Create the encoder/decoder once, to be reused by every call.
+        (invisible-watermark imports torch, so it is only imported here rather than with the wrapper.)
+        """
+        from imwatermark import WatermarkEncoder, WatermarkDecoder
+
+        self.encoder = WatermarkEncoder()
+        self.decoder = WatermarkDecoder('bits', self.payload_size)
+
+    def teardown(self):
+        self.encoder = None
+        self.decoder = None
     
     def encode(self, image_bytes: bytes, payload_bits: np.ndarray) -> bytes:
-        assert len(payload_bits) == self.payload_size
+        image_bgr = cv2.imdecode(np.asarray(bytearray(image_bytes)), cv2.IMREAD_COLOR)
+        enc_image_bgr = self.encode_array(image_bgr, payload_bits)
+        enc_image_bytes = cv2.imencode('.png', enc_image_bgr)[1].tobytes()
 
+        return enc_image_bytes
+    
+    def decode(self, image_bytes: bytes) -> np.ndarray:
         image_bgr = cv2.imdecode(np.asarray(bytearray(image_bytes)), cv2.IMREAD_COLOR)
+
+        return self.decode_array(image_bgr)
+
+    def encode_array(self, image_bgr: np.ndarray, payload_bits: np.ndarray) -> np.ndarray:
+        assert len(payload_bits) == self.payload_size
+
         payload_bytes = np.packbits(payload_bits).tobytes()
 
-        encoder = WatermarkEncoder()
-        encoder.set_watermark('bytes', payload_bytes)
+        if self.encoder is None:
+            self.setup()
+        self.encoder.set_watermark('bytes', payload_bytes)
         if self.mode == 'rivaGan':
             if np.prod(image_bgr.shape) > 10 ** 7:
                 raise Exception((
                     "Image size is rather large for the RivaGan watermark."
                     "If you are confident in your CPU/GPU, feel free to disable this size check."
                 ))
-            encoder.loadModel()
 
-        enc_image_bgr = encoder.encode(image_bgr, self.mode)
-        enc_image_bytes = cv2.imencode('.png', enc_image_bgr)[1].tobytes()
+        return self.encoder.encode(image_bgr, self.mode)
 
-        return enc_image_bytes
-    
-    def decode(self, image_bytes: bytes) -> np.ndarray:
-        image_bgr = cv2.imdecode(np.asarray(bytearray(image_bytes)), cv2.IMREAD_COLOR)
+    def decode_array(self, image_bgr: np.ndarray) -> np.ndarray:
+        # same as reading the image in w/ CV2 (color, contiguous)
+        if image_bgr.ndim == 2:
+            image_bgr = cv2.cvtColor(image_bgr, cv2.COLOR_GRAY2BGR)
+        image_bgr = np.ascontiguousarray(image_bgr)
 
-        decoder = WatermarkDecoder('bits', self.payload_size)
+        if self.decoder is None:
+            self.setup()
         if self.mode == 'rivaGan':
             if np.prod(image_bgr.shape) > 10 ** 7:
                 raise Exception((
                     "Image size is rather large for the RivaGan watermark."
                     "If you are confident in your CPU/GPU, feel free to disable this size check."
                 ))
-            decoder.loadModel()
             
         try:
-            payload_bits = decoder.decode(image_bgr, self.mode)
+            payload_bits = self.decoder.decode(image_bgr, self.mode)
         except:
             return None
 
@@ -77,11 +105,19 @@ class RGWrapper(RefWrapper):
     name = "REF_RIVAGAN"
     mode = 'rivaGan'
 
-    def encode(self, *args, **kwargs):
-        try:
-            import imp
-            imp.find_module('onnxruntime')
-        except ImportError:
+    def setup(self):
+        """
+        Load the RivaGan ONNX sessions (shared by the encoder and decoder), once per process.
+        """
+        if importlib.util.find_spec('onnxruntime') is None:
             logging.error("To run the RivaGan watermark from invisible-watermark, the module 'onnxruntime' is required.")
             raise Exception()
-        return super().encode(*args, **kwargs)
+        super().setup()
+        self.encoder.loadModel()
+
+    def teardown(self):
+        from imwatermark.rivaGan import RivaWatermark
+
+        RivaWatermark.encoder = None
+        RivaWatermark.decoder = None
+        super().teardown()
@@ -6,7 +6,7 @@ Image wrapper.
 """
 
 import abc
-from typing import Union
+from typing import List, Union
 
 import numpy as np
 
@@ -16,6 +16,10 @@ class ImageWrapper(abc.ABC):
     Abstract interface class for a watermark wrapper object.
     """
     TYPE = 'IMAGE'
+    # bump whenever the encoded output changes, to invalidate cached encodings
+    version = '0'
+    # whether decode has a detection stage, i.e. returns None when it finds no watermark
+    detects = False
 
     @property
     @abc.abstractmethod
@@ -34,3 +38,55 @@ class ImageWrapper(abc.ABC):
     @abc.abstractmethod
     def decode(self, image_bytes: bytes) -> Union[None, np.ndarray]:
         ...
+
+    def setup(self):
+        """
+        Optional: acquire long-lived resources (e.g. load models, open inference sessions).
+        Called once per process, before the first encode/decode; its time is reported apart from the per-call times.
+        """
+        pass
+
+    def teardown(self):
+        """
+        Optional: release the resources acquired by setup.
+        """
+        pass
+
+    def encode_array(self, image_bgr: np.ndarray, payload_bits: np.ndarray) -> np.ndarray:
+        """
+        Optional: encode a BGR image directly, without the round-trip through image bytes.
+        The input image must not be modified in place.
+        """
+        raise NotImplementedError
+
+    def decode_array(self, image_bgr: np.ndarray) -> Union[None, np.ndarray]:
+        """
+        Optional: decode a BGR image directly, without the round-trip through image bytes.
+        The image may be grayscale (2D), or a non-contiguous view.
+        """
+        raise NotImplementedError
+
+    def encode_batch(self, images: List[Union[bytes, np.ndarray]], payloads_bits: List[np.ndarray]) -> List[Union[bytes, np.ndarray]]:
+        """
+        Encode a batch of images, given as either bytes or BGR arrays (all of the same shape), with their payloads.
+        Wrappers that can run several images at once (e.g. on a GPU) should override this; by default, images are
+        encoded one at a time.
+        """
+        return [
+            self.encode_array(image, payload_bits) if isinstance(image, np.ndarray) else self.encode(image, payload_bits)
+            for image, payload_bits in zip(images, payloads_bits)
+        ]
+
+    def decode_batch(self, images: List[Union[bytes, np.ndarray]]) -> List[Union[None, np.ndarray]]:
+        """
+        Decode a batch of images, given as either bytes or BGR arrays (all of the same shape).
+        By default, images are decoded one at a time.
+        """
+        return [self.decode_array(image) if isinstance(image, np.ndarray) else self.decode(image) for image in images]
+
+    @classmethod
+    def implements(cls, method_name: str) -> bool:
+        """
+        Whether the wrapper implements (overrides) one of the optional methods.
+        """
+        return getattr(cls, method_name) is not getattr(ImageWrapper, method_name)